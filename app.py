@@ -2,37 +2,65 @@
 import os
 
 import aws_cdk as cdk
-import os
-from ipa_backup.ipa_backup_stack import IpaBackupStack
-from ipa_backup.code_repository_stack import CodeRepoStack
-from ipa_backup.pipeline_stack import Pipeline
+from ipa_backup import profiling
+from ipa_backup.stack_registry import StackRegistry
 
 app = cdk.App()
 
+# opt-in synth profiling, see ipa_backup/profiling.py
+profiling.enable_from(app)
+
 repository_name = "ipa-backup"
 
-CodeRepoStack(
-    scope=app,
-    construct_id=f"{repository_name}-code-construct",
-    env=cdk.Environment(account="832435373672", region="ap-southeast-2"),
-    repository_name=repository_name,
-)
-
-Pipeline(
-    scope=app,
-    construct_id=f"{repository_name}-pipeline-construct",
-    branch_name="master",
-    repository_name=repository_name,
-    # If you don't specify 'env', this stack will be environment-agnostic.
-    # Account/Region-dependent features and context lookups will not work,
-    # but a single synthesized template can be deployed anywhere.
-    # Uncomment the next line to specialize this stack for the AWS Account
-    # and Region that are implied by the current CLI configuration.
-    # env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
-    # Uncomment the next line if you know exactly what Account and Region you
-    # want to deploy the stack to. */
-    env=cdk.Environment(account="832435373672", region="ap-southeast-2"),
-    # For more information, see https://docs.aws.amazon.com/cdk/latest/guide/environments.html
-)
-
-app.synth()
+# the tooling account and region that hosts the repository and the pipeline. The accounts and
+# regions the backup stacks are deployed to come from the resource manifest.
+tooling_environment = cdk.Environment(account="832435373672", region="ap-southeast-2")
+
+# Each stack is built by its factory, and only when selected, see ipa_backup/stack_registry.py. The
+# imports live in the factories so a stack that isn't built isn't imported either.
+stacks = StackRegistry()
+
+
+@stacks.register(f"{repository_name}-code-construct")
+def code_repository(scope, construct_id):
+    # zips the working tree into the repository's seed, so only worth doing when this stack is wanted
+    from ipa_backup.code_repository_stack import CodeRepoStack
+
+    return CodeRepoStack(
+        scope=scope,
+        construct_id=construct_id,
+        env=tooling_environment,
+        repository_name=repository_name,
+    )
+
+
+@stacks.register(f"{repository_name}-pipeline-construct")
+def pipeline(scope, construct_id):
+    # builds a backup stack for every account and region in the manifest
+    from ipa_backup.pipeline_stack import Pipeline
+
+    return Pipeline(
+        scope=scope,
+        construct_id=construct_id,
+        branch_name="master",
+        repository_name=repository_name,
+        # If you don't specify 'env', this stack will be environment-agnostic.
+        # Account/Region-dependent features and context lookups will not work,
+        # but a single synthesized template can be deployed anywhere.
+        # Uncomment the next line to specialize this stack for the AWS Account
+        # and Region that are implied by the current CLI configuration.
+        # env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
+        # Uncomment the next line if you know exactly what Account and Region you
+        # want to deploy the stack to. */
+        env=tooling_environment,
+        # For more information, see https://docs.aws.amazon.com/cdk/latest/guide/environments.html
+    )
+
+
+# every stack, or those the ipa-backup:stacks context or IPA_BACKUP_STACKS environment variable selects
+stacks.build(app)
+
+assembly = app.synth()
+
+# writes synth-profile.json and synth-profile.folded next to cdk.out when profiling is on
+profiling.write_report(assembly)
@@ -0,0 +1,470 @@
+"""
+Keep a local SQLite catalog of the recovery points in every IPA backup vault, for fast restore lookups.
+
+The vaults of each account/region stack the pipeline deploys are found through the stack's vault
+outputs and crawled concurrently. Each vault's newest creation date is kept as a watermark, so a refresh only lists
+the recovery points created since the last one. Once a day each vault is listed in full instead, which drops the
+points deleted since, and points past their lifecycle's deletion date are pruned on every refresh:
+
+    python -m ipa_backup.catalog refresh
+    python -m ipa_backup.catalog latest arn:aws:rds:ap-southeast-2:123456789012:db:orders
+"""
+import argparse
+import datetime
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.discovery import DEFAULT_ROLE_NAME, AccountSessions
+from ipa_backup.manifest import DEFAULT_HOME_REGION, load_manifest
+
+
+# where the catalog is kept, unless --catalog says otherwise
+DEFAULT_CATALOG_PATH = ".recovery-points.sqlite"
+
+# the output every vault construct adds for its vault ARN, whose logical id starts with the vault class
+VAULT_OUTPUT_ID = "MemberAccountBackupVaultOutput"
+
+# the stacks holding the vaults are those the pipeline of app.py deploys, named after its stages, see
+# ipa_backup/pipeline_stack.py. ipa_backup/parallel_synth.py gives its stacks the same names. Stacks
+# deployed another way are named with --stack-name instead.
+DEFAULT_PIPELINE_NAME = "ipa-backup-pipeline-construct"
+DEFAULT_BRANCH_NAME = "master"
+DEFAULT_PIPELINE_ACCOUNT = "832435373672"
+
+# crawls are mostly waiting on the network, so several run at once
+DEFAULT_WORKERS = 16
+
+# a refresh relists the day before each watermark, so points still being created when the
+# last refresh ran are recorded again with their final status
+WATERMARK_OVERLAP_SECONDS = 86400
+
+# a vault is listed in full, dropping the points deleted since, when its last full listing is older than this
+FULL_LISTING_MAX_AGE_SECONDS = 86400
+
+# the statuses a recovery point can be restored from
+RESTORABLE_STATUSES = ("COMPLETED", "AVAILABLE")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recovery_points (
+    recovery_point_arn TEXT PRIMARY KEY,
+    resource_arn TEXT NOT NULL,
+    resource_type TEXT,
+    vault_arn TEXT NOT NULL,
+    vault_class TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    delete_at REAL
+);
+CREATE INDEX IF NOT EXISTS recovery_points_by_resource
+    ON recovery_points (resource_arn, created_at DESC);
+CREATE TABLE IF NOT EXISTS watermarks (
+    vault_arn TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS full_listings (
+    vault_arn TEXT PRIMARY KEY,
+    listed_at REAL NOT NULL
+);
+"""
+
+
+class CatalogVault(NamedTuple):
+    """
+    A backup vault crawled into the catalog.
+
+    :param vault_arn: The ARN of the vault.
+    :param vault_class: The class of the vault, one of silver, gold or platinum.
+    """
+
+    vault_arn: str
+    vault_class: str
+
+    @property
+    def region(self) -> str:
+        return self.vault_arn.split(":")[3]
+
+    @property
+    def account(self) -> str:
+        return self.vault_arn.split(":")[4]
+
+    @property
+    def vault_name(self) -> str:
+        return self.vault_arn.split(":")[-1]
+
+
+class RecoveryPoint(NamedTuple):
+    """
+    A recovery point as the catalog keeps it, with its dates in seconds since the epoch.
+    """
+
+    recovery_point_arn: str
+    resource_arn: str
+    resource_type: str
+    vault_arn: str
+    vault_class: str
+    created_at: float
+    status: str
+    delete_at: float = None
+
+
+def add_stack_arguments(parser: argparse.ArgumentParser) -> None:
+    # how the backup stack of each account and region is named, see backup_stack_name
+    parser.add_argument("--stack-name", help="the stack name of each {account} and {region}, rather than the pipeline's")
+    parser.add_argument("--pipeline-name", default=DEFAULT_PIPELINE_NAME, help="the stack name of the pipeline")
+    parser.add_argument("--branch-name", default=DEFAULT_BRANCH_NAME, help="the branch the pipeline deploys")
+    parser.add_argument("--pipeline-account", default=DEFAULT_PIPELINE_ACCOUNT, help="the account of the pipeline")
+
+
+def backup_stack_name(account: str, region: str, args: argparse.Namespace) -> str:
+    """
+    The name of the backup stack of an account and region: --stack-name if given, otherwise the name
+    of the stage stack the pipeline deploys there.
+
+    :param args: The parsed arguments of add_stack_arguments, and --home-region, the pipeline's region.
+    """
+    if args.stack_name:
+        return args.stack_name.format(account=account, region=region)
+    # the pipeline module imports the cdk, which only a pipeline's stack names need
+    from ipa_backup.pipeline_stack import stage_stack_name
+
+    return stage_stack_name(
+        args.pipeline_name, args.branch_name, account, region, (args.pipeline_account, args.home_region)
+    )
+
+
+def describe_stack(client, stack_name: str) -> Dict:
+    """
+    A stack as describe_stacks gives it, or None if it doesn't exist.
+
+    :param client: A CloudFormation client in the stack's account and region.
+    """
+    try:
+        (stack,) = client.describe_stacks(StackName=stack_name)["Stacks"]
+    except Exception as e:
+        error = getattr(e, "response", {}).get("Error", {})
+        if error.get("Code") == "ValidationError" and "does not exist" in error.get("Message", ""):
+            return None
+        raise
+    return stack
+
+
+def stack_vaults(client, stack_name: str) -> List[CatalogVault]:
+    """
+    The vaults of a backup stack, read from its vault outputs, or None if the stack doesn't exist.
+
+    :param client: A CloudFormation client in the stack's account and region.
+    :param stack_name: The name of the stack.
+    :type stack_name: str
+    """
+    stack = describe_stack(client, stack_name)
+    if stack is None:
+        return None
+    vaults = []
+    for output in stack.get("Outputs", ()):
+        # the output's logical id is the vault construct's id, which is its class, and the output's id
+        vault_class, found, _ = output["OutputKey"].partition(VAULT_OUTPUT_ID)
+        if found and vault_class:
+            vaults.append(CatalogVault(output["OutputValue"], vault_class))
+    return vaults
+
+
+def crawl_vault(client, vault: CatalogVault, created_after: float = None) -> List[RecoveryPoint]:
+    """
+    List the recovery points of a vault, optionally only those created after a time.
+
+    :param client: An AWS Backup client in the vault's account and region.
+    :param created_after: Seconds since the epoch. Defaults to every recovery point.
+    :type created_after: float
+    """
+    arguments = {"BackupVaultName": vault.vault_name}
+    if created_after is not None:
+        arguments["ByCreatedAfter"] = datetime.datetime.fromtimestamp(created_after, datetime.timezone.utc)
+    points = []
+    paginator = client.get_paginator("list_recovery_points_by_backup_vault")
+    for page in paginator.paginate(**arguments):
+        for point in page["RecoveryPoints"]:
+            delete_at = point.get("CalculatedLifecycle", {}).get("DeleteAt")
+            points.append(
+                RecoveryPoint(
+                    recovery_point_arn=point["RecoveryPointArn"],
+                    resource_arn=point["ResourceArn"],
+                    resource_type=point.get("ResourceType"),
+                    vault_arn=vault.vault_arn,
+                    vault_class=vault.vault_class,
+                    created_at=point["CreationDate"].timestamp(),
+                    status=point["Status"],
+                    delete_at=delete_at.timestamp() if delete_at else None,
+                )
+            )
+    return points
+
+
+class RecoveryPointCatalog:
+    """
+    The recovery points of the crawled vaults, indexed by resource ARN and creation time.
+
+    :param catalog_path: The SQLite database the catalog is kept in. ":memory:" keeps it in memory only.
+    :type catalog_path: str
+    """
+
+    def __init__(self, catalog_path: str = DEFAULT_CATALOG_PATH) -> None:
+        self.catalog_path = catalog_path
+        self._connection = sqlite3.connect(catalog_path)
+        self._connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def watermark(self, vault_arn: str) -> float:
+        # the newest creation date recorded for the vault, or None if it was never crawled
+        row = self._connection.execute(
+            "SELECT created_at FROM watermarks WHERE vault_arn = ?", (vault_arn,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def listed_at(self, vault_arn: str) -> float:
+        # when the vault was last listed in full, or None if it never was
+        row = self._connection.execute(
+            "SELECT listed_at FROM full_listings WHERE vault_arn = ?", (vault_arn,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def record(
+        self, vault: CatalogVault, points: Iterable[RecoveryPoint], listed_at: float = None
+    ) -> int:
+        """
+        Add or update a vault's recovery points and move its watermark forward, in one transaction.
+
+        :param listed_at: When the points were listed, if they are every point in the vault. The
+            vault's other points, which have been deleted since, are dropped.
+        :type listed_at: float
+        """
+        points = list(points)
+        with self._connection:
+            if listed_at is not None:
+                self._connection.execute("DELETE FROM recovery_points WHERE vault_arn = ?", (vault.vault_arn,))
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO full_listings VALUES (?, ?)", (vault.vault_arn, listed_at)
+                )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO recovery_points VALUES (?, ?, ?, ?, ?, ?, ?, ?)", points
+            )
+            if points:
+                self._connection.execute(
+                    "INSERT INTO watermarks VALUES (?, ?) ON CONFLICT (vault_arn) "
+                    "DO UPDATE SET created_at = max(created_at, excluded.created_at)",
+                    (vault.vault_arn, max(point.created_at for point in points)),
+                )
+        return len(points)
+
+    def prune(self, now: float = None) -> int:
+        """
+        Drop the recovery points whose lifecycle has deleted them, returning how many were dropped.
+
+        :param now: The time to judge expiry against, in seconds since the epoch. Defaults to now.
+        :type now: float
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp() if now is None else now
+        with self._connection:
+            return self._connection.execute(
+                "DELETE FROM recovery_points WHERE delete_at IS NOT NULL AND delete_at <= ?", (now,)
+            ).rowcount
+
+    def latest(
+        self, resource_arn: str, vault_class: str = None, now: float = None
+    ) -> RecoveryPoint:
+        """
+        The newest recovery point of a resource that can still be restored, or None.
+
+        :param resource_arn: The ARN of the backed up resource.
+        :type resource_arn: str
+        :param vault_class: Only look in the vaults of this class. Defaults to every vault.
+        :type vault_class: str
+        :param now: The time to judge expiry against, in seconds since the epoch. Defaults to now.
+        :type now: float
+        """
+        points = self.history(resource_arn, vault_class, now, limit=1)
+        return points[0] if points else None
+
+    def history(
+        self, resource_arn: str, vault_class: str = None, now: float = None, limit: int = None
+    ) -> List[RecoveryPoint]:
+        """
+        The restorable recovery points of a resource, newest first.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp() if now is None else now
+        query = (
+            "SELECT * FROM recovery_points WHERE resource_arn = ? "
+            f"AND status IN ({', '.join('?' for _ in RESTORABLE_STATUSES)}) "
+            "AND (delete_at IS NULL OR delete_at > ?)"
+        )
+        parameters = [resource_arn, *RESTORABLE_STATUSES, now]
+        if vault_class is not None:
+            query += " AND vault_class = ?"
+            parameters.append(vault_class)
+        query += " ORDER BY created_at DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [RecoveryPoint(*row) for row in self._connection.execute(query, parameters)]
+
+    def restorable(self, vault_class: str = None, now: float = None) -> List[RecoveryPoint]:
+        """
+        The newest restorable recovery point of every resource in each vault class, oldest resource ARN first.
+
+        :param vault_class: Only look in the vaults of this class. Defaults to every vault.
+        :type vault_class: str
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp() if now is None else now
+        query = (
+            "SELECT * FROM recovery_points WHERE "
+            f"status IN ({', '.join('?' for _ in RESTORABLE_STATUSES)}) "
+            "AND (delete_at IS NULL OR delete_at > ?)"
+        )
+        parameters = [*RESTORABLE_STATUSES, now]
+        if vault_class is not None:
+            query += " AND vault_class = ?"
+            parameters.append(vault_class)
+        query = (
+            "SELECT recovery_point_arn, resource_arn, resource_type, vault_arn, vault_class, "
+            "created_at, status, delete_at FROM ("
+            "SELECT *, row_number() OVER (PARTITION BY resource_arn, vault_class ORDER BY created_at DESC) "
+            f"AS newest FROM ({query})) WHERE newest = 1 ORDER BY resource_arn, vault_class"
+        )
+        return [RecoveryPoint(*row) for row in self._connection.execute(query, parameters)]
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT count(*) FROM recovery_points").fetchone()[0]
+
+
+def refresh(
+    catalog: RecoveryPointCatalog,
+    vaults: Sequence[CatalogVault],
+    client_factory: Callable,
+    workers: int = DEFAULT_WORKERS,
+    full: bool = False,
+    now: float = None,
+) -> int:
+    """
+    Crawl the vaults concurrently and record what they hold, returning how many points were recorded.
+
+    A vault never listed in full, or not for FULL_LISTING_MAX_AGE_SECONDS, is listed in full and its
+    deleted points dropped. The others only list the points since their watermark. Points whose
+    lifecycle has deleted them are pruned.
+
+    :param client_factory: Makes the boto3 client of an account, region and service, see
+        ipa_backup.discovery.AccountSessions.
+    :type client_factory: Callable
+    :param full: Relist every recovery point rather than those since each vault's watermark.
+    :type full: bool
+    :param now: The time of the refresh, in seconds since the epoch. Defaults to now.
+    :type now: float
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).timestamp() if now is None else now
+    catalog.prune(now)
+    crawls: List[Tuple[CatalogVault, float]] = []
+    for vault in vaults:
+        listed_at = catalog.listed_at(vault.vault_arn)
+        watermark = catalog.watermark(vault.vault_arn)
+        if full or listed_at is None or watermark is None or now - listed_at > FULL_LISTING_MAX_AGE_SECONDS:
+            crawls.append((vault, None))
+        else:
+            crawls.append((vault, watermark - WATERMARK_OVERLAP_SECONDS))
+
+    recorded = 0
+    if not crawls:
+        return recorded
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(crawls)))) as pool:
+        futures = {
+            pool.submit(
+                crawl_vault, client_factory(vault.account, vault.region, "backup"), vault, created_after
+            ): (vault, created_after)
+            for vault, created_after in crawls
+        }
+        # SQLite connections belong to the thread that made them, so only this thread writes
+        for future in as_completed(futures):
+            vault, created_after = futures[future]
+            recorded += catalog.record(vault, future.result(), listed_at=now if created_after is None else None)
+    return recorded
+
+
+def find_vaults(
+    targets: Sequence[Tuple[str, str]],
+    stack_name_of: Callable[[str, str], str],
+    client_factory: Callable,
+    workers: int = DEFAULT_WORKERS,
+) -> Tuple[List[CatalogVault], List[str]]:
+    """
+    The vaults of the backup stack of each account/region target, looked up concurrently.
+
+    :param stack_name_of: Gives the stack name of an account and region, see backup_stack_name.
+    :type stack_name_of: Callable[[str, str], str]
+    :param client_factory: Makes the boto3 client of an account, region and service.
+    :type client_factory: Callable
+    :return: The vaults, in target order, and the stacks that don't exist.
+    :rtype: Tuple[List[CatalogVault], List[str]]
+    """
+    if not targets:
+        return [], []
+
+    def lookup(target: Tuple[str, str]) -> List[CatalogVault]:
+        account, region = target
+        return stack_vaults(client_factory(account, region, "cloudformation"), stack_name_of(account, region))
+
+    vaults = []
+    missing = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as pool:
+        for (account, region), found in zip(targets, pool.map(lookup, targets)):
+            if found is None:
+                # not deployed yet, or deployed under another name
+                missing.append(f"{stack_name_of(account, region)} in {account}/{region}")
+            else:
+                vaults.extend(found)
+    return vaults, missing
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="the SQLite database to keep the catalog in")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    refresh_parser = commands.add_parser("refresh", help="crawl the vaults of every stack in the manifest")
+    refresh_parser.add_argument("--manifest", help="the manifest whose account/region stacks are crawled")
+    refresh_parser.add_argument("--home-region", default=DEFAULT_HOME_REGION, help="the region of the pipeline")
+    add_stack_arguments(refresh_parser)
+    refresh_parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help="the role assumed in each account")
+    refresh_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    refresh_parser.add_argument("--full", action="store_true", help="relist every recovery point")
+
+    latest_parser = commands.add_parser("latest", help="print the newest restorable recovery point of a resource")
+    latest_parser.add_argument("resource_arn")
+    latest_parser.add_argument("--vault-class", choices=("silver", "gold", "platinum"))
+    args = parser.parse_args(argv)
+
+    catalog = RecoveryPointCatalog(args.catalog)
+    try:
+        if args.command == "refresh":
+            sessions = AccountSessions(role_name=args.role_name)
+            vaults, missing = find_vaults(
+                load_manifest(args.manifest).targets(args.home_region),
+                lambda account, region: backup_stack_name(account, region, args),
+                sessions.client,
+                args.workers,
+            )
+            recorded = refresh(catalog, vaults, sessions.client, args.workers, args.full)
+            print(f"recorded {recorded} recovery points from {len(vaults)} vaults, {len(catalog)} in the catalog")
+            for stack in missing:
+                print(f"skipped {stack}, which doesn't exist")
+        else:
+            point = catalog.latest(args.resource_arn, args.vault_class)
+            if point is None:
+                raise SystemExit(f"no restorable recovery point of {args.resource_arn} in the catalog")
+            created = datetime.datetime.fromtimestamp(point.created_at, datetime.timezone.utc)
+            print(f"{point.recovery_point_arn} {point.vault_class} {created.isoformat()}")
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,41 +4,25 @@ from aws_cdk import (
     aws_s3_assets,
 )
 from constructs import Construct
-from shutil import copytree, ignore_patterns, rmtree, make_archive
-from os import path, remove
 
-
-dirname = path.dirname(__file__)
+from ipa_backup.profiling import profiled
+from ipa_backup.seed import REPOSITORY_ROOT, build_seed_archive
 
 
 class CodeRepoStack(Stack):
+    @profiled
     def __init__(
         self, scope: Construct, construct_id: str, repository_name: str, **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        # directory where all the code is stored
-        parent = path.join(dirname, "../")
-        # staging location for files to be compressed
-        build = path.join(dirname, "../build/")
-        # copy the whole file tree over except some of the following
-        copytree(
-            parent,
-            build,
-            ignore=ignore_patterns(
-                ".venv", "cdk.out", "*.zip", ".git", "*__python__", "*,pyc"
-            ),
-        )
-        # make a zip file with all the staged files
-        seed_file_path = make_archive("code-commit-repo-seed", "zip", build)
-        # then delete the staged files
-        rmtree(build)
+        # build the seed zip straight from the working tree, honouring the .gitignore. The zip is
+        # cached by a digest of its content, so an unchanged tree reuses the last one.
+        seed_file_path = build_seed_archive(root=REPOSITORY_ROOT)
         # use the zip as a artefact
         seed_artifact = aws_s3_assets.Asset(
             scope=self, id="seed-artefact", path=seed_file_path
         )
-        # then just delete the built file at the end
-        remove(seed_file_path)
         # create a new repository
         code_repo = aws_codecommit.CfnRepository(
             scope=self,  # the scope of this object
@@ -0,0 +1,190 @@
+from aws_cdk import (
+    aws_iam,
+    aws_kms,
+    App,
+    CfnElement,
+    CfnOutput,
+    Names,
+    RemovalPolicy,
+    Stack,
+)
+from constructs import Construct
+import functools
+import json
+from typing import Dict, Sequence, Tuple
+
+
+# the classes that share a key, by default every class of the stack shares one. The
+# ipa-backup:key-groups context moves classes into their own group, e.g. {"platinum": "platinum"}.
+KEY_GROUPS_CONTEXT_KEY = "ipa-backup:key-groups"
+DEFAULT_KEY_GROUP = "shared"
+
+# the id the backup key had inside the vault of its class, before the vaults shared it
+LEGACY_KEY_ID = "MemberAccountBackupKey"
+
+
+def legacy_logical_id(path: Sequence[str]) -> str:
+    """
+    The logical id CDK gives a resource at a path of construct ids under its stack.
+
+    :param path: The construct ids from the stack down to the resource.
+    :type path: Sequence[str]
+    """
+    return _legacy_logical_id(tuple(path))
+
+
+@functools.lru_cache(maxsize=None)
+def _legacy_logical_id(path: Tuple[str, ...]) -> str:
+    # worked out by CDK itself, from the same path in a scratch tree. Every stack of a class has the
+    # same paths, so the tree is only built once per path in a process
+    scope = App()
+    for construct_id in path:
+        scope = Construct(scope, construct_id)
+    return Names.unique_id(scope)
+
+
+class AccountBackupResources(Construct):
+    """
+    The backup role, its policies and the backup keys, created once per stack and shared by its vaults.
+
+    The resources are children of this construct under ids of their own, so which vault classes a
+    stack has doesn't move them. Before they were shared each vault held its own role and key, and
+    the stack's account class keeps the logical ids its vault gave them: a key's logical id moving
+    would replace the vaults it encrypts.
+
+    :param key_groups: The key group of each vault class. Classes in the same group share a key.
+    :type key_groups: Dict[str, str]
+    :param legacy_owner: The id of the vault that held the role and its class's key before they were
+        shared, whose logical ids they keep. Without it they have logical ids under this construct.
+    :type legacy_owner: str
+    """
+
+    ID = "account-backup-resources"
+
+    @classmethod
+    def of(cls, scope: Construct) -> "AccountBackupResources":
+        # the stack's single instance, created on first use
+        stack = Stack.of(scope)
+        existing = stack.node.try_find_child(cls.ID)
+        return existing if existing is not None else cls(stack, cls.ID)
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        key_groups: Dict[str, str] = None,
+        legacy_owner: str = None,
+    ) -> None:
+        super().__init__(scope, construct_id)
+        key_groups = key_groups or self.node.try_get_context(KEY_GROUPS_CONTEXT_KEY) or {}
+        if isinstance(key_groups, str):
+            # context set with -c on the command line arrives as a string
+            key_groups = json.loads(key_groups)
+        self.key_groups = dict(key_groups)
+        self.legacy_owner = legacy_owner
+        self._role: aws_iam.Role = None
+        self._keys: Dict[str, aws_kms.Key] = {}
+
+    def backup_role(self) -> aws_iam.Role:
+        """
+        The role AWS Backup assumes to back up and restore the account's resources.
+        """
+        if self._role is not None:
+            return self._role
+
+        # The role is assumed by the AWS Backup service principal, and has two managed policies for backup and restore.
+        account_backup_role = aws_iam.Role(
+            scope=self,
+            id="backup-role",
+            assumed_by=aws_iam.ServicePrincipal(service="backup.amazonaws.com"),
+            description="Alows AWS backup to access AWS services",
+            managed_policies=[
+                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                    managed_policy_name="service-role/AWSBackupServiceRolePolicyForBackup"
+                ),
+                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                    managed_policy_name="service-role/AWSBackupServiceRolePolicyForRestores"
+                ),
+                # there are additional managed policies to provide access to s3 resources
+                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                    managed_policy_name="AWSBackupServiceRolePolicyForS3Backup"
+                ),
+                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                    managed_policy_name="AWSBackupServiceRolePolicyForS3Restore"
+                ),
+                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
+                    managed_policy_name="AmazonSSMManagedInstanceCore"
+                ),
+            ],
+        )
+
+        existing_iam_role = aws_iam.Role.from_role_name(
+            scope=self,
+            id="ec2-role-for-ssm",
+            role_name="AmazonEC2RoleForSSM",
+        )
+        # add more permissions to be able to pass a service role for ssm
+        ssm_permissions_policy = aws_iam.Policy(
+            scope=self,
+            id="iam-pass-role",
+            statements=[
+                aws_iam.PolicyStatement(
+                    actions=[
+                        "iam:PassRole",
+                    ],
+                    resources=[existing_iam_role.role_arn],
+                )
+            ],
+        )
+        account_backup_role.attach_inline_policy(ssm_permissions_policy)
+
+        # Creates a new CloudFormation output for the cross-account AWS Backup role ARN.
+        # This output can be used to reference the role from other CloudFormation stacks.
+        role_output = CfnOutput(
+            scope=self,
+            id="backup-role-arn-output",
+            value=account_backup_role.role_arn,
+        )
+        self._keep_logical_id(account_backup_role.node.default_child, ["backup-role", "Resource"])
+        self._keep_logical_id(ssm_permissions_policy.node.default_child, ["iam-pass-role", "Resource"])
+        self._keep_logical_id(role_output, ["backup-role-arn-output"])
+        self._role = account_backup_role
+        return account_backup_role
+
+    def backup_key(self, class_value: str) -> aws_kms.Key:
+        """
+        The key that encrypts the vault of a class, shared with the other classes of its key group.
+
+        :param class_value: The class of the vault.
+        :type class_value: str
+        """
+        key_group = self.key_groups.get(class_value, DEFAULT_KEY_GROUP)
+        if key_group in self._keys:
+            return self._keys[key_group]
+
+        # Creates a new AWS KMS key that will be used for encrypting backups in a member account.
+        # The key is created with key rotation enabled, and a description is provided for clarity.
+        member_account_backup_key = aws_kms.Key(
+            scope=self,
+            id=f"{key_group}-backup-key",
+            description="Symmetric AWS CMK for Member account Backup Vault Encryption",
+            enable_key_rotation=True,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        # Grants the backup role permission to use the AWS KMS key for encryption and decryption.
+        account_backup_role = self.backup_role()
+        member_account_backup_key.grant_encrypt_decrypt(grantee=account_backup_role)
+        if key_group == self.key_groups.get(self.legacy_owner, DEFAULT_KEY_GROUP):
+            self._keep_logical_id(member_account_backup_key.node.default_child, [LEGACY_KEY_ID, "Resource"])
+        if not self._keys:
+            # the first grant made the role's default policy
+            default_policy = account_backup_role.node.find_child("DefaultPolicy")
+            self._keep_logical_id(default_policy.node.default_child, ["backup-role", "DefaultPolicy", "Resource"])
+        self._keys[key_group] = member_account_backup_key
+        return member_account_backup_key
+
+    def _keep_logical_id(self, element: CfnElement, legacy_path: Sequence[str]) -> None:
+        # the element keeps the logical id it had at the path under the legacy owner's vault
+        if self.legacy_owner is not None:
+            element.override_logical_id(legacy_logical_id([self.legacy_owner, *legacy_path]))
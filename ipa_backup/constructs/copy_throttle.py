@@ -0,0 +1,162 @@
+from aws_cdk import (
+    aws_backup,
+    aws_dynamodb,
+    aws_events,
+    aws_events_targets,
+    aws_iam,
+    aws_lambda,
+    Duration,
+    RemovalPolicy,
+    Stack,
+)
+from constructs import Construct
+import json
+from os import path
+from typing import Dict, List
+
+from ipa_backup.lambdas import copy_throttle
+from ipa_backup.policies import PlanPolicy
+
+
+# the handler code, deployed as its own asset
+LAMBDAS_PATH = path.join(path.dirname(path.dirname(__file__)), "lambdas")
+
+# copies are paced by the controller rather than made by the plans when this context is true, and
+# the quota of each destination region, or of all of them under "default", can be set alongside it:
+#   -c ipa-backup:copy-throttle=true -c 'ipa-backup:copy-quotas={"default": {"max_in_flight": 5}}'
+COPY_THROTTLE_CONTEXT_KEY = "ipa-backup:copy-throttle"
+COPY_QUOTAS_CONTEXT_KEY = "ipa-backup:copy-quotas"
+
+# how often queued copies are looked at when no job events arrive
+RELEASE_INTERVAL = Duration.minutes(1)
+
+
+def copies_paced(node) -> bool:
+    return str(node.try_get_context(COPY_THROTTLE_CONTEXT_KEY)).lower() == "true"
+
+
+class CopyThrottle(Construct):
+    """
+    The controller that starts the stack's disaster recovery copies within AWS Backup's quotas.
+
+    An EventBridge rule passes every backup and copy job state change to the controller function,
+    which queues a copy of each completed backup and starts queued copies through a token bucket per
+    source vault and destination region, see ipa_backup/lambdas/copy_throttle.py. A schedule starts
+    copies that were left waiting on tokens. The function runs one invocation at a time, so its
+    state in DynamoDB needs no locking.
+
+    :param quotas: The quota of each destination region, keyed by region or "default". Defaults to
+        the ipa-backup:copy-quotas context.
+    :type quotas: Dict[str, Dict]
+    """
+
+    ID = "copy-throttle"
+
+    @classmethod
+    def of(cls, scope: Construct) -> "CopyThrottle":
+        # the stack's single instance, created on first use
+        stack = Stack.of(scope)
+        existing = stack.node.try_find_child(cls.ID)
+        return existing if existing is not None else cls(stack, cls.ID)
+
+    def __init__(
+        self, scope: Construct, construct_id: str, quotas: Dict[str, Dict] = None
+    ) -> None:
+        super().__init__(scope, construct_id)
+        quotas = quotas or self.node.try_get_context(COPY_QUOTAS_CONTEXT_KEY) or {}
+        if isinstance(quotas, str):
+            # context set with -c on the command line arrives as a string
+            quotas = json.loads(quotas)
+        # fail the synth rather than the first invocation on a misspelt quota
+        for quota in quotas.values():
+            copy_throttle.Quota(**quota)
+
+        self.table = aws_dynamodb.Table(
+            scope=self,
+            id="state",
+            partition_key=aws_dynamodb.Attribute(
+                name=copy_throttle.PARTITION_KEY, type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name=copy_throttle.SORT_KEY, type=aws_dynamodb.AttributeType.STRING
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        self.function = aws_lambda.Function(
+            scope=self,
+            id="controller",
+            runtime=aws_lambda.Runtime.PYTHON_3_10,
+            handler="copy_throttle.handler",
+            code=aws_lambda.Code.from_asset(LAMBDAS_PATH, exclude=["__pycache__", "*.pyc"]),
+            timeout=Duration.minutes(1),
+            # one invocation at a time, so every event sees the state the last one saved
+            reserved_concurrent_executions=1,
+            environment={
+                copy_throttle.TABLE_NAME_VARIABLE: self.table.table_name,
+                copy_throttle.QUOTAS_VARIABLE: Stack.of(self).to_json_string(quotas),
+                copy_throttle.COPY_TARGETS_VARIABLE: "[]",
+            },
+        )
+        self.table.grant_read_write_data(self.function)
+        self.function.add_to_role_policy(
+            aws_iam.PolicyStatement(
+                actions=["backup:StartCopyJob", "backup:DescribeBackupJob", "backup:DescribeCopyJob"],
+                resources=["*"],
+            )
+        )
+
+        aws_events.Rule(
+            scope=self,
+            id="job-state-changes",
+            event_pattern=aws_events.EventPattern(
+                source=["aws.backup"],
+                detail_type=[
+                    copy_throttle.BACKUP_JOB_STATE_CHANGE,
+                    copy_throttle.COPY_JOB_STATE_CHANGE,
+                ],
+            ),
+            targets=[aws_events_targets.LambdaFunction(self.function)],
+        )
+        aws_events.Rule(
+            scope=self,
+            id="release-schedule",
+            schedule=aws_events.Schedule.rate(RELEASE_INTERVAL),
+            targets=[aws_events_targets.LambdaFunction(self.function)],
+        )
+        self._copy_targets: List[Dict] = []
+
+    def add_copies(
+        self, backup_plan: aws_backup.BackupPlan, policy: PlanPolicy, role: aws_iam.IRole
+    ) -> None:
+        """
+        Have the controller make the copies of a plan's policy, instead of the plan itself.
+
+        :param backup_plan: The plan whose recovery points are copied.
+        :type backup_plan: aws_backup.BackupPlan
+        :param policy: The policy the plan was built from, with its copy actions.
+        :type policy: PlanPolicy
+        :param role: The role the copy jobs run as.
+        :type role: aws_iam.IRole
+        """
+        if not policy.copy_actions:
+            return
+        role.grant_pass_role(self.function.grant_principal)
+        self._copy_targets.append(
+            {
+                "plan_id": backup_plan.backup_plan_id,
+                "copies": [
+                    {
+                        "destination_vault_arn": copy_action.destination_vault_arn,
+                        "iam_role_arn": role.role_arn,
+                        "delete_after_days": copy_action.delete_after_days,
+                        "move_to_cold_storage_after_days": copy_action.move_to_cold_storage_after_days,
+                    }
+                    for copy_action in policy.copy_actions
+                ],
+            }
+        )
+        # the plan ids are tokens, so the targets are a list rather than a dictionary keyed by them
+        self.function.add_environment(
+            copy_throttle.COPY_TARGETS_VARIABLE, Stack.of(self).to_json_string(self._copy_targets)
+        )
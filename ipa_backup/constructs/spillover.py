@@ -0,0 +1,80 @@
+from aws_cdk import (
+    CfnResource,
+    NestedStack,
+    Stack,
+)
+from constructs import Construct
+from typing import Dict, Tuple
+
+from ipa_backup.template_budget import (
+    RESOURCE_BYTES,
+    TemplateBudget,
+    TemplatePlanner,
+)
+
+
+class SelectionSpillover(Construct):
+    """
+    Decides which template each new backup selection goes into, one per stack.
+
+    Selections stay in the stack until its estimated template nears CloudFormation's resource
+    or byte limits. After that each spills into the nested stack its key hashes to, or the next
+    one with room, as planned by template_budget.TemplatePlanner, so a selection keeps its stack
+    when others are added or removed. The stack is measured again before every placement, so
+    resources added to it between selections are counted. The nested stacks reach the vault's
+    plans and role through the parameters the cdk passes them automatically.
+    """
+
+    ID = "selection-spillover"
+
+    @classmethod
+    def of(cls, scope: Construct) -> "SelectionSpillover":
+        # the stack's single instance, created on first use
+        stack = Stack.of(scope)
+        existing = stack.node.try_find_child(cls.ID)
+        return existing if existing is not None else cls(stack, cls.ID)
+
+    def __init__(self, scope: Construct, construct_id: str) -> None:
+        super().__init__(scope, construct_id)
+        self._stack = scope
+        self._planner: TemplatePlanner = None
+        self.nested_stacks: Dict[int, Tuple[NestedStack, TemplateBudget]] = {}
+
+    def _measure(self) -> TemplateBudget:
+        # count what the stack's own template holds besides what the planner put there, and assume
+        # an average size for it
+        resources = sum(
+            1
+            for child in self._stack.node.find_all()
+            if isinstance(child, CfnResource) and Stack.of(child) is self._stack
+        )
+        if self._planner is not None:
+            resources -= self._planner.placed.resources
+        return TemplateBudget(resources=resources, size=resources * RESOURCE_BYTES)
+
+    def scope_for(self, owner: Construct, resources: int, size: int, key: str = None) -> Construct:
+        """
+        Reserve room for new resources and return the scope to create them in.
+
+        :param owner: The construct that would normally hold the resources.
+        :type owner: Construct
+        :param resources: How many resources will be added.
+        :type resources: int
+        :param size: Their estimated size in bytes, see template_budget.selection_bytes.
+        :type size: int
+        :param key: What identifies the resources within the stack, which picks their nested stack.
+        :type key: str
+        :return: The owner itself while the stack has room, otherwise a nested stack.
+        """
+        measured = self._measure()
+        if self._planner is None:
+            self._planner = TemplatePlanner(measured)
+        else:
+            self._planner.remeasure(measured.resources, measured.size)
+        template = self._planner.place(resources, size, key)
+        if template == 0:
+            return owner
+        if template not in self.nested_stacks:
+            nested_stack = NestedStack(self, f"selections-{template}")
+            self.nested_stacks[template] = (nested_stack, self._planner.nested[template])
+        return self.nested_stacks[template][0]
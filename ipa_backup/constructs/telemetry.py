@@ -0,0 +1,184 @@
+from aws_cdk import (
+    aws_backup,
+    aws_cloudwatch,
+    aws_events,
+    aws_events_targets,
+    aws_lambda,
+    aws_lambda_event_sources,
+    aws_sqs,
+    Duration,
+    Stack,
+)
+from constructs import Construct
+import json
+from typing import Dict
+
+from ipa_backup.constructs.copy_throttle import LAMBDAS_PATH
+from ipa_backup.lambdas import backup_telemetry
+
+
+# the vaults publish job metrics, with a dashboard and alarms, when this context is true. The p95 job
+# duration each class alarms on, in minutes, can be set alongside it:
+#   -c ipa-backup:telemetry=true -c 'ipa-backup:job-duration-alarm-minutes={"gold": 120}'
+TELEMETRY_CONTEXT_KEY = "ipa-backup:telemetry"
+JOB_DURATION_ALARM_CONTEXT_KEY = "ipa-backup:job-duration-alarm-minutes"
+
+# the p95 job duration a class alarms on when the context doesn't say
+DEFAULT_JOB_DURATION_ALARM_MINUTES = 240
+
+# the function is handed up to this many events at once, or whatever arrived within the window
+BATCH_SIZE = 1_000
+BATCH_WINDOW = Duration.minutes(1)
+
+# the period the metrics are graphed and alarmed over
+METRIC_PERIOD = Duration.hours(1)
+
+
+def telemetry_enabled(node) -> bool:
+    return str(node.try_get_context(TELEMETRY_CONTEXT_KEY)).lower() == "true"
+
+
+class BackupTelemetry(Construct):
+    """
+    The pipeline that turns the stack's backup job and vault state changes into CloudWatch metrics.
+
+    An EventBridge rule puts every backup job and vault state change into an SQS queue, which hands
+    them to the telemetry function in batches. The function aggregates each batch by vault class,
+    account and resource type and logs the totals as Embedded Metric Format, see
+    ipa_backup/lambdas/backup_telemetry.py. Each vault added gets the graphs of its class on the
+    stack's dashboard and an alarm on the p95 duration of its jobs.
+
+    :param job_duration_alarm_minutes: The p95 job duration each class alarms on, by class. Defaults
+        to the ipa-backup:job-duration-alarm-minutes context.
+    :type job_duration_alarm_minutes: Dict[str, int]
+    """
+
+    ID = "backup-telemetry"
+
+    @classmethod
+    def of(cls, scope: Construct) -> "BackupTelemetry":
+        # the stack's single instance, created on first use
+        stack = Stack.of(scope)
+        existing = stack.node.try_find_child(cls.ID)
+        return existing if existing is not None else cls(stack, cls.ID)
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        job_duration_alarm_minutes: Dict[str, int] = None,
+    ) -> None:
+        super().__init__(scope, construct_id)
+        job_duration_alarm_minutes = (
+            job_duration_alarm_minutes
+            or self.node.try_get_context(JOB_DURATION_ALARM_CONTEXT_KEY)
+            or {}
+        )
+        if isinstance(job_duration_alarm_minutes, str):
+            # context set with -c on the command line arrives as a string
+            job_duration_alarm_minutes = json.loads(job_duration_alarm_minutes)
+        self.job_duration_alarm_minutes = job_duration_alarm_minutes
+
+        self.queue = aws_sqs.Queue(
+            scope=self,
+            id="events",
+            # longer than the function can run for, so a batch isn't handed out twice
+            visibility_timeout=Duration.minutes(6),
+            retention_period=Duration.days(1),
+        )
+        self.function = aws_lambda.Function(
+            scope=self,
+            id="publisher",
+            runtime=aws_lambda.Runtime.PYTHON_3_10,
+            handler="backup_telemetry.handler",
+            code=aws_lambda.Code.from_asset(LAMBDAS_PATH, exclude=["__pycache__", "*.pyc"]),
+            timeout=Duration.minutes(1),
+            environment={
+                backup_telemetry.NAMESPACE_VARIABLE: backup_telemetry.NAMESPACE,
+                backup_telemetry.VAULT_CLASSES_VARIABLE: "{}",
+            },
+        )
+        self.function.add_event_source(
+            aws_lambda_event_sources.SqsEventSource(
+                self.queue, batch_size=BATCH_SIZE, max_batching_window=BATCH_WINDOW
+            )
+        )
+        aws_events.Rule(
+            scope=self,
+            id="state-changes",
+            event_pattern=aws_events.EventPattern(
+                source=["aws.backup"],
+                detail_type=[
+                    backup_telemetry.BACKUP_JOB_STATE_CHANGE,
+                    backup_telemetry.BACKUP_VAULT_STATE_CHANGE,
+                ],
+            ),
+            targets=[aws_events_targets.SqsQueue(self.queue)],
+        )
+
+        self.dashboard = aws_cloudwatch.Dashboard(scope=self, id="dashboard")
+        self._vault_classes: Dict[str, str] = {}
+
+    def metric(self, metric_name: str, vault_class: str, statistic: str) -> aws_cloudwatch.Metric:
+        return aws_cloudwatch.Metric(
+            namespace=backup_telemetry.NAMESPACE,
+            metric_name=metric_name,
+            dimensions_map={"VaultClass": vault_class},
+            statistic=statistic,
+            period=METRIC_PERIOD,
+        )
+
+    def add_vault(self, vault: aws_backup.BackupVault, vault_class: str) -> None:
+        """
+        Publish the metrics of a vault's jobs under its class, and graph and alarm on that class.
+
+        :param vault: The vault whose job and state change events are counted.
+        :type vault: aws_backup.BackupVault
+        :param vault_class: The class the vault's metrics are published under.
+        :type vault_class: str
+        """
+        first_of_class = vault_class not in self._vault_classes.values()
+        self._vault_classes[vault.backup_vault_name] = vault_class
+        # the vault names can be tokens, so they are resolved by CloudFormation rather than here
+        self.function.add_environment(
+            backup_telemetry.VAULT_CLASSES_VARIABLE, Stack.of(self).to_json_string(self._vault_classes)
+        )
+        if not first_of_class:
+            return
+
+        p95_duration = self.metric("JobDuration", vault_class, "p95")
+        jobs = self.metric("Jobs", vault_class, "Sum")
+        failed = self.metric("JobsFailed", vault_class, "Sum")
+        alarm_minutes = self.job_duration_alarm_minutes.get(vault_class, DEFAULT_JOB_DURATION_ALARM_MINUTES)
+        aws_cloudwatch.Alarm(
+            scope=self,
+            id=f"{vault_class}-job-duration-p95",
+            alarm_description=f"The p95 duration of {vault_class} backup jobs is over {alarm_minutes} minutes",
+            metric=p95_duration,
+            threshold=alarm_minutes * 60,
+            evaluation_periods=1,
+            comparison_operator=aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+        self.dashboard.add_widgets(
+            aws_cloudwatch.GraphWidget(
+                title=f"{vault_class} job duration",
+                left=[self.metric("JobDuration", vault_class, "p50"), p95_duration],
+            ),
+            aws_cloudwatch.GraphWidget(
+                title=f"{vault_class} failure rate",
+                left=[
+                    aws_cloudwatch.MathExpression(
+                        expression="100 * failed / jobs",
+                        using_metrics={"failed": failed, "jobs": jobs},
+                        label="failed jobs (%)",
+                        period=METRIC_PERIOD,
+                    )
+                ],
+                right=[jobs],
+            ),
+            aws_cloudwatch.GraphWidget(
+                title=f"{vault_class} bytes transferred",
+                left=[self.metric("BytesTransferred", vault_class, "Sum")],
+            ),
+        )
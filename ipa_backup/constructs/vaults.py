@@ -1,16 +1,58 @@
 from aws_cdk import (
     aws_iam,
     CfnOutput,
-    aws_kms,
     aws_backup,
+    aws_events,
+    Duration,
     Tags,
     RemovalPolicy,
 )
 from constructs import Construct
-from typing import List
+from typing import Dict, List, Tuple
+
+from ipa_backup.manifest import (
+    DEFAULT_HOME_REGION,
+    FREQUENCIES,
+    Manifest,
+    load_manifest,
+    normalise_arns,
+)
+from ipa_backup.constructs.account_resources import AccountBackupResources
+from ipa_backup.constructs.spillover import SelectionSpillover
+from ipa_backup.constructs.telemetry import BackupTelemetry, telemetry_enabled
+from ipa_backup.policies import (
+    RULE_NAMES,
+    VAULT_LOCK_CHANGEABLE_DAYS,
+    VAULT_LOCK_MIN_RETENTION_DAYS,
+    PlanPolicy,
+    PolicyError,
+    class_policies,
+    max_retention_days,
+    validate_policies,
+)
+from ipa_backup.profiling import profiled
+from ipa_backup.selections import (
+    RESOURCE_TYPE_ARNS,
+    TagSelection,
+    coalesce_arns,
+    selection_name,
+    shard_arns,
+    split_continuous_arns,
+)
+from ipa_backup.schedule import BackupWindow, stock_window
+from ipa_backup.template_budget import selection_bytes
+
+
+# AWS Backup keeps continuous backups, and so the point-in-time restore window, for at most 35 days
+MAX_POINT_IN_TIME_DAYS = 35
+
+
+def _days(days: int) -> Duration:
+    return None if days is None else Duration.days(days)
 
 
 class SilverIpaVaultCustomConstruct(Construct):
+    @profiled
     def __init__(
         self,
         scope: Construct,
@@ -18,77 +60,18 @@ class SilverIpaVaultCustomConstruct(Construct):
         organization_id: str,
         vault_name: str = None,
         class_value: str = "silver",
+        backup_windows: Dict[str, BackupWindow] = None,
+        policies: Dict[str, PlanPolicy] = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        # The role is assumed by the AWS Backup service principal, and has two managed policies for backup and restore.
-        account_backup_role = aws_iam.Role(
-            scope=self,
-            id="backup-role",
-            assumed_by=aws_iam.ServicePrincipal(service="backup.amazonaws.com"),
-            description="Alows AWS backup to access AWS services",
-            managed_policies=[
-                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policy_name="service-role/AWSBackupServiceRolePolicyForBackup"
-                ),
-                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policy_name="service-role/AWSBackupServiceRolePolicyForRestores"
-                ),
-                # there are additional managed policies to provide access to s3 resources
-                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policy_name="AWSBackupServiceRolePolicyForS3Backup"
-                ),
-                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policy_name="AWSBackupServiceRolePolicyForS3Restore"
-                ),
-                aws_iam.ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policy_name="AmazonSSMManagedInstanceCore"
-                ),
-            ],
-        )
-
-        existing_iam_role = aws_iam.Role.from_role_name(
-            scope=self,
-            id="ec2-role-for-ssm",
-            role_name="AmazonEC2RoleForSSM",
-        )
-        # add more permissions to be able to pass a service role for ssm
-        ssm_permissions_policy = aws_iam.Policy(
-            scope=self,
-            id="iam-pass-role",
-            statements=[
-                aws_iam.PolicyStatement(
-                    actions=[
-                        "iam:PassRole",
-                    ],
-                    resources=[existing_iam_role.role_arn],
-                )
-            ],
-        )
-        account_backup_role.attach_inline_policy(ssm_permissions_policy)
-
-        # Creates a new CloudFormation output for the cross-account AWS Backup role ARN.
-        # This output can be used to reference the role from other CloudFormation stacks.
-        account_backup_role_output = CfnOutput(
-            scope=self,
-            id="backup-role-arn-output",
-            value=account_backup_role.role_arn,
-        )
-
-        # Creates a new AWS KMS key that will be used for encrypting backups in a member account.
-        # The key is created with key rotation enabled, and a description is provided for clarity.
-        member_account_backup_key = aws_kms.Key(
-            scope=self,
-            id="MemberAccountBackupKey",
-            description="Symmetric AWS CMK for Member account Backup Vault Encryption",
-            enable_key_rotation=True,
-            removal_policy=RemovalPolicy.DESTROY,
-        )
-
-        # Grants the specified IAM role permission to use the AWS KMS key for encryption and decryption.
-        member_account_backup_key.grant_encrypt_decrypt(grantee=account_backup_role)
-        self.account_role = account_backup_role
+        # The backup role, its policies and the KMS key are shared by every vault in the stack, see
+        # ipa_backup/constructs/account_resources.py. They are created once and every vault reuses them,
+        # unless the ipa-backup:key-groups context gives this class a key of its own.
+        account_resources = AccountBackupResources.of(self)
+        self.account_role = account_resources.backup_role()
+        member_account_backup_key = account_resources.backup_key(class_value=class_value)
 
         # Creates an AWS KMS key alias for the member account backup key.
         # The alias name is generated dynamically based on the class value,
@@ -133,6 +116,11 @@ class SilverIpaVaultCustomConstruct(Construct):
         cfn_vault = self.member_account_backup_vault.node.default_child
         cfn_vault.add_override("Properties.BackupVaultTags.Class", class_value)
 
+        # With the ipa-backup:telemetry context the vault's jobs are published as metrics of its class,
+        # with a dashboard and alarms. See ipa_backup/constructs/telemetry.py.
+        if telemetry_enabled(self.node):
+            BackupTelemetry.of(self).add_vault(self.member_account_backup_vault, class_value)
+
         # Then we add some backup plans
         self.weekly_plan = aws_backup.BackupPlan(
             scope=self,
@@ -146,22 +134,18 @@ class SilverIpaVaultCustomConstruct(Construct):
             scope=self,
             id="DailyIPABackupPlan",
         )
-        # Then we add each of the rules these generally follow the same configuration as the template
-        self.weekly_plan.add_rule(
-            aws_backup.BackupPlanRule.weekly(
-                backup_vault=self.member_account_backup_vault
-            )
-        )
-        self.monthly_plan.add_rule(
-            aws_backup.BackupPlanRule.monthly1_year(
-                backup_vault=self.member_account_backup_vault
-            )
-        )
-        self.daily_plan.add_rule(
-            aws_backup.BackupPlanRule.daily(
-                backup_vault=self.member_account_backup_vault
-            )
-        )
+        # Then we add each of the rules these generally follow the same configuration as the template.
+        # Given backup windows, see ipa_backup/schedule.py, each plan starts in its own window rather
+        # than at the preset's 05:00 UTC, so the fleet's jobs don't all start at once. The lifecycle
+        # and copies of each rule come from the class's policies, see ipa_backup/policies.py.
+        self.backup_windows = backup_windows or {}
+        self.policies = policies or class_policies(class_value)
+        errors = validate_policies(self.policies.values())
+        if errors:
+            raise PolicyError(errors, class_value)
+        self.weekly_plan.add_rule(self._plan_rule("weekly", self.backup_windows.get("weekly")))
+        self.monthly_plan.add_rule(self._plan_rule("monthly", self.backup_windows.get("monthly")))
+        self.daily_plan.add_rule(self._plan_rule("daily", self.backup_windows.get("daily")))
 
         # Adds a "Class" tag to the AWS CDK construct with the specified class value.
         # This tag can be used to identify and group related constructs in the AWS console.
@@ -180,38 +164,201 @@ class SilverIpaVaultCustomConstruct(Construct):
             value=member_account_backup_key.key_arn,
         )
 
+    def _plan_rule(
+        self, frequency: str, backup_window: BackupWindow = None
+    ) -> aws_backup.BackupPlanRule:
+        # the rule of the frequency's policy, in the given window or the preset's
+        policy = self.policies[frequency]
+        window_properties = {}
+        if backup_window is None:
+            backup_window = stock_window(frequency)
+        else:
+            window_properties = dict(
+                start_window=Duration.minutes(backup_window.start_window_minutes),
+                completion_window=Duration.minutes(backup_window.completion_window_minutes),
+            )
+        return aws_backup.BackupPlanRule(
+            rule_name=policy.rule_name,
+            backup_vault=self.member_account_backup_vault,
+            schedule_expression=aws_events.Schedule.expression(
+                backup_window.schedule_expression()
+            ),
+            delete_after=Duration.days(policy.delete_after_days),
+            move_to_cold_storage_after=_days(policy.move_to_cold_storage_after_days),
+            copy_actions=[
+                aws_backup.BackupPlanCopyActionProps(
+                    destination_backup_vault=aws_backup.BackupVault.from_backup_vault_arn(
+                        scope=self,
+                        id=f"{policy.rule_name}CopyDestination{number}",
+                        backup_vault_arn=copy_action.destination_vault_arn,
+                    ),
+                    delete_after=Duration.days(copy_action.delete_after_days),
+                    move_to_cold_storage_after=_days(
+                        copy_action.move_to_cold_storage_after_days
+                    ),
+                )
+                for number, copy_action in enumerate(policy.copy_actions)
+            ]
+            or None,
+            **window_properties,
+        )
+
+    def _add_resources_to_plan(
+        self,
+        backup_plan: aws_backup.BackupPlan,
+        frequency: str,
+        resource_arns: List[str],
+        selection_id: str,
+    ) -> List[aws_backup.BackupSelection]:
+        # Wildcards make some ARNs redundant, so drop those before the list is split into shards
+        # small enough for a single selection. A list that fits in one selection keeps the
+        # unsharded id, otherwise each shard's key is appended to it.
+        arns = coalesce_arns(normalise_arns(resource_arns, where=frequency))
+        selections = []
+        for shard_key, shard in shard_arns(arns).items():
+            scope, construct_id = self._selection_scope(
+                selection_name(frequency, selection_id, shard_key), selection_bytes(shard)
+            )
+            selections.append(
+                aws_backup.BackupSelection(
+                    scope=scope,
+                    id=construct_id,
+                    backup_plan=backup_plan,
+                    resources=[aws_backup.BackupResource.from_arn(arn) for arn in shard],
+                    role=self.account_role,
+                )
+            )
+        return selections
+
+    def _selection_scope(self, name: str, size: int) -> Tuple[Construct, str]:
+        # Selections go in this construct until the stack's template nears CloudFormation's limits,
+        # then into nested stacks. Those are shared by every vault in the stack, so ids there carry the
+        # vault's id, and that id picks the nested stack.
+        nested_id = f"{self.node.id}-{name}"
+        scope = SelectionSpillover.of(self).scope_for(self, resources=1, size=size, key=nested_id)
+        if scope is self:
+            return scope, name
+        return scope, nested_id
+
+    @profiled
     def add_resource_to_daily_plan(self, resource_arns: List[str], selection_id: str):
-        resources = [aws_backup.BackupResource.from_arn(arn) for arn in resource_arns]
-        aws_backup.BackupSelection(
-            scope=self,
-            id=f"DailyBackupSelection-{selection_id}",
-            backup_plan=self.daily_plan,
-            resources=resources,
-            role=self.account_role,
+        return self._add_resources_to_plan(
+            self.daily_plan, "daily", resource_arns, selection_id
         )
 
+    @profiled
     def add_resource_to_weekly_plan(self, resource_arns: List[str], selection_id: str):
-        resources = [aws_backup.BackupResource.from_arn(arn) for arn in resource_arns]
-        aws_backup.BackupSelection(
-            scope=self,
-            id=f"WeeklyBackupSelection-{selection_id}",
-            backup_plan=self.weekly_plan,
-            resources=resources,
-            role=self.account_role,
+        return self._add_resources_to_plan(
+            self.weekly_plan, "weekly", resource_arns, selection_id
         )
 
+    @profiled
     def add_resource_to_monthly_plan(self, resource_arns: List[str], selection_id: str):
-        resources = [aws_backup.BackupResource.from_arn(arn) for arn in resource_arns]
-        aws_backup.BackupSelection(
-            scope=self,
-            id=f"MonthlyBackupSelection-{selection_id}",
-            backup_plan=self.monthly_plan,
-            resources=resources,
+        return self._add_resources_to_plan(
+            self.monthly_plan, "monthly", resource_arns, selection_id
+        )
+
+    def add_tag_selection(
+        self,
+        frequency: str,
+        tags: Dict[str, str],
+        resource_types: List[str] = None,
+        selection_id: str = "tags",
+    ) -> aws_backup.BackupSelection:
+        """
+        Enroll resources by tag rather than by ARN, so the template doesn't grow with the fleet.
+
+        :param frequency: The plan to add the selection to, one of daily, weekly or monthly.
+        :type frequency: str
+        :param tags: The tag key/value pairs a resource must carry, all of them, to be backed up.
+        :type tags: Dict[str, str]
+        :param resource_types: The resource types to select from, for example ["EBS", "RDS"].
+            Defaults to every resource type supported by AWS Backup.
+        :type resource_types: List[str]
+        """
+        return self._add_tag_selection_to_plan(
+            TagSelection(
+                selection_id=selection_id,
+                frequency=frequency,
+                tags=tuple(sorted(tags.items())),
+                resource_types=tuple(resource_types or ()),
+            )
+        )
+
+    @profiled
+    def _add_tag_selection_to_plan(
+        self, tag_selection: TagSelection
+    ) -> aws_backup.BackupSelection:
+        if tag_selection.frequency not in FREQUENCIES:
+            raise ValueError(f"unknown frequency '{tag_selection.frequency}'")
+        unknown_types = set(tag_selection.resource_types) - set(RESOURCE_TYPE_ARNS)
+        if unknown_types:
+            raise ValueError(f"unknown resource types {', '.join(sorted(unknown_types))}")
+        backup_plan = getattr(self, f"{tag_selection.frequency}_plan")
+        scope, construct_id = self._selection_scope(
+            tag_selection.name, selection_bytes(tag_selection.resource_arns())
+        )
+        selection = aws_backup.BackupSelection(
+            scope=scope,
+            id=construct_id,
+            backup_plan=backup_plan,
+            resources=[
+                aws_backup.BackupResource.from_arn(arn)
+                for arn in tag_selection.resource_arns()
+            ],
             role=self.account_role,
         )
+        # The L2 construct only knows about ListOfTags, which matches resources carrying ANY of
+        # the tags. Conditions match resources carrying ALL of them within the selected types.
+        cfn_selection = selection.node.default_child
+        cfn_selection.add_property_override(
+            "BackupSelection.Conditions", tag_selection.conditions()
+        )
+        return selection
+
+    @profiled
+    def add_resources_from_manifest(
+        self,
+        account: str,
+        manifest: Manifest = None,
+        selection_id: str = "all",
+        region: str = None,
+        home_region: str = DEFAULT_HOME_REGION,
+    ):
+        """
+        Add every resource and tag selection the manifest lists for an account to the matching plans.
+
+        :param account: The account id to look up in the manifest.
+        :type account: str
+        :param manifest: A loaded manifest. Defaults to the manifest shipped with this package.
+        :type manifest: Manifest
+        :param region: Only add the resources that live in this region. Defaults to every region.
+        :type region: str
+        :param home_region: The region that resources without a region, such as s3 buckets, are
+            backed up from.
+        :type home_region: str
+        """
+        manifest = manifest or load_manifest()
+        for tag_selection in manifest.tag_selections(account):
+            self._add_tag_selection_to_plan(tag_selection)
+        add_to_plan = {
+            "daily": self.add_resource_to_daily_plan,
+            "weekly": self.add_resource_to_weekly_plan,
+            "monthly": self.add_resource_to_monthly_plan,
+        }
+        for frequency in FREQUENCIES:
+            resources = manifest.resources(account, frequency, region, home_region)
+            if not resources:
+                continue
+            try:
+                add_to_plan[frequency](resource_arns=resources, selection_id=selection_id)
+            except Exception as e:
+                print(f"Failed to add resources to the {frequency} plan: {e}")
+                raise e
 
 
 class GoldIpaVaultCustomConstruct(SilverIpaVaultCustomConstruct):
+    @profiled
     def __init__(
         self,
         scope: Construct,
@@ -237,10 +384,22 @@ class GoldIpaVaultCustomConstruct(SilverIpaVaultCustomConstruct):
             if isinstance(child, aws_backup.BackupVault):
                 vault = child
                 break
+        # The lock must allow the longest retention of the vault's policies, otherwise AWS Backup fails
+        # the jobs of that plan, so that is checked here rather than at the first backup.
+        lock_max_retention_days = max_retention_days(self.policies.values())
+        errors = validate_policies(self.policies.values(), lock_max_retention_days)
+        if errors:
+            raise PolicyError(errors, class_value)
         cfn_vault = vault.node.default_child
-        cfn_vault.add_override("Properties.LockConfiguration.ChangeableForDays", 14)
-        cfn_vault.add_override("Properties.LockConfiguration.MaxRetentionDays", 35)
-        cfn_vault.add_override("Properties.LockConfiguration.MinRetentionDays", 1)
+        cfn_vault.add_override(
+            "Properties.LockConfiguration.ChangeableForDays", VAULT_LOCK_CHANGEABLE_DAYS
+        )
+        cfn_vault.add_override(
+            "Properties.LockConfiguration.MaxRetentionDays", lock_max_retention_days
+        )
+        cfn_vault.add_override(
+            "Properties.LockConfiguration.MinRetentionDays", VAULT_LOCK_MIN_RETENTION_DAYS
+        )
 
         # Display a warning message about the cooling off period in red color
         print(
@@ -251,6 +410,7 @@ class GoldIpaVaultCustomConstruct(SilverIpaVaultCustomConstruct):
 
 
 class PlatinumIpaVaultCustomConstruct(GoldIpaVaultCustomConstruct):
+    @profiled
     def __init__(
         self,
         scope: Construct,
@@ -258,8 +418,14 @@ class PlatinumIpaVaultCustomConstruct(GoldIpaVaultCustomConstruct):
         organization_id: str,
         vault_name: str = None,
         class_value: str = "platinum",
+        point_in_time_days: int = MAX_POINT_IN_TIME_DAYS,
         **kwargs,
     ) -> None:
+        # checked before the vault, key and plans are built, so a bad window leaves nothing in the tree
+        if not 1 <= point_in_time_days <= MAX_POINT_IN_TIME_DAYS:
+            raise ValueError(
+                f"the point-in-time restore window must be 1 to {MAX_POINT_IN_TIME_DAYS} days, not {point_in_time_days}"
+            )
         super().__init__(
             scope,
             construct_id,
@@ -268,3 +434,52 @@ class PlatinumIpaVaultCustomConstruct(GoldIpaVaultCustomConstruct):
             class_value,
             **kwargs,
         )
+
+        # Platinum resources that AWS Backup can back up continuously, RDS databases, Aurora clusters and
+        # s3 buckets, are restored to any point in the last point_in_time_days rather than from the last
+        # daily snapshot. The continuous rule runs in the daily plan's window, where it takes the full
+        # backup the continuous one is built on.
+        daily_window = self.backup_windows.get("daily") or stock_window("daily")
+        self.continuous_plan = aws_backup.BackupPlan(
+            scope=self,
+            id="ContinuousIPABackupPlan",
+        )
+        self.continuous_plan.add_rule(
+            aws_backup.BackupPlanRule(
+                rule_name=RULE_NAMES["continuous"],
+                backup_vault=self.member_account_backup_vault,
+                enable_continuous_backup=True,
+                delete_after=Duration.days(point_in_time_days),
+                schedule_expression=aws_events.Schedule.expression(
+                    daily_window.schedule_expression()
+                ),
+                start_window=Duration.minutes(daily_window.start_window_minutes),
+                completion_window=Duration.minutes(daily_window.completion_window_minutes),
+            )
+        )
+
+    @profiled
+    def add_resource_to_continuous_plan(self, resource_arns: List[str], selection_id: str):
+        return self._add_resources_to_plan(
+            self.continuous_plan, "continuous", resource_arns, selection_id
+        )
+
+    @profiled
+    def add_resource_to_daily_plan(self, resource_arns: List[str], selection_id: str):
+        # Route each daily ARN by its service and resource type: those that support continuous backup
+        # go to the continuous plan, the rest fall back to the daily snapshot plan.
+        continuous_arns, snapshot_arns = split_continuous_arns(resource_arns)
+        selections = []
+        if continuous_arns:
+            selections += self.add_resource_to_continuous_plan(continuous_arns, selection_id)
+        if snapshot_arns:
+            selections += super().add_resource_to_daily_plan(snapshot_arns, selection_id)
+        return selections
+
+
+# the vault construct of each class, in the order they are created
+VAULT_CONSTRUCTS = {
+    "silver": SilverIpaVaultCustomConstruct,
+    "gold": GoldIpaVaultCustomConstruct,
+    "platinum": PlatinumIpaVaultCustomConstruct,
+}
@@ -0,0 +1,445 @@
+"""
+Discover the backup-eligible resources of many accounts and regions and write the resource manifest.
+
+Every RDS database and Aurora cluster, EBS volume, EFS file system, DynamoDB table and s3 bucket
+tagged with a backup frequency is listed under its account, with one scan per account, region and
+service running on a bounded thread pool. Scans are cached, so a second run only repeats the scans
+that have gone stale:
+
+    python -m ipa_backup.discovery --organization --regions ap-southeast-2 us-east-1 \\
+        --output ipa_backup/ipa_backup_stack_resources.json
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.manifest import (
+    DEFAULT_HOME_REGION,
+    FREQUENCIES,
+    TAG_SELECTIONS_KEY,
+    VAULT_CLASS_KEY,
+    arn_region,
+    parse_manifest,
+)
+
+
+# the services scanned, by the name of their boto3 client
+SERVICES = ("rds", "ec2", "efs", "dynamodb", "s3")
+
+# the tag that enrolls a resource, with one or more frequencies as its value, e.g. "daily,monthly"
+FREQUENCY_TAG_KEY = "backup-frequency"
+
+# the role assumed in each member account, which can list resources and read their tags
+DEFAULT_ROLE_NAME = "OrganizationAccountAccessRole"
+
+# scans are mostly waiting on the network, so many run at once
+DEFAULT_WORKERS = 32
+
+# how long a cached scan is reused, and how often the cache is written while a run is in progress
+DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+CACHE_FLUSH_SECONDS = 5.0
+DEFAULT_CACHE_PATH = ".discovery-cache.json"
+
+# a large org is throttled by the describe apis, so clients back off and retry rather than fail
+CLIENT_RETRIES = {"mode": "adaptive", "max_attempts": 10}
+
+
+class ScanResult(NamedTuple):
+    account: str
+    region: str
+    service: str
+    # each resource's ARN and tags
+    resources: Tuple[Tuple[str, Dict[str, str]], ...]
+
+
+def _tag_dict(tag_list: Iterable[Dict[str, str]]) -> Dict[str, str]:
+    return {tag["Key"]: tag["Value"] for tag in tag_list or ()}
+
+
+def scan_rds(client, account: str, region: str) -> List[Tuple[str, Dict[str, str]]]:
+    # Aurora instances are backed up through their cluster, so only stand-alone instances are listed
+    resources = []
+    for page in client.get_paginator("describe_db_clusters").paginate():
+        for cluster in page["DBClusters"]:
+            resources.append((cluster["DBClusterArn"], _tag_dict(cluster.get("TagList"))))
+    for page in client.get_paginator("describe_db_instances").paginate():
+        for instance in page["DBInstances"]:
+            if instance.get("DBClusterIdentifier"):
+                continue
+            resources.append((instance["DBInstanceArn"], _tag_dict(instance.get("TagList"))))
+    return resources
+
+
+def scan_ec2(client, account: str, region: str) -> List[Tuple[str, Dict[str, str]]]:
+    # only volumes are listed, an instance's volumes are backed up on their own
+    resources = []
+    for page in client.get_paginator("describe_volumes").paginate():
+        for volume in page["Volumes"]:
+            arn = f"arn:aws:ec2:{region}:{account}:volume/{volume['VolumeId']}"
+            resources.append((arn, _tag_dict(volume.get("Tags"))))
+    return resources
+
+
+def scan_efs(client, account: str, region: str) -> List[Tuple[str, Dict[str, str]]]:
+    resources = []
+    for page in client.get_paginator("describe_file_systems").paginate():
+        for file_system in page["FileSystems"]:
+            resources.append((file_system["FileSystemArn"], _tag_dict(file_system.get("Tags"))))
+    return resources
+
+
+def scan_dynamodb(client, account: str, region: str) -> List[Tuple[str, Dict[str, str]]]:
+    resources = []
+    for page in client.get_paginator("list_tables").paginate():
+        for table in page["TableNames"]:
+            arn = f"arn:aws:dynamodb:{region}:{account}:table/{table}"
+            tags = {}
+            for tag_page in client.get_paginator("list_tags_of_resource").paginate(ResourceArn=arn):
+                tags.update(_tag_dict(tag_page["Tags"]))
+            resources.append((arn, tags))
+    return resources
+
+
+def scan_s3(client, account: str, region: str) -> List[Tuple[str, Dict[str, str]]]:
+    # buckets are global, and are backed up from the home region
+    from botocore.exceptions import ClientError
+
+    resources = []
+    for bucket in client.list_buckets()["Buckets"]:
+        try:
+            tags = _tag_dict(client.get_bucket_tagging(Bucket=bucket["Name"])["TagSet"])
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchTagSet":
+                raise
+            tags = {}
+        resources.append((f"arn:aws:s3:::{bucket['Name']}", tags))
+    return resources
+
+
+SCANNERS: Dict[str, Callable] = {
+    "rds": scan_rds,
+    "ec2": scan_ec2,
+    "efs": scan_efs,
+    "dynamodb": scan_dynamodb,
+    "s3": scan_s3,
+}
+
+
+def frequencies_from_tags(tags: Dict[str, str], tag_key: str = FREQUENCY_TAG_KEY) -> Tuple[str, ...]:
+    """
+    The backup frequencies a resource's tag asks for, in manifest order. Unknown values are ignored.
+    """
+    requested = {value.strip().lower() for value in tags.get(tag_key, "").split(",")}
+    return tuple(frequency for frequency in FREQUENCIES if frequency in requested)
+
+
+class AccountSessions:
+    """
+    Make boto3 clients for member accounts, assuming the role in each account once.
+
+    Sessions aren't thread safe but clients are, so each account's session and clients are made under
+    the account's lock and then shared by every scan of that account. The role's credentials are
+    refreshed by assuming it again as they near expiry, so a scan can outlast a role session.
+
+    :param role_name: The role to assume in each account. None uses the caller's own credentials.
+    :type role_name: str
+    :param sts: The STS client that assumes the role. Defaults to one from the caller's session.
+    """
+
+    def __init__(self, role_name: str = DEFAULT_ROLE_NAME, session=None, sts=None) -> None:
+        import boto3
+
+        self.role_name = role_name
+        self._session = session or boto3.Session()
+        self._sts = sts
+        self._sessions = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._account_locks: Dict[str, threading.Lock] = {}
+
+    def session(self, account: str):
+        """
+        The boto3 session of an account, whose credentials refresh themselves. Call under the account's lock.
+        """
+        if self.role_name is None:
+            return self._session
+        if account not in self._sessions:
+            import boto3
+            import botocore.session
+            from botocore.credentials import RefreshableCredentials
+
+            with self._lock:
+                if self._sts is None:
+                    self._sts = self._session.client("sts")
+            sts = self._sts
+
+            def assume_role() -> Dict[str, str]:
+                # botocore calls this again, under its own lock, once the credentials are close to expiring
+                credentials = sts.assume_role(
+                    RoleArn=f"arn:aws:iam::{account}:role/{self.role_name}",
+                    RoleSessionName="ipa-backup-discovery",
+                )["Credentials"]
+                return {
+                    "access_key": credentials["AccessKeyId"],
+                    "secret_key": credentials["SecretAccessKey"],
+                    "token": credentials["SessionToken"],
+                    "expiry_time": credentials["Expiration"].isoformat(),
+                }
+
+            botocore_session = botocore.session.get_session()
+            botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+                metadata=assume_role(), refresh_using=assume_role, method="sts-assume-role"
+            )
+            self._sessions[account] = boto3.Session(botocore_session=botocore_session)
+        return self._sessions[account]
+
+    def client(self, account: str, region: str, service: str):
+        from botocore.config import Config
+
+        key = (account, region, service)
+        # one lock per account, so assuming the role in one account doesn't hold up the others.
+        # Without a role every account shares the caller's session, and so its lock.
+        with self._lock:
+            account_lock = self._account_locks.setdefault(account, threading.Lock())
+        if self.role_name is None:
+            account_lock = self._lock
+        with account_lock:
+            if key not in self._clients:
+                self._clients[key] = self.session(account).client(
+                    service, region_name=region, config=Config(retries=CLIENT_RETRIES)
+                )
+            return self._clients[key]
+
+    def organization_accounts(self) -> List[str]:
+        # the active accounts of the organization, listed from its management account
+        accounts = []
+        paginator = self._session.client("organizations").get_paginator("list_accounts")
+        for page in paginator.paginate():
+            accounts.extend(a["Id"] for a in page["Accounts"] if a["Status"] == "ACTIVE")
+        return sorted(accounts)
+
+
+class DiscoveryCache:
+    """
+    The scans of earlier runs, keyed by account, region and service, kept in a JSON file.
+
+    :param cache_path: The file the cache is kept in. None keeps it in memory only.
+    :type cache_path: str
+    """
+
+    def __init__(self, cache_path: str = None) -> None:
+        self.cache_path = cache_path
+        self._entries: Dict[str, Dict] = {}
+        if cache_path and path.isfile(cache_path):
+            with open(cache_path, "r") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def _key(account: str, region: str, service: str) -> str:
+        return f"{account}/{region}/{service}"
+
+    def get(self, account: str, region: str, service: str, max_age: float) -> ScanResult:
+        entry = self._entries.get(self._key(account, region, service))
+        if entry is None or time.time() - entry["scanned_at"] > max_age:
+            return None
+        return ScanResult(
+            account, region, service, tuple((arn, tags) for arn, tags in entry["resources"])
+        )
+
+    def put(self, result: ScanResult) -> None:
+        self._entries[self._key(result.account, result.region, result.service)] = {
+            "scanned_at": time.time(),
+            "resources": [list(resource) for resource in result.resources],
+        }
+
+    def save(self) -> None:
+        if not self.cache_path:
+            return
+        # written to the side and moved into place, so an interrupted run never leaves half a cache
+        partial_path = self.cache_path + ".partial"
+        with open(partial_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(partial_path, self.cache_path)
+
+
+def _scan(client_factory, account: str, region: str, service: str) -> ScanResult:
+    client = client_factory(account, region, service)
+    return ScanResult(
+        account, region, service, tuple(SCANNERS[service](client, account, region))
+    )
+
+
+def discover(
+    accounts: Sequence[str],
+    regions: Sequence[str],
+    client_factory: Callable,
+    home_region: str = DEFAULT_HOME_REGION,
+    workers: int = DEFAULT_WORKERS,
+    cache: DiscoveryCache = None,
+    max_age: float = DEFAULT_MAX_AGE_SECONDS,
+    tag_key: str = FREQUENCY_TAG_KEY,
+) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Scan every account and region, and sort the tagged resources into their backup frequencies.
+
+    :param accounts: The accounts to scan.
+    :type accounts: Sequence[str]
+    :param regions: The regions to scan in each account. s3 is only scanned in the home region.
+    :type regions: Sequence[str]
+    :param client_factory: Makes the boto3 client of an account, region and service, see AccountSessions.
+    :type client_factory: Callable
+    :param workers: How many scans run at once.
+    :type workers: int
+    :param cache: Earlier scans to reuse while they are younger than ``max_age`` seconds.
+    :type cache: DiscoveryCache
+    :return: The sorted ARNs of each frequency of each account that has tagged resources.
+    :rtype: Dict[str, Dict[str, List[str]]]
+    """
+    cache = cache or DiscoveryCache()
+    scans = [
+        (account, region, service)
+        for account in accounts
+        for region in regions
+        for service in SERVICES
+        if service != "s3" or region == home_region
+    ]
+    results = []
+    pending = []
+    for scan in scans:
+        cached = cache.get(*scan, max_age=max_age)
+        if cached is not None:
+            results.append(cached)
+        else:
+            pending.append(scan)
+
+    if pending:
+        flushed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            futures = [pool.submit(_scan, client_factory, *scan) for scan in pending]
+            try:
+                # the cache is only touched from this thread, and written every few seconds so an
+                # interrupted run keeps the scans it finished
+                for future in as_completed(futures):
+                    result = future.result()
+                    cache.put(result)
+                    results.append(result)
+                    if time.monotonic() - flushed > CACHE_FLUSH_SECONDS:
+                        cache.save()
+                        flushed = time.monotonic()
+            finally:
+                cache.save()
+
+    discovered: Dict[str, Dict[str, set]] = {}
+    for result in results:
+        for arn, tags in result.resources:
+            for frequency in frequencies_from_tags(tags, tag_key):
+                discovered.setdefault(result.account, {}).setdefault(frequency, set()).add(arn)
+    return {
+        account: {
+            frequency: sorted(frequencies[frequency])
+            for frequency in FREQUENCIES
+            if frequency in frequencies
+        }
+        for account, frequencies in sorted(discovered.items())
+    }
+
+
+def build_manifest(
+    discovered: Dict[str, Dict[str, List[str]]],
+    existing: Dict = None,
+    scanned: Iterable[Tuple[str, str]] = None,
+    home_region: str = DEFAULT_HOME_REGION,
+) -> Dict:
+    """
+    The manifest of the discovered resources, merged into the existing manifest.
+
+    Each account keeps its vault class, tag selections and wildcard ARNs, which discovery can't
+    produce. Its ARNs in the scanned regions are replaced by those discovered, and its ARNs in any
+    other region are kept, so a scan of some accounts or regions leaves the rest as they were.
+
+    :param scanned: The account/region pairs that were scanned. Defaults to those with discovered
+        resources. ARNs without a region, such as s3 buckets, belong to the home region.
+    :type scanned: Iterable[Tuple[str, str]]
+    :raises ManifestError: if the result isn't a valid manifest.
+    """
+    existing = existing or {}
+    if scanned is None:
+        scanned = {
+            (account, arn_region(arn) or home_region)
+            for account, frequencies in discovered.items()
+            for arns in frequencies.values()
+            for arn in arns
+        }
+    scanned = set(scanned)
+    manifest = {}
+    for account in sorted(set(discovered) | set(existing)):
+        previous = existing.get(account, {})
+        entry = {
+            key: previous[key] for key in (VAULT_CLASS_KEY, TAG_SELECTIONS_KEY) if key in previous
+        }
+        for frequency in FREQUENCIES:
+            arns = set(discovered.get(account, {}).get(frequency, ()))
+            arns.update(
+                arn
+                for arn in previous.get(frequency, ())
+                if "*" in arn or (account, arn_region(arn) or home_region) not in scanned
+            )
+            if arns:
+                entry[frequency] = sorted(arns)
+        if entry:
+            manifest[account] = entry
+    parse_manifest(manifest, source="discovery")
+    return manifest
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    accounts = parser.add_mutually_exclusive_group(required=True)
+    accounts.add_argument("--accounts", nargs="+", help="the accounts to scan")
+    accounts.add_argument("--organization", action="store_true", help="scan every active account of the organization")
+    parser.add_argument("--regions", nargs="+", default=[DEFAULT_HOME_REGION])
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION, help="the region s3 is scanned from")
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help="the role assumed in each account")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--tag-key", default=FREQUENCY_TAG_KEY)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="where scans are cached between runs")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE_SECONDS, help="seconds a cached scan is reused")
+    parser.add_argument("--output", required=True, help="the manifest to write, its vault classes and tag selections are kept")
+    args = parser.parse_args(argv)
+
+    sessions = AccountSessions(role_name=args.role_name)
+    account_ids = sessions.organization_accounts() if args.organization else args.accounts
+    started = time.perf_counter()
+    discovered = discover(
+        account_ids,
+        args.regions,
+        sessions.client,
+        home_region=args.home_region,
+        workers=args.workers,
+        cache=DiscoveryCache(args.cache),
+        max_age=args.max_age,
+        tag_key=args.tag_key,
+    )
+    existing = None
+    if path.isfile(args.output):
+        with open(args.output, "r") as f:
+            existing = json.load(f)
+    scanned = [(account, region) for account in account_ids for region in args.regions]
+    manifest = build_manifest(discovered, existing, scanned, args.home_region)
+    with open(args.output, "w") as f:
+        json.dump(manifest, f, indent=4)
+        f.write("\n")
+    arns = sum(len(arns) for entry in discovered.values() for arns in entry.values())
+    print(
+        f"{arns} resources in {len(discovered)} of {len(account_ids)} accounts,"
+        f" written to {args.output} in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Estimate the backup stack of every manifest account and region without synthesizing it.
+
+The selections, resources, template bytes and headroom under CloudFormation's limits are worked
+out with the same sharding and template placement the vault constructs use, from plain Python, so
+a manifest edit can be checked in well under a second rather than through a full cdk synth:
+
+    python -m ipa_backup.estimate --manifest ipa_backup/ipa_backup_stack_resources.json
+
+The estimates are of stacks synthesized without context. The resources the ipa-backup:copy-throttle,
+ipa-backup:telemetry and ipa-backup:key-groups context add, a few functions, queues, rules, alarms
+and keys in the stack's own template, aren't counted.
+"""
+import argparse
+import time
+from typing import List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.manifest import (
+    DEFAULT_HOME_REGION,
+    FREQUENCIES,
+    Manifest,
+    load_manifest,
+)
+from ipa_backup.selections import coalesce_arns, selection_name, shard_arns, split_continuous_arns
+from ipa_backup.template_budget import (
+    MAX_TEMPLATE_BYTES,
+    MAX_TEMPLATE_RESOURCES,
+    RESOURCE_BYTES,
+    TemplateBudget,
+    TemplatePlanner,
+    selection_bytes,
+)
+
+
+# measured from the templates of stacks with no selections: the resources and bytes of a stack
+# holding the vault of each class, with the shared role, policies and key
+STACK_RESOURCES = {"silver": 8, "gold": 8, "platinum": 9}
+STACK_BYTES = {"silver": 7_550, "gold": 7_620, "platinum": 8_370}
+
+# what a backup selection renders to, its fixed part and each ARN's length plus indent and quoting,
+# and each tag of a tag selection's conditions. template_budget.selection_bytes is deliberately higher.
+SELECTION_RENDERED_BYTES = 450
+ARN_RENDERED_BYTES = 10
+TAG_CONDITION_BYTES = 140
+
+# a nested template with no selections yet, and what each nested stack adds to its parent
+NESTED_TEMPLATE_RENDERED_BYTES = 600
+NESTED_STACK_RENDERED_BYTES = 1_300
+
+# the context whose resources the estimates leave out
+UNMODELLED_CONTEXT = ("ipa-backup:copy-throttle", "ipa-backup:telemetry", "ipa-backup:key-groups")
+
+
+class TemplateEstimate(NamedTuple):
+    resources: int
+    size: int
+
+    @property
+    def headroom(self) -> float:
+        # the share of the nearer of CloudFormation's two limits still free
+        return min(1 - self.resources / MAX_TEMPLATE_RESOURCES, 1 - self.size / MAX_TEMPLATE_BYTES)
+
+
+class StackEstimate(NamedTuple):
+    """
+    What the backup stack of an account and region is expected to synthesize to.
+
+    :param selections: The backup selections, by ARN and by tag.
+    :param templates: The stack's own template first, then its nested templates.
+    """
+
+    account: str
+    region: str
+    vault_class: str
+    selections: int
+    templates: Tuple[TemplateEstimate, ...]
+
+    @property
+    def resources(self) -> int:
+        return sum(template.resources for template in self.templates)
+
+    @property
+    def template_bytes(self) -> int:
+        return sum(template.size for template in self.templates)
+
+    @property
+    def nested_stacks(self) -> int:
+        return len(self.templates) - 1
+
+    @property
+    def headroom(self) -> float:
+        return min(template.headroom for template in self.templates)
+
+
+def _selection_groups(
+    manifest: Manifest, account: str, region: str, home_region: str
+) -> List[Tuple[str, Tuple[str, ...], int]]:
+    # the key, ARNs and extra rendered bytes of each selection, in the order the vault constructs add
+    # them. The key is the selection's construct id in a nested stack, prefixed with its vault's id,
+    # which is the class of the account's vault.
+    vault_class = manifest.vault_class(account)
+    groups = []
+    for tag_selection in manifest.tag_selections(account):
+        groups.append(
+            (
+                f"{vault_class}-{tag_selection.name}",
+                tag_selection.resource_arns(),
+                TAG_CONDITION_BYTES * len(tag_selection.tags),
+            )
+        )
+    for frequency in FREQUENCIES:
+        resources = manifest.resources(account, frequency, region, home_region)
+        if not resources:
+            continue
+        plans = [(frequency, resources)]
+        if vault_class == "platinum" and frequency == "daily":
+            # continuous capable resources go to the continuous plan first, see PlatinumIpaVaultCustomConstruct
+            continuous, snapshots = split_continuous_arns(resources)
+            plans = [(plan, arns) for plan, arns in (("continuous", continuous), ("daily", snapshots)) if arns]
+        for plan, arns in plans:
+            # the manifest's ARNs were validated when it was parsed, so they only need coalescing
+            arns = coalesce_arns(arns)
+            groups.extend(
+                (f"{vault_class}-{selection_name(plan, 'all', shard_key)}", tuple(shard), 0)
+                for shard_key, shard in shard_arns(arns).items()
+            )
+    return groups
+
+
+def estimate_stack(
+    manifest: Manifest, account: str, region: str = None, home_region: str = DEFAULT_HOME_REGION
+) -> StackEstimate:
+    """
+    Estimate the backup stack of one account, optionally only for one of its regions.
+
+    :param region: The region of the stack. Defaults to every region, as an environment agnostic stack.
+    :type region: str
+    """
+    vault_class = manifest.vault_class(account)
+    # the planner is given the same figures as constructs.spillover.SelectionSpillover, so it places
+    # every selection where the synth would
+    planner = TemplatePlanner(
+        TemplateBudget(
+            resources=STACK_RESOURCES[vault_class],
+            size=STACK_RESOURCES[vault_class] * RESOURCE_BYTES,
+        )
+    )
+    templates = {0: [STACK_RESOURCES[vault_class], STACK_BYTES[vault_class]]}
+    groups = _selection_groups(manifest, account, region, home_region)
+    for key, arns, extra_bytes in groups:
+        template = planner.place(1, selection_bytes(arns), key)
+        if template not in templates:
+            templates[template] = [0, NESTED_TEMPLATE_RENDERED_BYTES]
+            templates[0][0] += 1
+            templates[0][1] += NESTED_STACK_RENDERED_BYTES
+        templates[template][0] += 1
+        templates[template][1] += (
+            SELECTION_RENDERED_BYTES
+            + extra_bytes
+            + sum(map(len, arns))
+            + ARN_RENDERED_BYTES * len(arns)
+        )
+    return StackEstimate(
+        account=account,
+        region=region,
+        vault_class=vault_class,
+        selections=len(groups),
+        templates=tuple(TemplateEstimate(*templates[template]) for template in sorted(templates)),
+    )
+
+
+def estimate_manifest(
+    manifest: Manifest, home_region: str = DEFAULT_HOME_REGION
+) -> List[StackEstimate]:
+    """
+    Estimate the stack of every account/region target of the manifest, in manifest order.
+    """
+    return [
+        estimate_stack(manifest, account, region, home_region)
+        for account, region in manifest.targets(home_region)
+    ]
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--manifest", help="the manifest to estimate, defaults to the one in the package")
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION)
+    parser.add_argument("--headroom", type=float, default=0.2, help="flag stacks with less headroom than this")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    estimates = estimate_manifest(load_manifest(args.manifest), args.home_region)
+    elapsed = time.perf_counter() - started
+
+    print(f"{'account':<14}{'region':<16}{'class':<10}{'selections':>11}{'resources':>10}{'nested':>7}{'bytes':>11}{'headroom':>9}")
+    for estimate in estimates:
+        flag = "  !" if estimate.headroom < args.headroom else ""
+        print(
+            f"{estimate.account:<14}{estimate.region:<16}{estimate.vault_class:<10}"
+            f"{estimate.selections:>11}{estimate.resources:>10}{estimate.nested_stacks:>7}"
+            f"{estimate.template_bytes:>11,}{estimate.headroom:>9.0%}{flag}"
+        )
+    print(
+        f"{len(estimates)} stacks, {sum(e.resources for e in estimates):,} resources, "
+        f"{sum(e.template_bytes for e in estimates):,} template bytes, estimated in {elapsed * 1000:.0f}ms"
+        f" without the resources of {', '.join(UNMODELLED_CONTEXT)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
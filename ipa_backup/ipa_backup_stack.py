@@ -4,21 +4,26 @@ from aws_cdk import (
     CfnOutput,
     aws_s3,
     aws_dynamodb,
+    Token,
 )
 from constructs import Construct
-from typing import List
+from typing import List, Sequence
+
+from ipa_backup.constructs.account_resources import AccountBackupResources
+from ipa_backup.constructs.copy_throttle import CopyThrottle, copies_paced
+from ipa_backup.constructs.vaults import VAULT_CONSTRUCTS
+from ipa_backup.manifest import DEFAULT_HOME_REGION, load_manifest
+from ipa_backup.policies import DisasterRecovery, class_policies
+from ipa_backup.profiling import profiled
+from ipa_backup.schedule import MaintenanceEnvelope, plan_windows
 
-from ipa_backup.constructs.vaults import (
-    GoldIpaVaultCustomConstruct,
-    PlatinumIpaVaultCustomConstruct,
-    SilverIpaVaultCustomConstruct,
-)
 
-import json
-import os
+# the template metadata key holding the fingerprint of the manifest slice the stack was built from
+MANIFEST_FINGERPRINT_METADATA_KEY = "ipa-backup:manifest-fingerprint"
 
 
 class IpaBackupStack(Stack):
+    @profiled
     def __init__(
         self,
         scope: Construct,
@@ -27,6 +32,11 @@ class IpaBackupStack(Stack):
         silver_vault_name: str = None,
         gold_vault_name: str = None,
         platinum_vault_name: str = None,
+        vault_classes: Sequence[str] = None,
+        manifest_path: str = None,
+        home_region: str = DEFAULT_HOME_REGION,
+        maintenance_envelope: MaintenanceEnvelope = None,
+        disaster_recovery: DisasterRecovery = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -46,76 +56,94 @@ class IpaBackupStack(Stack):
         :param platinum_vault_name: The name of the AWS Backup platinum vault.
             Defaults to "ipa-aws-backup-vault-continuous".
         :type platinum_vault_name: str
+        :param vault_classes: The vault classes to create, out of "silver", "gold" and "platinum".
+            The class the manifest assigns to the account is always created.
+        :type vault_classes: Sequence[str]
+        :param manifest_path: The resource manifest to read the account's resources from.
+            Defaults to the ipa_backup_stack_resources.json shipped with this package.
+        :type manifest_path: str
+        :param home_region: The region that resources without a region, such as s3 buckets,
+            are backed up from. Defaults to "ap-southeast-2".
+        :type home_region: str
+        :param maintenance_envelope: The hours and days the backup plans are scheduled in. Defaults to
+            the ipa-backup:backup-window-start and -hours context, or 12:00 to 20:00 UTC.
+        :type maintenance_envelope: MaintenanceEnvelope
+        :param disaster_recovery: The region and/or account the gold and platinum plans copy their recovery
+            points to. Defaults to the ipa-backup:dr-region and ipa-backup:dr-account context, or no copies.
+        :type disaster_recovery: DisasterRecovery
         """
 
-        # Creates a new Silver IPA backup vault for the member account.
-        # This is done by instantiating a new SilverIpaVault construct with the specified parameters.
-        account_vault = SilverIpaVaultCustomConstruct(
-            scope=self,
-            construct_id="silver",
-            organization_id=organization_id,
-            vault_name=silver_vault_name,
+        # Load the resource manifest. It is parsed and validated once per process and shared by every stack,
+        # so this is a dictionary lookup after the first stack has been built.
+        manifest = load_manifest(manifest_path)
+        account = f"{self.account}"
+        account_class = manifest.vault_class(account)
+        region = None if Token.is_unresolved(self.region) else self.region
+
+        # Stamp the template with the fingerprint of the account's slice of the manifest it was built from. The
+        # pipeline only has stages for the slices changed since its last deployment, see ipa_backup/manifest_diff.py.
+        self.manifest_fingerprint = manifest.fingerprint(account, region, home_region)
+        self.template_options.metadata = {
+            MANIFEST_FINGERPRINT_METADATA_KEY: self.manifest_fingerprint
+        }
+
+        # Creates the Silver, Gold and Platinum IPA backup vaults asked for, always including the vault of
+        # the class the manifest assigns to the account. Silver is the default.
+        vault_names = {
+            "silver": silver_vault_name,
+            "gold": gold_vault_name,
+            "platinum": platinum_vault_name,
+        }
+        # Each plan gets its own backup window in the envelope, picked from the account, region, class and
+        # frequency. An environment agnostic stack has no account yet, so its stack name keeps the windows stable.
+        maintenance_envelope = maintenance_envelope or MaintenanceEnvelope.from_context(self.node)
+        schedule_key = self.stack_name if Token.is_unresolved(self.account) else account
+
+        # The lifecycle and disaster recovery copies of each class's plans, checked against AWS Backup's rules.
+        disaster_recovery = disaster_recovery or DisasterRecovery.from_context(self.node)
+
+        unknown_classes = set(vault_classes or ()) - set(VAULT_CONSTRUCTS)
+        if unknown_classes:
+            raise ValueError(f"unknown vault classes {', '.join(sorted(unknown_classes))}")
+        # With the ipa-backup:copy-throttle context the plans make no copies, and a controller makes them
+        # instead, paced to stay within AWS Backup's copy job quotas. See ipa_backup/constructs/copy_throttle.py.
+        pace_copies = copies_paced(self.node)
+        # The vaults share a backup role and keys. The account's class keeps the logical ids its vault gave
+        # them before they were shared, whichever other classes the stack has.
+        AccountBackupResources(self, AccountBackupResources.ID, legacy_owner=account_class)
+        self.vaults = {}
+        for class_value, vault_construct in VAULT_CONSTRUCTS.items():
+            if class_value != account_class and class_value not in (vault_classes or ()):
+                continue
+            policies = class_policies(class_value, disaster_recovery, self.region, account)
+            self.vaults[class_value] = vault = vault_construct(
+                scope=self,
+                construct_id=class_value,
+                organization_id=organization_id,
+                vault_name=vault_names[class_value],
+                backup_windows=plan_windows(schedule_key, class_value, maintenance_envelope, region),
+                policies={
+                    frequency: policy._replace(copy_actions=()) for frequency, policy in policies.items()
+                }
+                if pace_copies
+                else policies,
+            )
+            if pace_copies:
+                for frequency, backup_plan in (
+                    ("daily", vault.daily_plan),
+                    ("weekly", vault.weekly_plan),
+                    ("monthly", vault.monthly_plan),
+                ):
+                    if policies[frequency].copy_actions:
+                        CopyThrottle.of(self).add_copies(backup_plan, policies[frequency], vault.account_role)
+        account_vault = self.vaults[account_class]
+
+        # Add the account's daily, weekly and monthly resources to the backup plans of its vault.
+        # A stack deployed to a specific region only backs up the resources in that region.
+        account_vault.add_resources_from_manifest(
+            account=account,
+            manifest=manifest,
+            selection_id="all",
+            region=region,
+            home_region=home_region,
         )
-
-        # Creates a new Gold IPA backup vault for the member account.
-        # This is done by instantiating a new GoldIpaVault construct with the specified parameters.
-        # gold_member_account_vault = GoldIpaVaultCustomConstruct(
-        #     scope=self,
-        #     construct_id="Gold",
-        #     account_role=account_backup_role,
-        #     organization_id=organization_id,
-        #     vault_name=gold_vault_name,
-        # )
-
-        # Creates a new Platinum IPA backup vault for the member account.
-        # This is done by instantiating a new PlatinumIpaVault construct with the specified parameters.
-        # platinum_member_account_vault = PlatinumIpaVaultCustomConstruct(
-        #     scope=self,
-        #     construct_id="Platinum",
-        #     account_role=account_backup_role,
-        #     organization_id=organization_id,
-        #     vault_name=platinum_vault_name,
-        # )
-
-        # Define the directory path to the external JSON file
-        directory = "ipa_backup/ipa_backup_stack_resources.json"
-
-        # Read the resource names from the external JSON file
-        with open(os.path.join(directory), "r") as f:
-            resources = json.load(f).get(f"{self.account}", {}).get("daily", {})
-
-        # Add the resources to the silver vault's daily backup plan.
-        if resources:
-            try:
-                account_vault.add_resource_to_daily_plan(
-                    resource_arns=resources, selection_id="all"
-                )
-            except Exception as e:
-                print(f"Failed to add resources to the daily plan: {e}")
-                raise e
-
-        # Read the resource names from the external JSON file
-        with open(os.path.join(directory), "r") as f:
-            resources = json.load(f).get(f"{self.account}", {}).get("weekly", {})
-
-        if resources:
-            try:
-                account_vault.add_resource_to_weekly_plan(
-                    resource_arns=resources, selection_id="all"
-                )
-            except Exception as e:
-                print(f"Failed to add resources to the weekly plan: {e}")
-                raise e
-
-        # Read the resource names from the external JSON file
-        with open(os.path.join(directory), "r") as f:
-            resources = json.load(f).get(f"{self.account}", {}).get("monthly", {})
-
-        if resources:
-            try:
-                account_vault.add_resource_to_monthly_plan(
-                    resource_arns=resources, selection_id="all"
-                )
-            except Exception as e:
-                print(f"Failed to add resources to the monthly plan: {e}")
-                raise e
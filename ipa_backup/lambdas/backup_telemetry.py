@@ -0,0 +1,209 @@
+"""
+Turn the backup job and vault state changes of the IPA backup vaults into CloudWatch metrics.
+
+EventBridge sends each state change to an SQS queue, and the queue hands this function batches of
+them. Each batch is aggregated by vault class, account and resource type, and written to the
+function's log as Embedded Metric Format (EMF) documents, which CloudWatch turns into metrics
+without a PutMetricData call per event:
+
+    Jobs, JobsFailed        the finished backup jobs, and those of them that didn't complete
+    JobDuration             seconds from creation to completion of each finished job, as raw values
+                            so CloudWatch can work out percentiles
+    BytesTransferred        the bytes the finished jobs transferred
+    VaultStateChanges       the state changes of the vaults themselves
+
+Every metric is published with the VaultClass, AccountId and ResourceType dimensions and with
+VaultClass alone, which the dashboard and alarms use.
+
+This module is deployed on its own, so it only imports the standard library.
+"""
+import json
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+
+BACKUP_JOB_STATE_CHANGE = "Backup Job State Change"
+BACKUP_VAULT_STATE_CHANGE = "Backup Vault State Change"
+
+# the job states a job ends in, and those of them that count as a failure
+FINISHED_JOB_STATES = ("COMPLETED", "FAILED", "ABORTED", "EXPIRED", "PARTIAL")
+FAILED_JOB_STATES = ("FAILED", "ABORTED", "EXPIRED", "PARTIAL")
+
+# the environment the function is configured through, see ipa_backup/constructs/telemetry.py
+VAULT_CLASSES_VARIABLE = "VAULT_CLASSES"
+NAMESPACE_VARIABLE = "METRICS_NAMESPACE"
+
+NAMESPACE = "IpaBackup"
+DIMENSION_SETS = [["VaultClass", "AccountId", "ResourceType"], ["VaultClass"]]
+
+# an EMF document may carry at most 100 values for a metric, longer lists go in further documents
+MAX_VALUES_PER_METRIC = 100
+
+# the resource type vault state changes are counted under
+VAULT_RESOURCE_TYPE = "BackupVault"
+
+
+class MetricKey(NamedTuple):
+    vault_class: str
+    account: str
+    resource_type: str
+
+
+class MetricTotals:
+    """
+    What the events of one vault class, account and resource type in a batch add up to.
+    """
+
+    def __init__(self) -> None:
+        self.jobs = 0
+        self.failed = 0
+        self.bytes_transferred = 0
+        self.vault_state_changes = 0
+        self.durations: List[float] = []
+
+
+def _timestamp(value: str) -> float:
+    # the events carry ISO 8601 times in UTC, with a Z that fromisoformat only reads from 3.11
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class MetricBatch:
+    """
+    The totals of a batch of events, by vault class, account and resource type.
+
+    :param vault_classes: The class of each vault by vault name. Events of other vaults are ignored.
+    :type vault_classes: Dict[str, str]
+    """
+
+    def __init__(self, vault_classes: Dict[str, str]) -> None:
+        self.vault_classes = vault_classes
+        self.totals: Dict[MetricKey, MetricTotals] = {}
+        self.ignored = 0
+
+    def add(self, event: Dict) -> bool:
+        """
+        Count an EventBridge event towards the batch, returning whether it was one of the vaults' events.
+        """
+        detail = event.get("detail") or {}
+        vault_class = self.vault_classes.get(detail.get("backupVaultName"))
+        detail_type = event.get("detail-type")
+        if vault_class is None or detail_type not in (BACKUP_JOB_STATE_CHANGE, BACKUP_VAULT_STATE_CHANGE):
+            self.ignored += 1
+            return False
+        account = event.get("account") or detail.get("accountId") or "unknown"
+
+        if detail_type == BACKUP_VAULT_STATE_CHANGE:
+            self._totals(MetricKey(vault_class, account, VAULT_RESOURCE_TYPE)).vault_state_changes += 1
+            return True
+
+        state = detail.get("state")
+        if state not in FINISHED_JOB_STATES:
+            # created, running and the like, the job is counted once it ends
+            return True
+        totals = self._totals(MetricKey(vault_class, account, detail.get("resourceType") or "unknown"))
+        totals.jobs += 1
+        totals.failed += state in FAILED_JOB_STATES
+        totals.bytes_transferred += _int(detail.get("bytesTransferred") or detail.get("backupSizeInBytes"))
+        finished_at = detail.get("completionDate") or event.get("time")
+        if detail.get("creationDate") and finished_at:
+            duration = _timestamp(finished_at) - _timestamp(detail["creationDate"])
+            totals.durations.append(max(0.0, duration))
+        return True
+
+    def _totals(self, key: MetricKey) -> MetricTotals:
+        if key not in self.totals:
+            self.totals[key] = MetricTotals()
+        return self.totals[key]
+
+    def documents(self, timestamp: float, namespace: str = NAMESPACE) -> List[Dict]:
+        """
+        The EMF documents of the batch, one per key plus one for each further 100 job durations.
+
+        :param timestamp: When the metrics were observed, in seconds since the epoch.
+        :type timestamp: float
+        """
+        documents = []
+        for key, totals in self.totals.items():
+            durations = totals.durations
+            metrics = {
+                "Jobs": (totals.jobs, "Count"),
+                "JobsFailed": (totals.failed, "Count"),
+                "BytesTransferred": (totals.bytes_transferred, "Bytes"),
+                "VaultStateChanges": (totals.vault_state_changes, "Count"),
+                "JobDuration": (durations[:MAX_VALUES_PER_METRIC], "Seconds"),
+            }
+            if not durations:
+                del metrics["JobDuration"]
+            documents.append(_document(key, metrics, timestamp, namespace))
+            for start in range(MAX_VALUES_PER_METRIC, len(durations), MAX_VALUES_PER_METRIC):
+                chunk = durations[start : start + MAX_VALUES_PER_METRIC]
+                documents.append(_document(key, {"JobDuration": (chunk, "Seconds")}, timestamp, namespace))
+        return documents
+
+
+def _document(key: MetricKey, metrics: Dict[str, Tuple], timestamp: float, namespace: str) -> Dict:
+    return {
+        "_aws": {
+            "Timestamp": int(timestamp * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": DIMENSION_SETS,
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+                }
+            ],
+        },
+        "VaultClass": key.vault_class,
+        "AccountId": key.account,
+        "ResourceType": key.resource_type,
+        **{name: value for name, (value, _) in metrics.items()},
+    }
+
+
+def events_from(records: Iterable[Dict]) -> Iterable[Dict]:
+    """
+    The EventBridge events in the bodies of a batch of SQS records, skipping any that aren't JSON.
+    """
+    for record in records:
+        try:
+            yield json.loads(record["body"])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def publish(
+    records: Iterable[Dict],
+    vault_classes: Dict[str, str],
+    emit: Callable[[str], None] = print,
+    clock: Callable[[], float] = time.time,
+    namespace: str = NAMESPACE,
+) -> Dict[str, int]:
+    """
+    Aggregate a batch of SQS records and emit its EMF documents, returning how many of each there were.
+    """
+    batch = MetricBatch(vault_classes)
+    events = 0
+    for event in events_from(records):
+        batch.add(event)
+        events += 1
+    documents = batch.documents(clock(), namespace)
+    for document in documents:
+        emit(json.dumps(document, separators=(",", ":")))
+    return {"events": events, "ignored": batch.ignored, "documents": len(documents)}
+
+
+def handler(event, context):
+    return publish(
+        event.get("Records", ()),
+        vault_classes=json.loads(os.environ.get(VAULT_CLASSES_VARIABLE) or "{}"),
+        namespace=os.environ.get(NAMESPACE_VARIABLE) or NAMESPACE,
+    )
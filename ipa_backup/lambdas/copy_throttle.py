@@ -0,0 +1,399 @@
+"""
+Pace the disaster recovery copy jobs of the IPA backup vaults so they stay within AWS Backup's quotas.
+
+When copies are paced the backup plans make no copies of their own. Instead this function hears
+each completed backup job, queues a copy of its recovery point for every copy target of its plan,
+and starts queued copies as a token bucket allows, never running more at once than the quota of
+the destination region. Copies are counted per source vault and destination region, and copies
+that fail on a quota are queued again. The state is kept in a DynamoDB table and the function runs
+one invocation at a time, so each event sees the state the last one left:
+
+    {"detail-type": "Backup Job State Change", "detail": {"state": "COMPLETED", ...}}
+    {"detail-type": "Copy Job State Change", "detail": {"state": "COMPLETED", ...}}
+    {"detail-type": "Scheduled Event", ...}
+
+This module is deployed on its own, so it only imports the standard library and boto3.
+"""
+import hashlib
+import json
+import os
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, NamedTuple, Set, Tuple
+
+
+BACKUP_JOB_STATE_CHANGE = "Backup Job State Change"
+COPY_JOB_STATE_CHANGE = "Copy Job State Change"
+
+# the copy job states after which a copy no longer counts against the quota
+FINISHED_COPY_STATES = ("COMPLETED", "FAILED", "ABORTED", "PARTIAL", "EXPIRED")
+
+# a copy that fails with one of these in its status message, or is refused with one of these
+# error codes, hit a quota and is queued again rather than given up on
+QUOTA_MESSAGES = ("limit", "exceeded", "throttl")
+QUOTA_ERROR_CODES = ("LimitExceededException", "ThrottlingException")
+
+# the environment the function is configured through, see ipa_backup/constructs/copy_throttle.py
+TABLE_NAME_VARIABLE = "TABLE_NAME"
+COPY_TARGETS_VARIABLE = "COPY_TARGETS"
+QUOTAS_VARIABLE = "QUOTAS"
+
+# the key attributes of the state table. Each pacing key holds one state item and one item per queued copy.
+PARTITION_KEY = "pacing_key"
+SORT_KEY = "entry"
+STATE_ENTRY = "state"
+QUEUED_PREFIX = "queued#"
+
+# the quota used for a destination region that isn't configured
+DEFAULT_QUOTA_KEY = "default"
+
+# a copy that has been running this long without a state change event is looked up on the schedule,
+# in case its event was lost, and one running longer than any copy should is dropped from in_flight
+RECONCILE_AFTER_SECONDS = 30 * 60
+MAX_COPY_SECONDS = 7 * 24 * 60 * 60
+
+
+class Quota(NamedTuple):
+    """
+    How many copies to a destination region may run at once, and how fast new ones may start.
+
+    :param max_in_flight: The most copies running at once.
+    :type max_in_flight: int
+    :param jobs_per_minute: How fast the token bucket refills.
+    :type jobs_per_minute: float
+    :param burst: The size of the token bucket, the most copies started at once after a quiet spell.
+    :type burst: int
+    """
+
+    max_in_flight: int = 10
+    jobs_per_minute: float = 5.0
+    burst: int = 10
+
+
+class TokenBucket(NamedTuple):
+    tokens: float
+    updated_at: float
+
+    def refill(self, quota: Quota, now: float) -> "TokenBucket":
+        elapsed = max(0.0, now - self.updated_at)
+        return TokenBucket(min(float(quota.burst), self.tokens + elapsed * quota.jobs_per_minute / 60), now)
+
+    def take(self, count: int) -> "TokenBucket":
+        return self._replace(tokens=self.tokens - count)
+
+
+class CopyRequest(NamedTuple):
+    """
+    A copy of a recovery point waiting to be started, or running.
+    """
+
+    recovery_point_arn: str
+    source_vault_name: str
+    destination_vault_arn: str
+    iam_role_arn: str
+    delete_after_days: int = None
+    move_to_cold_storage_after_days: int = None
+    queued_at: float = 0.0
+    # how many times the copy was started and failed on a quota, and when it was last started
+    attempt: int = 0
+    started_at: float = None
+
+    @property
+    def destination_region(self) -> str:
+        return self.destination_vault_arn.split(":")[3]
+
+    @property
+    def pacing_key(self) -> str:
+        return pacing_key(self.source_vault_name, self.destination_region)
+
+    @property
+    def entry(self) -> str:
+        # queued entries sort by the time they were queued, so copies start in order
+        digest = hashlib.sha256(
+            f"{self.recovery_point_arn}|{self.destination_vault_arn}".encode("utf-8")
+        ).hexdigest()[:16]
+        return f"{QUEUED_PREFIX}{self.queued_at:017.6f}#{digest}"
+
+    def start_copy_job_arguments(self) -> Dict:
+        arguments = {
+            "RecoveryPointArn": self.recovery_point_arn,
+            "SourceBackupVaultName": self.source_vault_name,
+            "DestinationBackupVaultArn": self.destination_vault_arn,
+            "IamRoleArn": self.iam_role_arn,
+            # a copy started twice, e.g. when an invocation is retried, is only made once. Each
+            # attempt has a token of its own, as AWS Backup ignores a start with a token it has seen.
+            "IdempotencyToken": f"{self.entry[len(QUEUED_PREFIX):]}#{self.attempt}",
+        }
+        lifecycle = {}
+        if self.delete_after_days is not None:
+            lifecycle["DeleteAfterDays"] = self.delete_after_days
+        if self.move_to_cold_storage_after_days is not None:
+            lifecycle["MoveToColdStorageAfterDays"] = self.move_to_cold_storage_after_days
+        if lifecycle:
+            arguments["Lifecycle"] = lifecycle
+        return arguments
+
+    def retry(self) -> "CopyRequest":
+        # queued again where it was, as a new attempt
+        return self._replace(attempt=self.attempt + 1, started_at=None)
+
+
+class PacingState(NamedTuple):
+    """
+    The token bucket of a pacing key, and the copies it has running by copy job id.
+    """
+
+    bucket: TokenBucket
+    in_flight: Dict[str, CopyRequest]
+
+
+def pacing_key(source_vault_name: str, destination_region: str) -> str:
+    return f"{source_vault_name}|{destination_region}"
+
+
+def release(
+    state: PacingState, quota: Quota, queued: List[CopyRequest], now: float
+) -> Tuple[PacingState, List[CopyRequest]]:
+    """
+    The queued copies that may start now, oldest first, and the state after taking their tokens.
+
+    :param queued: The copies waiting for the pacing key, oldest first.
+    :type queued: List[CopyRequest]
+    """
+    bucket = state.bucket.refill(quota, now)
+    room = min(int(bucket.tokens), quota.max_in_flight - len(state.in_flight))
+    released = list(queued[: max(0, room)])
+    return state._replace(bucket=bucket.take(len(released))), released
+
+
+def is_quota_failure(message: str) -> bool:
+    message = (message or "").lower()
+    return any(fragment in message for fragment in QUOTA_MESSAGES)
+
+
+class DynamoStore:
+    """
+    The pacing state and queued copies, kept in the function's DynamoDB table.
+
+    :param table: A boto3 DynamoDB Table resource.
+    """
+
+    def __init__(self, table) -> None:
+        self.table = table
+
+    def state(self, key: str, quota: Quota, now: float) -> PacingState:
+        # a key seen for the first time starts with a full bucket
+        item = self.table.get_item(Key={PARTITION_KEY: key, SORT_KEY: STATE_ENTRY}).get("Item")
+        if item is None:
+            return PacingState(TokenBucket(float(quota.burst), now), {})
+        return PacingState(
+            TokenBucket(float(item["tokens"]), float(item["updated_at"])),
+            {job_id: CopyRequest(**json.loads(request)) for job_id, request in item.get("in_flight", {}).items()},
+        )
+
+    def save(self, key: str, state: PacingState) -> None:
+        self.table.put_item(
+            Item={
+                PARTITION_KEY: key,
+                SORT_KEY: STATE_ENTRY,
+                "tokens": Decimal(str(state.bucket.tokens)),
+                "updated_at": Decimal(str(state.bucket.updated_at)),
+                "in_flight": {job_id: json.dumps(request._asdict()) for job_id, request in state.in_flight.items()},
+            }
+        )
+
+    def enqueue(self, request: CopyRequest) -> None:
+        self.table.put_item(
+            Item={
+                PARTITION_KEY: request.pacing_key,
+                SORT_KEY: request.entry,
+                "request": json.dumps(request._asdict()),
+            }
+        )
+
+    def queued(self, key: str, limit: int) -> List[CopyRequest]:
+        if limit < 1:
+            return []
+        from boto3.dynamodb.conditions import Key
+
+        response = self.table.query(
+            KeyConditionExpression=Key(PARTITION_KEY).eq(key) & Key(SORT_KEY).begins_with(QUEUED_PREFIX),
+            Limit=limit,
+        )
+        return [CopyRequest(**json.loads(item["request"])) for item in response["Items"]]
+
+    def remove(self, request: CopyRequest) -> None:
+        self.table.delete_item(Key={PARTITION_KEY: request.pacing_key, SORT_KEY: request.entry})
+
+    def keys(self) -> Set[str]:
+        # the pacing keys with queued copies or copies in flight
+        from boto3.dynamodb.conditions import Attr
+
+        keys = set()
+        arguments = {
+            "FilterExpression": Attr(SORT_KEY).begins_with(QUEUED_PREFIX) | Attr("in_flight").size().gt(0),
+            "ProjectionExpression": PARTITION_KEY,
+        }
+        while True:
+            response = self.table.scan(**arguments)
+            keys.update(item[PARTITION_KEY] for item in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return keys
+            arguments["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class CopyThrottle:
+    """
+    Queue the copies of completed backups and start them within the quota of each destination region.
+
+    :param store: Where the pacing state and queued copies are kept, see DynamoStore.
+    :param client: An AWS Backup client.
+    :param copy_targets: The copies to make of each backup plan's recovery points, by plan id. Each copy
+        has a destination_vault_arn, iam_role_arn, delete_after_days and move_to_cold_storage_after_days.
+    :type copy_targets: Dict[str, List[Dict]]
+    :param quotas: The quota of each destination region, and the default quota under "default".
+    :type quotas: Dict[str, Quota]
+    """
+
+    def __init__(
+        self,
+        store,
+        client,
+        copy_targets: Dict[str, List[Dict]],
+        quotas: Dict[str, Quota] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.store = store
+        self.client = client
+        self.copy_targets = copy_targets
+        self.quotas = quotas or {}
+        self.clock = clock
+
+    def quota(self, key: str) -> Quota:
+        region = key.rsplit("|", 1)[-1]
+        return self.quotas.get(region) or self.quotas.get(DEFAULT_QUOTA_KEY) or Quota()
+
+    def handle(self, event: Dict) -> Dict[str, int]:
+        """
+        Act on an event and start whatever copies may start, returning how many started for each key.
+        """
+        detail = event.get("detail") or {}
+        detail_type = event.get("detail-type")
+        if detail_type == BACKUP_JOB_STATE_CHANGE:
+            keys = self._queue_copies(detail) if detail.get("state") == "COMPLETED" else set()
+        elif detail_type == COPY_JOB_STATE_CHANGE:
+            keys = self._finish_copy(detail) if detail.get("state") in FINISHED_COPY_STATES else set()
+        else:
+            # the schedule, which starts copies that were waiting on tokens
+            keys = self.store.keys()
+            for key in sorted(keys):
+                self._reconcile(key)
+        return {key: self._start_copies(key) for key in sorted(keys)}
+
+    def _queue_copies(self, detail: Dict) -> Set[str]:
+        plan_id = (detail.get("createdBy") or {}).get("backupPlanId")
+        recovery_point_arn = detail.get("recoveryPointArn")
+        if plan_id is None or recovery_point_arn is None:
+            # not every backup job event carries these, the job itself always does
+            job = self.client.describe_backup_job(BackupJobId=detail["backupJobId"])
+            plan_id = job.get("CreatedBy", {}).get("BackupPlanId")
+            recovery_point_arn = job.get("RecoveryPointArn")
+        keys = set()
+        for target in self.copy_targets.get(plan_id, ()):
+            request = CopyRequest(
+                recovery_point_arn=recovery_point_arn,
+                source_vault_name=detail["backupVaultName"],
+                queued_at=self.clock(),
+                **target,
+            )
+            self.store.enqueue(request)
+            keys.add(request.pacing_key)
+        return keys
+
+    def _finish_copy(self, detail: Dict) -> Set[str]:
+        source_vault_name = detail["sourceBackupVaultArn"].split(":")[-1]
+        key = pacing_key(source_vault_name, detail["destinationBackupVaultArn"].split(":")[3])
+        state = self.store.state(key, self.quota(key), self.clock())
+        request = state.in_flight.pop(detail["copyJobId"], None)
+        if request is None:
+            # a copy this function didn't start
+            return set()
+        if detail["state"] == "FAILED" and is_quota_failure(detail.get("statusMessage")):
+            # back in the queue where it was, ahead of copies queued since
+            self.store.enqueue(request.retry())
+        self.store.save(key, state)
+        return {key}
+
+    def _reconcile(self, key: str) -> None:
+        # copies whose state change events never arrived would hold their slots forever, so the schedule
+        # looks up those that have been running a while, and drops any running longer than a copy can
+        now = self.clock()
+        state = self.store.state(key, self.quota(key), now)
+        changed = False
+        for job_id, request in list(state.in_flight.items()):
+            running_for = now - (request.started_at if request.started_at is not None else request.queued_at)
+            if running_for < RECONCILE_AFTER_SECONDS:
+                continue
+            try:
+                job = self.client.describe_copy_job(CopyJobId=job_id)["CopyJob"]
+            except Exception as e:
+                if getattr(e, "response", {}).get("Error", {}).get("Code") != "ResourceNotFoundException":
+                    raise
+                job = {}
+            if job.get("State") not in FINISHED_COPY_STATES and job and running_for < MAX_COPY_SECONDS:
+                continue
+            del state.in_flight[job_id]
+            changed = True
+            if job.get("State") == "FAILED" and is_quota_failure(job.get("StatusMessage")):
+                self.store.enqueue(request.retry())
+        if changed:
+            self.store.save(key, state)
+
+    def _start_copies(self, key: str) -> int:
+        quota = self.quota(key)
+        now = self.clock()
+        state = self.store.state(key, quota, now)
+        queued = self.store.queued(key, limit=quota.max_in_flight - len(state.in_flight))
+        state, released = release(state, quota, queued, now)
+        started = 0
+        for request in released:
+            try:
+                response = self.client.start_copy_job(**request.start_copy_job_arguments())
+            except Exception as e:
+                code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                if code not in QUOTA_ERROR_CODES:
+                    raise
+                # refused on a quota: hand back the tokens of the copies not started and try next time
+                state = state._replace(bucket=state.bucket.take(started - len(released)))
+                break
+            state.in_flight[response["CopyJobId"]] = request._replace(started_at=now)
+            self.store.remove(request)
+            started += 1
+        self.store.save(key, state)
+        return started
+
+
+def _quotas_from(document: Dict[str, Dict]) -> Dict[str, Quota]:
+    return {region: Quota(**quota) for region, quota in document.items()}
+
+
+def _copy_targets_from(document: Iterable[Dict]) -> Dict[str, List[Dict]]:
+    # the plan ids are only known once deployed, so the targets arrive as a list rather than keyed by id
+    return {plan["plan_id"]: plan["copies"] for plan in document}
+
+
+_controller: CopyThrottle = None
+
+
+def handler(event, context):
+    global _controller
+    if _controller is None:
+        import boto3
+
+        _controller = CopyThrottle(
+            store=DynamoStore(boto3.resource("dynamodb").Table(os.environ[TABLE_NAME_VARIABLE])),
+            client=boto3.client("backup"),
+            copy_targets=_copy_targets_from(json.loads(os.environ[COPY_TARGETS_VARIABLE])),
+            quotas=_quotas_from(json.loads(os.environ.get(QUOTAS_VARIABLE) or "{}")),
+        )
+    return _controller.handle(event)
@@ -0,0 +1,365 @@
+import hashlib
+import json
+import re
+import threading
+from os import path, stat
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from ipa_backup.profiling import profiled
+from ipa_backup.selections import RESOURCE_TYPE_ARNS, TagSelection
+
+
+dirname = path.dirname(__file__)
+
+# the manifest that ships with the repository, resolved relative to this module rather than the cwd
+DEFAULT_MANIFEST_PATH = path.join(dirname, "ipa_backup_stack_resources.json")
+
+# the backup frequencies a manifest is allowed to declare for an account
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+# the account key that holds tag based selections rather than a frequency's ARN list
+TAG_SELECTIONS_KEY = "tag_selections"
+
+# the account key naming the vault class the account's resources are backed up in, and its choices
+VAULT_CLASS_KEY = "vault_class"
+VAULT_CLASSES = ("silver", "gold", "platinum")
+DEFAULT_VAULT_CLASS = "silver"
+
+# the region that global ARNs, such as s3 buckets, are backed up from
+DEFAULT_HOME_REGION = "ap-southeast-2"
+
+# arn:partition:service:region:account:resource - region and account may be empty (s3) or wildcards
+ARN_PATTERN = re.compile(
+    r"^arn:(aws|aws-cn|aws-us-gov):[a-z0-9-]+:([a-z0-9-]+|\*)?:(\d{12}|\*)?:\S+$"
+)
+ACCOUNT_PATTERN = re.compile(r"^\d{12}$")
+
+
+class ManifestError(ValueError):
+    """
+    Raised when the resource manifest is malformed.
+
+    :param errors: Every problem found in the manifest, so they can be fixed in one pass.
+    :type errors: List[str]
+    """
+
+    def __init__(self, errors: List[str], source: str = None) -> None:
+        self.errors = list(errors)
+        self.source = source
+        header = f"Invalid resource manifest {source}" if source else "Invalid resource manifest"
+        super().__init__(header + ":\n  " + "\n  ".join(self.errors))
+
+
+class Manifest:
+    """
+    An immutable account -> frequency -> ARN index over the resource manifest.
+
+    :param index: The validated index, see :func:`parse_manifest`.
+    :type index: Dict[str, Dict[str, Tuple[str, ...]]]
+    :param tag_selections: The validated tag selections of each account.
+    :type tag_selections: Dict[str, Tuple[TagSelection, ...]]
+    :param vault_classes: The vault class of each account that doesn't use the default.
+    :type vault_classes: Dict[str, str]
+    :param digest: The sha256 of the manifest body the index was built from.
+    :type digest: str
+    """
+
+    def __init__(
+        self,
+        index: Dict[str, Dict[str, Tuple[str, ...]]],
+        tag_selections: Dict[str, Tuple[TagSelection, ...]] = None,
+        vault_classes: Dict[str, str] = None,
+        digest: str = None,
+        source: str = None,
+    ) -> None:
+        self._index = index
+        self._tag_selections = tag_selections or {}
+        self._vault_classes = vault_classes or {}
+        self.digest = digest
+        self.source = source
+
+    @property
+    def accounts(self) -> Tuple[str, ...]:
+        return tuple(self._index)
+
+    def __contains__(self, account: str) -> bool:
+        return account in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def frequencies(self, account: str) -> Mapping[str, Tuple[str, ...]]:
+        # a read-only view, the index is shared by every stack in the process
+        return MappingProxyType(self._index.get(account, {}))
+
+    def resources(
+        self,
+        account: str,
+        frequency: str,
+        region: str = None,
+        home_region: str = DEFAULT_HOME_REGION,
+    ) -> Tuple[str, ...]:
+        """
+        The ARNs an account backs up at a frequency, optionally only those for one region.
+
+        ARNs with a wildcard region belong to every region. ARNs with no region, such as s3
+        buckets, belong to the home region only so they are not backed up twice.
+        """
+        if frequency not in FREQUENCIES:
+            raise ManifestError([f"unknown frequency '{frequency}'"], self.source)
+        arns = self._index.get(account, {}).get(frequency, ())
+        if region is None:
+            return arns
+        regions = (region, "*", "") if region == home_region else (region, "*")
+        return tuple(arn for arn in arns if arn_region(arn) in regions)
+
+    def regions(self, account: str, home_region: str = DEFAULT_HOME_REGION) -> Tuple[str, ...]:
+        """
+        The regions an account has resources in, home region first and the rest sorted.
+        """
+        regions = {
+            arn_region(arn)
+            for arns in self._index.get(account, {}).values()
+            for arn in arns
+        }
+        concrete = sorted(region for region in regions - {"", "*"} if region != home_region)
+        if home_region in regions or not concrete or regions & {"", "*"} or self.tag_selections(account):
+            return (home_region, *concrete)
+        return tuple(concrete)
+
+    def targets(self, home_region: str = DEFAULT_HOME_REGION) -> Tuple[Tuple[str, str], ...]:
+        """
+        Every account/region pair that needs a backup stack, in manifest order.
+        """
+        return tuple(
+            (account, region)
+            for account in self._index
+            for region in self.regions(account, home_region)
+        )
+
+    def tag_selections(self, account: str) -> Tuple[TagSelection, ...]:
+        return self._tag_selections.get(account, ())
+
+    def vault_class(self, account: str) -> str:
+        return self._vault_classes.get(account, DEFAULT_VAULT_CLASS)
+
+    def fingerprint(
+        self, account: str, region: str = None, home_region: str = DEFAULT_HOME_REGION
+    ) -> str:
+        """
+        A digest of everything the backup stack of an account, or of one of its regions, is built from.
+
+        Two manifests give the same fingerprint for a target exactly when its stack would be
+        synthesized from the same slice, whatever changed in other accounts or regions.
+        """
+        slice_document = {
+            VAULT_CLASS_KEY: self.vault_class(account),
+            TAG_SELECTIONS_KEY: [list(selection) for selection in self.tag_selections(account)],
+            **{
+                frequency: list(self.resources(account, frequency, region, home_region))
+                for frequency in FREQUENCIES
+            },
+        }
+        canonical = json.dumps(slice_document, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+    def fingerprints(self, home_region: str = DEFAULT_HOME_REGION) -> Dict[Tuple[str, str], str]:
+        """
+        The fingerprint of every account/region target, in manifest order.
+        """
+        return {
+            (account, region): self.fingerprint(account, region, home_region)
+            for account, region in self.targets(home_region)
+        }
+
+    def arn_count(self) -> int:
+        return sum(
+            len(arns) for frequencies in self._index.values() for arns in frequencies.values()
+        )
+
+
+def arn_region(arn: str) -> str:
+    return arn.split(":", 4)[3]
+
+
+def normalise_arns(resource_arns: Iterable[str], where: str = "resources") -> Tuple[str, ...]:
+    """
+    Validate a list of ARNs and return it de-duplicated, keeping the first occurrence order.
+
+    :raises ManifestError: if any ARN is malformed.
+    """
+    errors = []
+    seen = {}
+    for arn in resource_arns:
+        if not isinstance(arn, str) or not ARN_PATTERN.match(arn):
+            errors.append(f"{where}: invalid ARN {arn!r}")
+            continue
+        seen.setdefault(arn, None)
+    if errors:
+        raise ManifestError(errors)
+    return tuple(seen)
+
+
+def _parse_tag_selections(account: str, specs, errors: List[str]) -> Tuple[TagSelection, ...]:
+    where = f"{account}.{TAG_SELECTIONS_KEY}"
+    if not isinstance(specs, list):
+        errors.append(f"{where}: expected a list of tag selections")
+        return ()
+
+    selections = []
+    for position, spec in enumerate(specs):
+        spec_where = f"{where}[{position}]"
+        if not isinstance(spec, dict):
+            errors.append(f"{spec_where}: expected an object")
+            continue
+        unknown = set(spec) - {"id", "frequency", "tags", "resource_types"}
+        if unknown:
+            errors.append(f"{spec_where}: unknown keys {', '.join(sorted(unknown))}")
+        frequency = spec.get("frequency")
+        if frequency not in FREQUENCIES:
+            errors.append(f"{spec_where}: unknown frequency, expected one of {', '.join(FREQUENCIES)}")
+        tags = spec.get("tags")
+        if not isinstance(tags, dict) or not tags or not all(
+            isinstance(key, str) and isinstance(value, str) for key, value in tags.items()
+        ):
+            errors.append(f"{spec_where}: tags must be a non-empty object of string values")
+            tags = {}
+        resource_types = spec.get("resource_types", [])
+        if (
+            not isinstance(resource_types, list)
+            or not all(isinstance(resource_type, str) for resource_type in resource_types)
+            or set(resource_types) - set(RESOURCE_TYPE_ARNS)
+        ):
+            errors.append(
+                f"{spec_where}: resource_types must be a list drawn from {', '.join(RESOURCE_TYPE_ARNS)}"
+            )
+            resource_types = []
+        selection_id = spec.get("id")
+        if selection_id is None:
+            # name the selection after its content, so reordering the list doesn't rename it
+            canonical = json.dumps([frequency, sorted(tags.items()), sorted(resource_types)])
+            selection_id = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:8]
+        selections.append(
+            TagSelection(
+                selection_id=str(selection_id),
+                frequency=frequency,
+                tags=tuple(sorted(tags.items())),
+                resource_types=tuple(dict.fromkeys(resource_types)),
+            )
+        )
+
+    seen = set()
+    for selection in selections:
+        key = (selection.frequency, selection.selection_id)
+        if key in seen:
+            errors.append(f"{where}: duplicate {selection.frequency} selection id {selection.selection_id}")
+        seen.add(key)
+    return tuple(selections)
+
+
+def parse_manifest(document: dict, source: str = None, digest: str = None) -> Manifest:
+    """
+    Validate a decoded manifest document and build the account -> frequency -> ARN index.
+
+    Every account, frequency and ARN is checked before anything is returned so that a bad
+    manifest fails the synth straight away, with all of its problems listed together.
+
+    :raises ManifestError: on malformed accounts, unknown frequencies, bad ARNs, bad tag selections or duplicates.
+    """
+    if not isinstance(document, dict):
+        raise ManifestError(["the manifest must be a JSON object keyed by account id"], source)
+
+    errors = []
+    index = {}
+    tag_selections = {}
+    vault_classes = {}
+    for account, frequencies in document.items():
+        if not ACCOUNT_PATTERN.match(account):
+            errors.append(f"{account}: account ids must be 12 digits")
+        if not isinstance(frequencies, dict):
+            errors.append(f"{account}: expected an object keyed by frequency")
+            continue
+        index[account] = {}
+        for frequency, arns in frequencies.items():
+            where = f"{account}.{frequency}"
+            if frequency == TAG_SELECTIONS_KEY:
+                tag_selections[account] = _parse_tag_selections(account, arns, errors)
+                continue
+            if frequency == VAULT_CLASS_KEY:
+                if arns not in VAULT_CLASSES:
+                    errors.append(f"{where}: expected one of {', '.join(VAULT_CLASSES)}")
+                vault_classes[account] = arns
+                continue
+            if frequency not in FREQUENCIES:
+                errors.append(f"{where}: unknown frequency, expected one of {', '.join(FREQUENCIES)}")
+                continue
+            if not isinstance(arns, list):
+                errors.append(f"{where}: expected a list of ARNs")
+                continue
+            seen = set()
+            for arn in arns:
+                if not isinstance(arn, str) or not ARN_PATTERN.match(arn):
+                    errors.append(f"{where}: invalid ARN {arn!r}")
+                elif arn in seen:
+                    errors.append(f"{where}: duplicate ARN {arn}")
+                else:
+                    seen.add(arn)
+            index[account][frequency] = tuple(arns)
+
+    if errors:
+        raise ManifestError(errors, source)
+    return Manifest(
+        index=index,
+        tag_selections=tag_selections,
+        vault_classes=vault_classes,
+        digest=digest,
+        source=source,
+    )
+
+
+# memoized manifests keyed on the absolute path, holding the stat key and content digest they were built from
+_cache: Dict[str, Tuple[Tuple[int, int], Manifest]] = {}
+_cache_lock = threading.Lock()
+
+
+@profiled
+def load_manifest(manifest_path: str = None) -> Manifest:
+    """
+    Load, validate and index the resource manifest once per process.
+
+    The parsed manifest is memoized on the file's mtime and size. When those change the body
+    is hashed, and the cached index is still reused if the content is identical.
+
+    :param manifest_path: The manifest to load. Defaults to the manifest shipped with this package.
+    :type manifest_path: str
+    """
+    manifest_path = path.abspath(manifest_path or DEFAULT_MANIFEST_PATH)
+    file_stat = stat(manifest_path)
+    stat_key = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(manifest_path)
+        if cached and cached[0] == stat_key:
+            return cached[1]
+
+        with open(manifest_path, "rb") as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()
+        if cached and cached[1].digest == digest:
+            # touched but not changed, so keep the existing index
+            _cache[manifest_path] = (stat_key, cached[1])
+            return cached[1]
+
+        try:
+            document = json.loads(body)
+        except ValueError as e:
+            raise ManifestError([f"not valid JSON: {e}"], manifest_path) from e
+        manifest = parse_manifest(document, source=manifest_path, digest=digest)
+        _cache[manifest_path] = (stat_key, manifest)
+        return manifest
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
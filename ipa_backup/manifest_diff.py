@@ -0,0 +1,192 @@
+"""
+List the account/region stages a change to the resource manifest affects.
+
+Each stage's backup stack is built from its own slice of the manifest, so only the stages whose
+slice fingerprint changed, and stages that were added or removed, need to be synthesized and deployed:
+
+    python -m ipa_backup.manifest_diff --base-ref ipa-backup-deployed
+
+The pipeline builds only the stages targets_to_deploy gives, against the revision it last deployed.
+"""
+import argparse
+import json
+import subprocess
+from os import path
+from typing import List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.manifest import (
+    DEFAULT_HOME_REGION,
+    DEFAULT_MANIFEST_PATH,
+    Manifest,
+    ManifestError,
+    load_manifest,
+    parse_manifest,
+)
+
+
+# how a stage is affected by the change
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+# the paths, besides the manifest, that every backup stack is built from. A change to any of them
+# can change every stage, ipa_backup/ipa_backup_stack.py for one
+STACK_SOURCES = ("app.py", "cdk.json", "requirements.txt", "ipa_backup")
+
+
+class AffectedTarget(NamedTuple):
+    """
+    A stage whose backup stack differs between two manifests.
+
+    :param account: The account of the stage.
+    :param region: The region of the stage.
+    :param change: One of added, removed or changed.
+    """
+
+    account: str
+    region: str
+    change: str
+
+
+def affected_targets(
+    base: Manifest, head: Manifest, home_region: str = DEFAULT_HOME_REGION
+) -> List[AffectedTarget]:
+    """
+    The stages that were added, removed or had their manifest slice changed, in the head manifest's order.
+
+    :param base: The manifest that was last deployed.
+    :type base: Manifest
+    :param head: The manifest about to be deployed.
+    :type head: Manifest
+    :param home_region: The region that resources without a region, such as s3 buckets, are backed up from.
+    :type home_region: str
+    """
+    base_fingerprints = base.fingerprints(home_region)
+    head_fingerprints = head.fingerprints(home_region)
+    affected = []
+    for target, fingerprint in head_fingerprints.items():
+        if target not in base_fingerprints:
+            affected.append(AffectedTarget(*target, ADDED))
+        elif base_fingerprints[target] != fingerprint:
+            affected.append(AffectedTarget(*target, CHANGED))
+    # removed stages are no longer deployed by the pipeline, and their stacks have to be deleted by hand
+    affected.extend(
+        AffectedTarget(*target, REMOVED) for target in base_fingerprints if target not in head_fingerprints
+    )
+    return affected
+
+
+def _git_toplevel(manifest_path: str) -> str:
+    return subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"],
+        cwd=path.dirname(manifest_path),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def manifest_at_ref(ref: str, manifest_path: str = DEFAULT_MANIFEST_PATH) -> Manifest:
+    """
+    Load the manifest as it was at a git revision.
+
+    :param ref: Any revision git understands, e.g. a branch, tag or commit.
+    :type ref: str
+    :param manifest_path: The manifest's path in the working tree.
+    :type manifest_path: str
+    """
+    manifest_path = path.abspath(manifest_path)
+    toplevel = _git_toplevel(manifest_path)
+    relative_path = path.relpath(manifest_path, toplevel).replace(path.sep, "/")
+    source = f"{ref}:{relative_path}"
+    body = subprocess.run(
+        ["git", "show", source], cwd=toplevel, capture_output=True, text=True, check=True
+    ).stdout
+    try:
+        document = json.loads(body)
+    except ValueError as e:
+        raise ManifestError([f"not valid JSON: {e}"], source) from e
+    return parse_manifest(document, source=source)
+
+
+def sources_changed_since(ref: str, manifest_path: str = DEFAULT_MANIFEST_PATH) -> bool:
+    """
+    Whether any of the STACK_SOURCES other than the manifest changed since a git revision.
+
+    :param ref: Any revision git understands.
+    :type ref: str
+    :param manifest_path: The manifest's path in the working tree, which doesn't count as a change.
+    :type manifest_path: str
+    """
+    manifest_path = path.abspath(manifest_path)
+    toplevel = _git_toplevel(manifest_path)
+    relative_path = path.relpath(manifest_path, toplevel).replace(path.sep, "/")
+    # --quiet exits with 1 when there are differences, and anything else when git fails
+    difference = subprocess.run(
+        ["git", "diff", "--quiet", ref, "--", *STACK_SOURCES, f":(exclude){relative_path}"],
+        cwd=toplevel,
+        capture_output=True,
+        text=True,
+    )
+    if difference.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(difference.returncode, difference.args, difference.stdout, difference.stderr)
+    return difference.returncode == 1
+
+
+def targets_to_deploy(
+    ref: str, manifest_path: str = DEFAULT_MANIFEST_PATH, home_region: str = DEFAULT_HOME_REGION
+) -> Tuple[Tuple[str, str], ...]:
+    """
+    The account/region targets whose stacks may differ from those deployed at a git revision.
+
+    Every target when the revision, or the manifest at it, can't be read, or when the stack sources
+    changed since. Otherwise only the targets that were added or whose slice changed, removed ones
+    have no stage to deploy.
+
+    :param ref: The revision that was last deployed to every target.
+    :type ref: str
+    :param manifest_path: The manifest about to be deployed.
+    :type manifest_path: str
+    :param home_region: The region that resources without a region, such as s3 buckets, are backed up from.
+    :type home_region: str
+    """
+    manifest_path = manifest_path or DEFAULT_MANIFEST_PATH
+    head = load_manifest(manifest_path)
+    try:
+        if sources_changed_since(ref, manifest_path):
+            return head.targets(home_region)
+        base = manifest_at_ref(ref, manifest_path)
+    except (OSError, subprocess.CalledProcessError, ManifestError):
+        # not a git checkout, an unknown revision, or a manifest git can't give back
+        return head.targets(home_region)
+    affected = {
+        (target.account, target.region)
+        for target in affected_targets(base, head, home_region)
+        if target.change != REMOVED
+    }
+    return tuple(target for target in head.targets(home_region) if target in affected)
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    base = parser.add_mutually_exclusive_group(required=True)
+    base.add_argument("--base", help="the manifest that was last deployed")
+    base.add_argument("--base-ref", help="the git revision that was last deployed")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="the manifest about to be deployed")
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION)
+    args = parser.parse_args(argv)
+
+    if args.base_ref:
+        base_manifest = manifest_at_ref(args.base_ref, args.manifest)
+    else:
+        base_manifest = load_manifest(args.base)
+    head_manifest = load_manifest(args.manifest)
+
+    affected = affected_targets(base_manifest, head_manifest, args.home_region)
+    for target in affected:
+        print(f"{target.account} {target.region} {target.change}")
+    print(f"{len(affected)} of {len(head_manifest.targets(args.home_region))} stages affected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Synthesize the backup stack of every manifest account/region across a pool of worker processes.
+
+The jsii bridge makes a single cdk App effectively single threaded, so the targets are split
+into contiguous shards, each shard is synthesized into its own cloud assembly by a separate
+process, and the assemblies are merged into one cdk.out with a single manifest.json and tree.json.
+The merged output is byte-for-byte the assembly a single App would have written. Each stack has the
+name of the stage stack the pipeline deploys to its account and region, so deploying one updates the
+pipeline's stack rather than creating a second one beside it:
+
+    python -m ipa_backup.parallel_synth --workers 8
+    cdk deploy --app cdk.out ipa-backup-pipeline-construct-master-123456789012-ap-southeast-2-stage
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import path
+from typing import List, Sequence, Tuple
+
+from ipa_backup.catalog import (
+    DEFAULT_BRANCH_NAME,
+    DEFAULT_PIPELINE_ACCOUNT,
+    DEFAULT_PIPELINE_NAME,
+    add_stack_arguments,
+    backup_stack_name,
+)
+from ipa_backup.manifest import DEFAULT_HOME_REGION, load_manifest
+
+
+# the files every cloud assembly writes, which are merged rather than copied
+ASSEMBLY_MANIFEST = "manifest.json"
+ASSEMBLY_TREE = "tree.json"
+ASSEMBLY_VERSION_FILE = "cdk.out"
+TREE_ARTIFACT = "Tree"
+
+
+def stack_naming(home_region: str = DEFAULT_HOME_REGION) -> argparse.Namespace:
+    """
+    The stack names of the pipeline in app.py, as catalog.add_stack_arguments parses them.
+
+    :param home_region: The region of the pipeline.
+    """
+    return argparse.Namespace(
+        stack_name=None,
+        pipeline_name=DEFAULT_PIPELINE_NAME,
+        branch_name=DEFAULT_BRANCH_NAME,
+        pipeline_account=DEFAULT_PIPELINE_ACCOUNT,
+        home_region=home_region,
+    )
+
+
+def stack_id(account: str, region: str, naming: argparse.Namespace = None) -> str:
+    """
+    The name of the backup stack of an account and region, the stage stack the pipeline deploys there.
+
+    :param naming: The parsed arguments of catalog.add_stack_arguments, and --home-region. Defaults
+        to the pipeline of app.py, see stack_naming.
+    """
+    return backup_stack_name(account, region, naming or stack_naming())
+
+
+def build_account_stacks(
+    app,
+    targets: Sequence[Tuple[str, str]],
+    manifest_path: str = None,
+    home_region: str = DEFAULT_HOME_REGION,
+    naming: argparse.Namespace = None,
+) -> None:
+    """
+    Add an IpaBackupStack for each account/region target to the app.
+
+    Both the single-process and the parallel synth build their stacks here, so they can't drift.
+
+    :param naming: How the stacks are named, see stack_id. Defaults to the pipeline in the home region.
+    """
+    from aws_cdk import Environment
+
+    from ipa_backup.ipa_backup_stack import IpaBackupStack
+
+    naming = naming or stack_naming(home_region)
+    for account, region in targets:
+        IpaBackupStack(
+            scope=app,
+            construct_id=stack_id(account, region, naming),
+            env=Environment(account=account, region=region),
+            silver_vault_name="ipa-backup-vault-silver",
+            manifest_path=manifest_path,
+            home_region=home_region,
+        )
+
+
+def synth_targets(
+    outdir: str,
+    targets: Sequence[Tuple[str, str]],
+    manifest_path: str = None,
+    home_region: str = DEFAULT_HOME_REGION,
+    naming: argparse.Namespace = None,
+) -> str:
+    # synthesize the targets with a single App in this process
+    from aws_cdk import App
+
+    app = App(outdir=outdir)
+    build_account_stacks(app, targets, manifest_path, home_region, naming)
+    return app.synth().directory
+
+
+def _synth_shard(arguments) -> str:
+    # runs in a worker process, which starts its own jsii runtime
+    outdir, targets, manifest_path, home_region, naming = arguments
+    return synth_targets(outdir, targets, manifest_path, home_region, naming)
+
+
+def partition(targets: Sequence[Tuple[str, str]], shards: int) -> List[List[Tuple[str, str]]]:
+    """
+    Split the targets into at most ``shards`` contiguous, nearly equal slices, keeping their order.
+    """
+    shards = max(1, min(shards, len(targets)))
+    size, remainder = divmod(len(targets), shards)
+    slices = []
+    start = 0
+    for shard in range(shards):
+        end = start + size + (1 if shard < remainder else 0)
+        slices.append(list(targets[start:end]))
+        start = end
+    return [shard for shard in slices if shard]
+
+
+def _read_json(json_path: str) -> dict:
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(json_path: str, document: dict) -> None:
+    # the same layout as the cdk's JSON.stringify(document, undefined, 2)
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(document, indent=2, ensure_ascii=False))
+
+
+def merge_assemblies(shard_directories: Sequence[str], outdir: str) -> None:
+    """
+    Merge the cloud assemblies of each shard, in order, into a single assembly.
+
+    Stack templates and asset manifests are copied across, the artifacts of every manifest.json
+    and the children of every tree.json are concatenated, and the Tree artifact is written last
+    as the cdk does itself.
+
+    :raises ValueError: if two shards write different content to the same file.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    manifest = None
+    tree = None
+    for shard_directory in shard_directories:
+        for name in sorted(os.listdir(shard_directory)):
+            if name in (ASSEMBLY_MANIFEST, ASSEMBLY_TREE):
+                continue
+            source = path.join(shard_directory, name)
+            target = path.join(outdir, name)
+            if path.isdir(source):
+                shutil.copytree(source, target, dirs_exist_ok=True)
+                continue
+            if path.exists(target) and name != ASSEMBLY_VERSION_FILE:
+                with open(source, "rb") as a, open(target, "rb") as b:
+                    if a.read() != b.read():
+                        raise ValueError(f"shards wrote different content to {name}")
+            shutil.copyfile(source, target)
+
+        shard_manifest = _read_json(path.join(shard_directory, ASSEMBLY_MANIFEST))
+        shard_tree = _read_json(path.join(shard_directory, ASSEMBLY_TREE))
+        if manifest is None:
+            manifest, tree = shard_manifest, shard_tree
+            tree_artifact = manifest["artifacts"].pop(TREE_ARTIFACT)
+            tree_node = tree["tree"]["children"].pop(TREE_ARTIFACT)
+            continue
+        for name, artifact in shard_manifest["artifacts"].items():
+            if name != TREE_ARTIFACT:
+                manifest["artifacts"][name] = artifact
+        for name, child in shard_tree["tree"]["children"].items():
+            if name != TREE_ARTIFACT:
+                tree["tree"]["children"][name] = child
+        for missing in shard_manifest.get("missing", []):
+            if missing not in manifest.setdefault("missing", []):
+                manifest["missing"].append(missing)
+
+    manifest["artifacts"][TREE_ARTIFACT] = tree_artifact
+    tree["tree"]["children"][TREE_ARTIFACT] = tree_node
+    _write_json(path.join(outdir, ASSEMBLY_MANIFEST), manifest)
+    _write_json(path.join(outdir, ASSEMBLY_TREE), tree)
+
+
+def parallel_synth(
+    outdir: str,
+    workers: int = None,
+    manifest_path: str = None,
+    home_region: str = DEFAULT_HOME_REGION,
+    naming: argparse.Namespace = None,
+) -> str:
+    """
+    Synthesize every manifest account/region into ``outdir`` using a pool of worker processes.
+
+    :param outdir: Where to write the merged cloud assembly.
+    :type outdir: str
+    :param workers: How many worker processes to use. Defaults to the number of cpus.
+    :type workers: int
+    :param manifest_path: The resource manifest. Defaults to the manifest shipped with this package.
+    :type manifest_path: str
+    :param naming: How the stacks are named, see stack_id. Defaults to the pipeline in the home region.
+    :type naming: argparse.Namespace
+    :return: The directory of the merged assembly.
+    :rtype: str
+    """
+    targets = load_manifest(manifest_path).targets(home_region)
+    shards = partition(targets, workers or os.cpu_count() or 1)
+    if len(shards) <= 1:
+        return synth_targets(outdir, targets, manifest_path, home_region, naming)
+
+    with tempfile.TemporaryDirectory(prefix="ipa-backup-synth-") as staging:
+        arguments = [
+            (path.join(staging, f"shard-{number}"), shard, manifest_path, home_region, naming)
+            for number, shard in enumerate(shards)
+        ]
+        # spawn rather than fork, a forked worker would share the parent's jsii pipe
+        with ProcessPoolExecutor(
+            max_workers=len(shards), mp_context=get_context("spawn")
+        ) as pool:
+            shard_directories = list(pool.map(_synth_shard, arguments))
+        if path.isdir(outdir):
+            shutil.rmtree(outdir)
+        merge_assemblies(shard_directories, outdir)
+    return outdir
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--outdir",
+        default=os.environ.get("CDK_OUTDIR", "cdk.out"),
+        help="where to write the cloud assembly (default: $CDK_OUTDIR or cdk.out)",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpus)")
+    parser.add_argument("--manifest", default=None, help="the resource manifest to synthesize")
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION, help="the region of the pipeline")
+    add_stack_arguments(parser)
+    args = parser.parse_args(argv)
+    print(parallel_synth(args.outdir, args.workers, args.manifest, args.home_region, args))
+
+
+if __name__ == "__main__":
+    main()
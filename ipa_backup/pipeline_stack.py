@@ -4,65 +4,203 @@ from aws_cdk import (
     Stage,
     pipelines,
     aws_codecommit,
-    Stage,
+    aws_iam,
     Environment,
+    Token,
 )
 from constructs import Construct
+from typing import List, Sequence, Tuple
 
 from ipa_backup.ipa_backup_stack import IpaBackupStack
+from ipa_backup.manifest import DEFAULT_HOME_REGION, load_manifest
+from ipa_backup.manifest_diff import targets_to_deploy
+from ipa_backup.profiling import profiled
+
+
+# the number of stages deployed side by side in a wave, unless the ipa-backup:wave-width context says otherwise
+DEFAULT_WAVE_WIDTH = 20
+
+# the construct id of the backup stack in each stage, which ends the stack's name
+STAGE_STACK_ID = "stage"
+
+# the git tag the pipeline moves to the revision it deployed, once every wave has deployed it. With
+# the ipa-backup:deployed-ref context the pipeline only has stages for the targets changed since
+DEPLOYED_TAG = "ipa-backup-deployed"
+DEPLOYED_REF_CONTEXT_KEY = "ipa-backup:deployed-ref"
+
+# lets git in codebuild pull and push over https with the project's role
+GIT_CREDENTIAL_COMMANDS = [
+    "git config --global credential.helper '!aws codecommit credential-helper $@'",
+    "git config --global credential.UseHttpPath true",
+]
+
+
+def plan_waves(
+    targets: Sequence[Tuple[str, str]], width: int
+) -> List[List[Tuple[str, str]]]:
+    """
+    Group account/region targets into waves of at most ``width`` stages, keeping their order.
+
+    :param targets: The account/region pairs to deploy to.
+    :type targets: Sequence[Tuple[str, str]]
+    :param width: The most stages to deploy at the same time.
+    :type width: int
+    """
+    if width < 1:
+        raise ValueError(f"the wave width must be at least 1, not {width}")
+    return [list(targets[i : i + width]) for i in range(0, len(targets), width)]
+
+
+def stage_name(
+    pipeline_name: str, branch_name: str, account: str, region: str, home_target: Tuple[str, str]
+) -> str:
+    """
+    The name of the stage deploying an account/region target.
+
+    :param pipeline_name: The stack name of the pipeline.
+    :param home_target: The pipeline's own account and region, whose stage keeps its original name,
+        and so its stack name.
+    :type home_target: Tuple[str, str]
+    """
+    name = f"{pipeline_name}-{branch_name}"
+    if (account, region) != tuple(home_target):
+        name += f"-{account}-{region}"
+    return name
+
+
+def stage_stack_name(
+    pipeline_name: str, branch_name: str, account: str, region: str, home_target: Tuple[str, str]
+) -> str:
+    """
+    The name of the backup stack the pipeline deploys to an account/region target, see stage_name.
+    """
+    return f"{stage_name(pipeline_name, branch_name, account, region, home_target)}-{STAGE_STACK_ID}"
 
 
 # create a stage for deployment of the solution into the target account and region
 class DeploymentStage(Stage):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    @profiled
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        account: str = "832435373672",
+        region: str = DEFAULT_HOME_REGION,
+        manifest_path: str = None,
+        home_region: str = DEFAULT_HOME_REGION,
+        **kwargs
+    ) -> None:
         super().__init__(scope, construct_id, **kwargs)
         # create a instance of the intended class, i.e. the cloudformation stack
         stack = IpaBackupStack(
             scope=self,
-            construct_id="stage",
-            env=Environment(account="832435373672", region="ap-southeast-2"),
+            construct_id=STAGE_STACK_ID,
+            env=Environment(account=account, region=region),
             silver_vault_name="ipa-backup-vault-silver",
+            manifest_path=manifest_path,
+            home_region=home_region,
         )
 
 
 class Pipeline(Stack):
+    @profiled
     def __init__(
         self,
         scope: Construct,
         construct_id: str,
         repository_name: str,
         branch_name: str,
+        manifest_path: str = None,
+        wave_width: int = None,
+        deployed_ref: str = None,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
+        # every account/region in the manifest has a stack, global resources are backed up from the pipeline's region
+        home_region = DEFAULT_HOME_REGION if Token.is_unresolved(self.region) else self.region
+        targets = load_manifest(manifest_path).targets(home_region)
+        # Given the revision last deployed everywhere, only the targets whose manifest slice changed since get a
+        # stage, see ipa_backup/manifest_diff.py. Any other change to the stacks' sources deploys every target.
+        deployed_ref = deployed_ref or self.node.try_get_context(DEPLOYED_REF_CONTEXT_KEY)
+        deploy_targets = targets_to_deploy(deployed_ref, manifest_path, home_region) if deployed_ref else targets
+        # how many of those stages deploy at the same time
+        wave_width = wave_width or int(
+            self.node.try_get_context("ipa-backup:wave-width") or DEFAULT_WAVE_WIDTH
+        )
         # create a reference to the existing repository
         existing_repository = aws_codecommit.Repository.from_repository_name(
             scope=self, id="existing-repository", repository_name=repository_name
         )
+        # a full clone rather than a zip of the branch, so the synth can read the deployed revision from git
+        source = pipelines.CodePipelineSource.code_commit(  # pull the code from code commit
+            repository=existing_repository,
+            branch=branch_name,  # refer to the master branch
+            code_build_clone_output=True,
+        )
         # so we want to create a new pipeline for the code to be deployed
         pipeline = pipelines.CodePipeline(
             scope=self,
             id="pipeline",
-            synth=pipelines.ShellStep(  # the commands required to complete the synthesis
+            # deploying into other accounts needs the artifact bucket encrypted with a key they can use
+            cross_account_keys=any(account != self.account for account, _ in targets),
+            synth=pipelines.CodeBuildStep(  # the commands required to complete the synthesis
                 id="synth",
-                input=pipelines.CodePipelineSource.code_commit(  # pull the code from code commit
-                    repository=existing_repository,
-                    branch=branch_name,  # refer to the master branch
-                ),
+                input=source,
                 commands=[
                     # "python -m pytest tests/unit -v",
-                    "cdk synth",
+                    f"git fetch --force origin refs/tags/{DEPLOYED_TAG}:refs/tags/{DEPLOYED_TAG} || true",
+                    f"cdk synth -c {DEPLOYED_REF_CONTEXT_KEY}={DEPLOYED_TAG}",
                 ],  # the actual synthesis command
                 install_commands=[
+                    *GIT_CREDENTIAL_COMMANDS,
                     "npm install -g aws-cdk",  # install the cdk sdk
                     "python -m pip install -r requirements.txt",  # install the python libraries to support the cdk application
                     "python -m pip install -r requirements-dev.txt",  # install the python libraries that are used for testing only
                 ],
+                # reading the cloned repository, and the deployed tag
+                role_policy_statements=[
+                    aws_iam.PolicyStatement(
+                        actions=["codecommit:GitPull"],
+                        resources=[existing_repository.repository_arn],
+                    )
+                ],
             ),
         )
-        # add a stage to the pipeline to deploy the solution into the development environment - local account for now.
-        deployment_stage = DeploymentStage(
-            scope=self,
-            construct_id=self.stack_name + "-" + branch_name,
-        )
-        stage = pipeline.add_stage(stage=deployment_stage)
+        # add a wave of parallel stages for each slice of the targets
+        for number, wave_targets in enumerate(plan_waves(deploy_targets, wave_width), start=1):
+            wave = pipeline.add_wave(id=f"wave-{number}")
+            for account, region in wave_targets:
+                deployment_stage = DeploymentStage(
+                    scope=self,
+                    construct_id=stage_name(
+                        self.stack_name, branch_name, account, region, (self.account, home_region)
+                    ),
+                    account=account,
+                    region=region,
+                    manifest_path=manifest_path,
+                    home_region=home_region,
+                )
+                wave.add_stage(stage=deployment_stage)
+        # once the last wave has deployed, every target is at this revision. The step has a wave of its own, as
+        # a full wave already has as many actions as a pipeline stage can hold
+        if deploy_targets:
+            pipeline.add_wave(
+                id="record-deployed-revision",
+                post=[
+                    pipelines.CodeBuildStep(
+                        "tag-deployed-revision",
+                        input=source,
+                        install_commands=GIT_CREDENTIAL_COMMANDS,
+                        commands=[
+                            f"git tag --force {DEPLOYED_TAG}",
+                            f"git push --force origin refs/tags/{DEPLOYED_TAG}",
+                        ],
+                        role_policy_statements=[
+                            aws_iam.PolicyStatement(
+                                actions=["codecommit:GitPull", "codecommit:GitPush"],
+                                resources=[existing_repository.repository_arn],
+                            )
+                        ],
+                    )
+                ],
+            )
@@ -0,0 +1,481 @@
+"""
+Work out each vault class's plan lifecycles and disaster recovery copies from its retention targets.
+
+The targets say how long recovery points are kept, how long they must stay fast to restore, and how
+long a copy is kept away from the account's region. From them come the cold storage transitions and
+copy actions of the plans, which are checked against AWS Backup's rules when the stack is synthesized.
+A storage and cost projection for a manifest shows what the targets cost:
+
+    python -m ipa_backup.policies --size-gb 200 --change-rate 0.03
+"""
+import argparse
+import json
+import math
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.manifest import DEFAULT_HOME_REGION, FREQUENCIES, Manifest, arn_region, load_manifest
+from ipa_backup.selections import split_continuous_arns
+
+
+# a recovery point moved to cold storage is billed there for at least 90 days, and AWS Backup
+# rejects a lifecycle that deletes it any sooner
+COLD_STORAGE_MIN_DAYS = 90
+
+# how many days apart each plan's recovery points are
+FREQUENCY_INTERVAL_DAYS = {"daily": 1, "weekly": 7, "monthly": 30}
+
+# the rule name of each plan, kept from the BackupPlanRule presets the plans were first built from
+RULE_NAMES = {
+    "daily": "Daily",
+    "weekly": "Weekly",
+    "monthly": "Monthly1Year",
+    "continuous": "Continuous",
+}
+
+# the copies of a class are kept in the vault of the same class in the disaster recovery region or account.
+# That vault isn't created by this stack, so its ARN can be given for each class, e.g.
+#   -c 'ipa-backup:dr-vault-arns={"gold": "arn:aws:backup:ap-southeast-4:123456789012:backup-vault:dr-gold"}'
+# and otherwise it is the vault named after the class in the disaster recovery region and account.
+DR_REGION_CONTEXT_KEY = "ipa-backup:dr-region"
+DR_ACCOUNT_CONTEXT_KEY = "ipa-backup:dr-account"
+DR_VAULT_ARNS_CONTEXT_KEY = "ipa-backup:dr-vault-arns"
+DR_VAULT_NAME = "ipa-backup-vault-{class_value}"
+
+# the lock of the gold and platinum vaults: how long it can still be changed, and the shortest retention
+VAULT_LOCK_CHANGEABLE_DAYS = 14
+VAULT_LOCK_MIN_RETENTION_DAYS = 1
+
+# storage prices in USD per GB-month, and for copying a GB across regions, in ap-southeast-2
+WARM_GB_MONTH = 0.05
+COLD_GB_MONTH = 0.01
+COPY_TRANSFER_GB = 0.02
+
+
+class PolicyError(ValueError):
+    """
+    Raised when a vault's plans break one of AWS Backup's lifecycle or vault lock rules.
+
+    :param errors: Every problem found, so they can be fixed in one pass.
+    :type errors: List[str]
+    """
+
+    def __init__(self, errors: List[str], class_value: str = None) -> None:
+        self.errors = list(errors)
+        header = f"Invalid {class_value} backup policy" if class_value else "Invalid backup policy"
+        super().__init__(header + ":\n  " + "\n  ".join(self.errors))
+
+
+class RetentionTarget(NamedTuple):
+    """
+    How long a plan's recovery points are kept.
+
+    :param retain_days: How long recovery points are kept.
+    :type retain_days: int
+    :param warm_days: How long they must stay in warm storage to restore quickly. None keeps them warm.
+    :type warm_days: int
+    :param copy_retain_days: How long the disaster recovery copy is kept. None makes no copy.
+    :type copy_retain_days: int
+    """
+
+    retain_days: int
+    warm_days: int = None
+    copy_retain_days: int = None
+
+
+class CopyAction(NamedTuple):
+    destination_vault_arn: str
+    delete_after_days: int
+    move_to_cold_storage_after_days: int = None
+
+
+class PlanPolicy(NamedTuple):
+    """
+    The lifecycle and copy actions of one backup plan rule.
+    """
+
+    frequency: str
+    delete_after_days: int
+    move_to_cold_storage_after_days: int = None
+    copy_actions: Tuple[CopyAction, ...] = ()
+
+    @property
+    def rule_name(self) -> str:
+        return RULE_NAMES[self.frequency]
+
+
+class DisasterRecovery(NamedTuple):
+    """
+    Where the disaster recovery copies go. A copy goes to another region, another account, or both.
+
+    :param region: The region copies are made in. Defaults to the region of the vault.
+    :type region: str
+    :param account: The account copies are made in. Defaults to the account of the vault.
+    :type account: str
+    :param vault_arns: The ARN of the vault each class copies to, by class. A class without one copies
+        to the vault named after it in the region and account above.
+    :type vault_arns: Dict[str, str]
+    """
+
+    region: str = None
+    account: str = None
+    vault_arns: Dict[str, str] = None
+
+    @classmethod
+    def from_context(cls, node) -> "DisasterRecovery":
+        """
+        The target of the ipa-backup:dr-region, ipa-backup:dr-account and ipa-backup:dr-vault-arns
+        context, or None without any of them.
+        """
+        region = node.try_get_context(DR_REGION_CONTEXT_KEY)
+        account = node.try_get_context(DR_ACCOUNT_CONTEXT_KEY)
+        vault_arns = node.try_get_context(DR_VAULT_ARNS_CONTEXT_KEY)
+        if isinstance(vault_arns, str):
+            # context set with -c on the command line arrives as a string
+            vault_arns = json.loads(vault_arns)
+        if region is None and account is None and not vault_arns:
+            return None
+        return cls(region=region, account=None if account is None else str(account), vault_arns=vault_arns)
+
+    def is_local(self, region: str, account: str) -> bool:
+        # copying into the vault's own region and account would copy it into itself
+        return self.region in (None, region) and self.account in (None, account)
+
+    def copies_to(self, class_value: str, region: str, account: str) -> str:
+        """
+        The ARN of the vault the copies of a class go to, or None when they would go into the vault itself.
+
+        :param region: The region of the vault, which copies default to.
+        :param account: The account of the vault, which copies default to.
+        """
+        if class_value in (self.vault_arns or {}):
+            return self.vault_arns[class_value]
+        if self.is_local(region, account):
+            return None
+        return self.vault_arn(class_value, region, account)
+
+    def vault_arn(self, class_value: str, region: str, account: str) -> str:
+        return (
+            f"arn:aws:backup:{self.region or region}:{self.account or account}:"
+            f"backup-vault:{DR_VAULT_NAME.format(class_value=class_value)}"
+        )
+
+
+# the retention targets of each vault class. Monthly recovery points only need fast restores for
+# their first month, gold keeps a copy of its weekly and monthly recovery points, and platinum of all.
+CLASS_RETENTION_TARGETS: Dict[str, Dict[str, RetentionTarget]] = {
+    "silver": {
+        "daily": RetentionTarget(retain_days=35),
+        "weekly": RetentionTarget(retain_days=90),
+        "monthly": RetentionTarget(retain_days=365, warm_days=30),
+    },
+    "gold": {
+        "daily": RetentionTarget(retain_days=35),
+        "weekly": RetentionTarget(retain_days=90, copy_retain_days=90),
+        "monthly": RetentionTarget(retain_days=365, warm_days=30, copy_retain_days=365),
+    },
+    "platinum": {
+        "daily": RetentionTarget(retain_days=35, copy_retain_days=35),
+        "weekly": RetentionTarget(retain_days=90, copy_retain_days=90),
+        "monthly": RetentionTarget(retain_days=365, warm_days=30, copy_retain_days=365),
+    },
+}
+
+
+def cold_storage_after(retain_days: int, warm_days: int = None) -> int:
+    """
+    When to move a recovery point to cold storage, or None when it should stay warm.
+
+    A recovery point only goes cold if it then stays there for the 90 days cold storage is billed for.
+    """
+    if warm_days is None or retain_days - warm_days < COLD_STORAGE_MIN_DAYS:
+        return None
+    return max(warm_days, 1)
+
+
+def plan_policy(
+    frequency: str,
+    target: RetentionTarget,
+    copy_to: str = None,
+) -> PlanPolicy:
+    """
+    The lifecycle and copy action of a plan that meets a retention target.
+
+    :param copy_to: The ARN of the vault copies go to. None makes no copy.
+    :type copy_to: str
+    """
+    copy_actions = ()
+    if copy_to and target.copy_retain_days:
+        copy_actions = (
+            CopyAction(
+                destination_vault_arn=copy_to,
+                delete_after_days=target.copy_retain_days,
+                move_to_cold_storage_after_days=cold_storage_after(
+                    target.copy_retain_days, target.warm_days
+                ),
+            ),
+        )
+    return PlanPolicy(
+        frequency=frequency,
+        delete_after_days=target.retain_days,
+        move_to_cold_storage_after_days=cold_storage_after(target.retain_days, target.warm_days),
+        copy_actions=copy_actions,
+    )
+
+
+def class_policies(
+    class_value: str,
+    disaster_recovery: DisasterRecovery = None,
+    region: str = None,
+    account: str = None,
+    targets: Dict[str, RetentionTarget] = None,
+) -> Dict[str, PlanPolicy]:
+    """
+    The daily, weekly and monthly plan policies of a vault class.
+
+    :param class_value: The vault class, one of silver, gold or platinum.
+    :type class_value: str
+    :param disaster_recovery: Where copies go. None makes no copies.
+    :type disaster_recovery: DisasterRecovery
+    :param region: The region of the vault, which copies default to.
+    :type region: str
+    :param account: The account of the vault, which copies default to.
+    :type account: str
+    :param targets: The retention targets of each frequency. Defaults to those of the class.
+    :type targets: Dict[str, RetentionTarget]
+    :raises PolicyError: if the policies break AWS Backup's rules.
+    """
+    if targets is None:
+        if class_value not in CLASS_RETENTION_TARGETS:
+            raise ValueError(f"unknown vault class '{class_value}'")
+        targets = CLASS_RETENTION_TARGETS[class_value]
+    copy_to = None
+    if disaster_recovery is not None:
+        copy_to = disaster_recovery.copies_to(class_value, region, account)
+    policies = {
+        frequency: plan_policy(frequency, targets[frequency], copy_to)
+        for frequency in FREQUENCIES
+    }
+    errors = validate_policies(policies.values())
+    if errors:
+        raise PolicyError(errors, class_value)
+    return policies
+
+
+def _lifecycle_errors(where: str, delete_after_days: int, cold_after_days: int) -> List[str]:
+    errors = []
+    if delete_after_days is not None and delete_after_days < 1:
+        errors.append(f"{where}: recovery points must be kept for at least a day")
+    if cold_after_days is None:
+        return errors
+    if cold_after_days < 1:
+        errors.append(f"{where}: recovery points can't move to cold storage before a day")
+    if delete_after_days is not None and delete_after_days - cold_after_days < COLD_STORAGE_MIN_DAYS:
+        errors.append(
+            f"{where}: recovery points must stay in cold storage for {COLD_STORAGE_MIN_DAYS} days,"
+            f" but are deleted {delete_after_days - cold_after_days} days after moving there"
+        )
+    return errors
+
+
+def validate_policies(
+    policies, max_retention_days: int = None
+) -> List[str]:
+    """
+    Check plan policies against AWS Backup's lifecycle rules, and optionally a vault lock.
+
+    :param policies: The policies to check.
+    :type policies: Iterable[PlanPolicy]
+    :param max_retention_days: The longest retention the vault's lock allows, if it has one.
+    :type max_retention_days: int
+    :return: Every problem found.
+    :rtype: List[str]
+    """
+    errors = []
+    for policy in policies:
+        where = f"{policy.frequency} plan"
+        errors += _lifecycle_errors(
+            where, policy.delete_after_days, policy.move_to_cold_storage_after_days
+        )
+        if max_retention_days is not None and not (
+            VAULT_LOCK_MIN_RETENTION_DAYS <= policy.delete_after_days <= max_retention_days
+        ):
+            errors.append(
+                f"{where}: keeps recovery points for {policy.delete_after_days} days, outside the"
+                f" vault lock's {VAULT_LOCK_MIN_RETENTION_DAYS} to {max_retention_days} days"
+            )
+        for copy_action in policy.copy_actions:
+            errors += _lifecycle_errors(
+                f"{where} copy to {copy_action.destination_vault_arn}",
+                copy_action.delete_after_days,
+                copy_action.move_to_cold_storage_after_days,
+            )
+    return errors
+
+
+def max_retention_days(policies) -> int:
+    """
+    The longest any recovery point of the policies is kept, which a vault lock has to allow.
+
+    Copies are included, as they go to a vault of the same class and lock.
+    """
+    return max(
+        [policy.delete_after_days for policy in policies]
+        + [copy.delete_after_days for policy in policies for copy in policy.copy_actions]
+    )
+
+
+class StorageProjection(NamedTuple):
+    vault_class: str
+    frequency: str
+    resources: int
+    warm_gb: float
+    cold_gb: float
+    copy_gb: float
+    monthly_cost: float
+    warm_only_cost: float
+
+
+def _stored_gb(
+    interval_days: int,
+    delete_after_days: int,
+    cold_after_days: int,
+    size_gb: float,
+    change_rate: float,
+) -> Tuple[float, float]:
+    # The warm recovery points of a resource form one incremental chain: a full backup, then each
+    # point adds what changed since the last. Cold storage holds full backups.
+    points = max(math.ceil(delete_after_days / interval_days), 1)
+    warm_points = points
+    if cold_after_days is not None:
+        warm_points = min(max(math.ceil(cold_after_days / interval_days), 1), points)
+    increment = size_gb * min(change_rate * interval_days, 1.0)
+    warm = size_gb + increment * (warm_points - 1)
+    cold = size_gb * (points - warm_points)
+    return warm, cold
+
+
+def project_storage(
+    manifest: Manifest,
+    size_gb: float = 100.0,
+    change_rate: float = 0.05,
+    disaster_recovery: DisasterRecovery = None,
+    point_in_time_days: int = 35,
+    home_region: str = DEFAULT_HOME_REGION,
+) -> List[StorageProjection]:
+    """
+    Project the steady-state storage and monthly cost of every plan in the manifest.
+
+    Every resource is assumed to be ``size_gb`` with ``change_rate`` of it changing each day. Daily
+    RDS, Aurora and s3 resources of platinum accounts are kept as continuous backups for
+    ``point_in_time_days`` instead. Tag selections are left out, as the number of resources they
+    match isn't known until deployment. A resource is copied unless the disaster recovery target
+    is its own account and region, where resources without a region are in ``home_region``.
+
+    :return: One projection per vault class and frequency, with the cost of keeping it all warm.
+    :rtype: List[StorageProjection]
+    """
+    # the resources of each class and frequency, counted by the account and region they are in
+    resources: Dict[Tuple[str, str], Dict[Tuple[str, str], int]] = {}
+
+    def count(key: Tuple[str, str], account: str, arns: Sequence[str]) -> None:
+        counts = resources.setdefault(key, {})
+        for arn in arns:
+            region = arn_region(arn)
+            where = (account, home_region if region in ("", "*") else region)
+            counts[where] = counts.get(where, 0) + 1
+
+    for account in manifest.accounts:
+        vault_class = manifest.vault_class(account)
+        for frequency in manifest.frequencies(account):
+            arns = manifest.resources(account, frequency)
+            if vault_class == "platinum" and frequency == "daily":
+                continuous, arns = split_continuous_arns(arns)
+                count((vault_class, "continuous"), account, continuous)
+            count((vault_class, frequency), account, arns)
+
+    projections = []
+    for (vault_class, frequency), counts in sorted(resources.items()):
+        if not counts:
+            continue
+        if frequency == "continuous":
+            policies = {where: PlanPolicy(frequency, delete_after_days=point_in_time_days) for where in counts}
+            interval_days = 1
+        else:
+            policies = {
+                (account, region): class_policies(vault_class, disaster_recovery, region, account)[frequency]
+                for account, region in counts
+            }
+            interval_days = FREQUENCY_INTERVAL_DAYS[frequency]
+        # the lifecycle is the same everywhere, only whether a resource is copied depends on where it is
+        policy = next(iter(policies.values()))
+        warm, cold = _stored_gb(
+            interval_days,
+            policy.delete_after_days,
+            policy.move_to_cold_storage_after_days,
+            size_gb,
+            change_rate,
+        )
+        all_warm, _ = _stored_gb(
+            interval_days, policy.delete_after_days, None, size_gb, change_rate
+        )
+        # the copies of each resource, added up over the resources that are copied
+        copy_gb = 0.0
+        transfer_gb = 0.0
+        for where, resources_there in counts.items():
+            for copy_action in policies[where].copy_actions:
+                copy_warm, copy_cold = _stored_gb(
+                    interval_days,
+                    copy_action.delete_after_days,
+                    copy_action.move_to_cold_storage_after_days,
+                    size_gb,
+                    change_rate,
+                )
+                copy_gb += resources_there * (copy_warm + copy_cold)
+                # each copy moves what changed since the last, a month's worth of them every month
+                transfer_gb += resources_there * size_gb * min(change_rate * interval_days, 1.0) * 30 / interval_days
+        count = sum(counts.values())
+        copy_cost = copy_gb * WARM_GB_MONTH + transfer_gb * COPY_TRANSFER_GB
+        projections.append(
+            StorageProjection(
+                vault_class=vault_class,
+                frequency=frequency,
+                resources=count,
+                warm_gb=round(warm * count, 1),
+                cold_gb=round(cold * count, 1),
+                copy_gb=round(copy_gb, 1),
+                monthly_cost=round(count * (warm * WARM_GB_MONTH + cold * COLD_GB_MONTH) + copy_cost, 2),
+                warm_only_cost=round(count * all_warm * WARM_GB_MONTH + copy_cost, 2),
+            )
+        )
+    return projections
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--manifest", default=None, help="the resource manifest to project")
+    parser.add_argument("--size-gb", type=float, default=100.0, help="the assumed size of a resource")
+    parser.add_argument("--change-rate", type=float, default=0.05, help="the share of a resource changing daily")
+    parser.add_argument("--dr-region", default=None, help="the region disaster recovery copies go to")
+    parser.add_argument("--dr-account", default=None, help="the account disaster recovery copies go to")
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION, help="the region of resources without one")
+    args = parser.parse_args(argv)
+
+    disaster_recovery = None
+    if args.dr_region or args.dr_account:
+        disaster_recovery = DisasterRecovery(region=args.dr_region, account=args.dr_account)
+    projections = project_storage(
+        load_manifest(args.manifest), args.size_gb, args.change_rate, disaster_recovery, home_region=args.home_region
+    )
+    print("class     frequency   resources     warm GB     cold GB     copy GB   USD/month   all warm")
+    for p in projections:
+        print(
+            f"{p.vault_class:<9} {p.frequency:<10} {p.resources:>10} {p.warm_gb:>11} {p.cold_gb:>11}"
+            f" {p.copy_gb:>11} {p.monthly_cost:>11} {p.warm_only_cost:>10}"
+        )
+    total = sum(p.monthly_cost for p in projections)
+    warm_only = sum(p.warm_only_cost for p in projections)
+    print(f"total: {total:.2f} USD/month, {warm_only:.2f} USD/month without cold storage")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import functools
+import json
+import os
+import time
+from os import path
+from typing import Callable, Dict, List, Tuple
+
+
+# profiling is opt-in, with either IPA_BACKUP_PROFILE=1 or cdk synth -c ipa-backup:profile=true
+PROFILE_ENV_VAR = "IPA_BACKUP_PROFILE"
+PROFILE_CONTEXT_KEY = "ipa-backup:profile"
+
+# written next to the cloud assembly directory
+REPORT_FILE_NAME = "synth-profile.json"
+FOLDED_FILE_NAME = "synth-profile.folded"
+
+# the requests the jsii kernel sends to its node process, each of which is a round trip
+JSII_PROVIDER_METHODS = (
+    "create",
+    "delete",
+    "get",
+    "set",
+    "sget",
+    "sset",
+    "invoke",
+    "sinvoke",
+    "begin",
+    "end",
+    "callbacks",
+    "complete",
+    "sync_complete",
+)
+
+
+class SynthProfiler:
+    """
+    Collects wall time and jsii round trips for every profiled call, keyed by its call stack.
+
+    Frames are aggregated by the path of profiled calls leading to them, so the same
+    constructor called from two places is reported twice. Self time and self round trips
+    exclude the profiled calls made inside a frame.
+    """
+
+    def __init__(self) -> None:
+        self.jsii_calls = 0
+        self.frames: Dict[Tuple[str, ...], Dict[str, float]] = {}
+        self._stack: List[str] = []
+        self._originals: Dict[str, Callable] = {}
+
+    def install(self) -> None:
+        # count every round trip by wrapping the requests of the kernel's provider. The generated
+        # bindings hold bound kernel methods, so the provider is the one place they all pass through.
+        import jsii
+
+        provider = jsii.kernel.provider
+        for name in JSII_PROVIDER_METHODS:
+            if name in self._originals or not hasattr(provider, name):
+                continue
+            self._originals[name] = getattr(provider, name)
+            setattr(provider, name, self._counting(self._originals[name]))
+
+    def uninstall(self) -> None:
+        import jsii
+
+        provider = jsii.kernel.provider
+        for name in self._originals:
+            # drop the instance attribute so the provider's own method shows through again
+            delattr(provider, name)
+        self._originals.clear()
+
+    def _counting(self, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            self.jsii_calls += 1
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    def call(self, name: str, func: Callable, *args, **kwargs):
+        self._stack.append(name)
+        key = tuple(self._stack)
+        frame = self.frames.setdefault(
+            key,
+            {"calls": 0, "wall_seconds": 0.0, "child_seconds": 0.0, "jsii_calls": 0, "child_jsii_calls": 0},
+        )
+        jsii_calls = self.jsii_calls
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            calls = self.jsii_calls - jsii_calls
+            self._stack.pop()
+            frame["calls"] += 1
+            frame["wall_seconds"] += elapsed
+            frame["jsii_calls"] += calls
+            if len(key) > 1:
+                parent = self.frames[key[:-1]]
+                parent["child_seconds"] += elapsed
+                parent["child_jsii_calls"] += calls
+
+    def report(self) -> List[Dict]:
+        return [
+            {
+                "stack": list(key),
+                "calls": frame["calls"],
+                "wall_seconds": round(frame["wall_seconds"], 6),
+                "self_seconds": round(frame["wall_seconds"] - frame["child_seconds"], 6),
+                "jsii_calls": frame["jsii_calls"],
+                "self_jsii_calls": frame["jsii_calls"] - frame["child_jsii_calls"],
+            }
+            for key, frame in sorted(
+                self.frames.items(), key=lambda item: item[1]["wall_seconds"], reverse=True
+            )
+        ]
+
+    def folded(self) -> List[str]:
+        # one "frame;frame;frame <self microseconds>" line per call stack, the input to flamegraph.pl
+        lines = []
+        for key, frame in sorted(self.frames.items()):
+            self_us = int((frame["wall_seconds"] - frame["child_seconds"]) * 1_000_000)
+            lines.append(f"{';'.join(key)} {max(self_us, 0)}")
+        return lines
+
+
+_profiler: SynthProfiler = None
+
+
+def active_profiler() -> SynthProfiler:
+    return _profiler
+
+
+def enable() -> SynthProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = SynthProfiler()
+        _profiler.install()
+    return _profiler
+
+
+def disable() -> None:
+    global _profiler
+    if _profiler is not None:
+        _profiler.uninstall()
+        _profiler = None
+
+
+def enable_from(app) -> SynthProfiler:
+    """
+    Turn profiling on when the environment variable or the app's context asks for it.
+
+    :param app: The cdk App, whose context may carry the ipa-backup:profile flag.
+    :return: The active profiler, or None when profiling is off.
+    """
+    flag = os.environ.get(PROFILE_ENV_VAR) or app.node.try_get_context(PROFILE_CONTEXT_KEY)
+    if str(flag).lower() in ("1", "true", "yes"):
+        return enable()
+    return None
+
+
+def profiled(func: Callable) -> Callable:
+    """
+    Record the wall time and jsii round trips of a function or constructor when profiling is on.
+
+    When profiling is off the wrapped function is called straight through.
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        return _profiler.call(name, func, *args, **kwargs)
+
+    return wrapper
+
+
+def _template_sizes(outdir: str) -> List[Dict]:
+    # every template in the assembly, including those of nested stage assemblies
+    templates = []
+    for current, _, filenames in os.walk(outdir):
+        for filename in sorted(filenames):
+            if not filename.endswith(".template.json"):
+                continue
+            template_path = path.join(current, filename)
+            with open(template_path, "rb") as f:
+                body = f.read()
+            templates.append(
+                {
+                    "template": path.relpath(template_path, outdir).replace(os.sep, "/"),
+                    "resources": len(json.loads(body).get("Resources", {})),
+                    "bytes": len(body),
+                }
+            )
+    return sorted(templates, key=lambda template: template["template"])
+
+
+def write_report(assembly) -> str:
+    """
+    Write the JSON report and the folded flamegraph stacks next to the cloud assembly.
+
+    Does nothing when profiling is off.
+
+    :param assembly: The cloud assembly returned by app.synth().
+    :return: The path of the JSON report, or None when profiling is off.
+    """
+    if _profiler is None:
+        return None
+    outdir = path.abspath(assembly.directory)
+    report_directory = path.dirname(outdir)
+    templates = _template_sizes(outdir)
+    report = {
+        "assembly": outdir,
+        "jsii_calls": _profiler.jsii_calls,
+        "frames": _profiler.report(),
+        "templates": templates,
+        "template_resources": sum(template["resources"] for template in templates),
+        "template_bytes": sum(template["bytes"] for template in templates),
+    }
+    report_path = path.join(report_directory, REPORT_FILE_NAME)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    with open(path.join(report_directory, FOLDED_FILE_NAME), "w") as f:
+        f.write("\n".join(_profiler.folded()) + "\n")
+    return report_path
@@ -0,0 +1,557 @@
+"""
+Restore sample recovery points of every vault class concurrently and report how long each took.
+
+Samples are taken from the recovery point catalog, see ipa_backup/catalog.py: the newest restorable
+point of a few resources of each vault class and resource type. Each sample is restored as a new
+resource, never over the original, with the backup role its stack outputs. Restore jobs are polled
+with backoff, and the restored resource is deleted once the restore is timed. The time to restore
+of each class is written as a histogram to a JSON report, with one CSV row per restore:
+
+    python -m ipa_backup.catalog refresh
+    python -m ipa_backup.restore_drill --per-group 2 --report restore-drill.json --csv restore-drill.csv
+
+With --simulate the drill runs offline against SimulatedAws, which completes restores after a
+latency drawn for each class and resource type, on a clock sped up by --time-scale.
+"""
+import argparse
+import csv
+import datetime
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.catalog import (
+    DEFAULT_CATALOG_PATH,
+    RecoveryPoint,
+    RecoveryPointCatalog,
+    add_stack_arguments,
+    backup_stack_name,
+    describe_stack,
+)
+from ipa_backup.discovery import DEFAULT_ROLE_NAME, AccountSessions
+from ipa_backup.manifest import DEFAULT_HOME_REGION
+
+
+# restores are mostly waiting on AWS Backup, but each creates a resource, so only a few run at once
+DEFAULT_WORKERS = 8
+DEFAULT_PER_GROUP = 1
+
+# the first wait between polls of a restore job, how much longer each wait gets, and the longest wait
+POLL_INITIAL_SECONDS = 15.0
+POLL_BACKOFF = 2.0
+POLL_MAX_SECONDS = 300.0
+
+# a restore still running after this long is given up on, and then waited on this much longer so
+# whatever it restores can still be deleted
+DEFAULT_TIMEOUT_SECONDS = 12 * 60 * 60
+DEFAULT_CLEANUP_TIMEOUT_SECONDS = 60 * 60
+
+# the restore job states a job ends in
+FINISHED_RESTORE_STATES = ("COMPLETED", "ABORTED", "FAILED")
+
+# the output every stack adds for its backup role, see ipa_backup/constructs/account_resources.py.
+# Its logical id starts with the id of the vault that created the role.
+ROLE_OUTPUT_ID = "backuprolearnoutput"
+
+# the upper bounds, in minutes, of the time to restore histogram's buckets. Slower restores go in the last.
+HISTOGRAM_MINUTES = (5, 15, 30, 60, 120, 240, 480)
+HISTOGRAM_BUCKETS = (*(f"<={minutes}m" for minutes in HISTOGRAM_MINUTES), f">{HISTOGRAM_MINUTES[-1]}m")
+
+# the restore metadata that makes each resource type restore as a new resource, given a name to
+# restore it under, and how a restored resource is deleted: the service, the client method and the
+# argument the last part of its ARN is passed as, plus any other arguments
+DRILL_METADATA: Dict[str, Callable[[Dict[str, str], str], Dict[str, str]]] = {
+    "EBS": lambda metadata, name: {},
+    "RDS": lambda metadata, name: {"DBInstanceIdentifier": name},
+    "Aurora": lambda metadata, name: {"DBClusterIdentifier": name},
+    "EFS": lambda metadata, name: {"newFileSystem": "true", "CreationToken": name},
+    "DynamoDB": lambda metadata, name: {"targetTableName": name},
+}
+CLEANUP: Dict[str, Tuple[str, str, str, Dict]] = {
+    "EBS": ("ec2", "delete_volume", "VolumeId", {}),
+    "RDS": ("rds", "delete_db_instance", "DBInstanceIdentifier", {"SkipFinalSnapshot": True, "DeleteAutomatedBackups": True}),
+    "Aurora": ("rds", "delete_db_cluster", "DBClusterIdentifier", {"SkipFinalSnapshot": True}),
+    "EFS": ("efs", "delete_file_system", "FileSystemId", {}),
+    "DynamoDB": ("dynamodb", "delete_table", "TableName", {}),
+}
+
+
+class DrillResult(NamedTuple):
+    """
+    How the restore of a sample recovery point went.
+
+    :param seconds: The time to restore, from AWS Backup creating the restore job to completing it.
+    :param cleaned_up: Whether the restored resource was deleted.
+    :param error: Why the drill failed, if it did.
+    :param needs_cleanup: Whether the restore job, or the resource it restored, was left behind and
+        has to be deleted by hand.
+    """
+
+    recovery_point_arn: str
+    resource_arn: str
+    resource_type: str
+    vault_class: str
+    restore_job_id: str = None
+    status: str = None
+    seconds: float = None
+    created_resource_arn: str = None
+    cleaned_up: bool = False
+    error: str = None
+    needs_cleanup: bool = False
+
+
+def _last_arn_part(arn: str) -> str:
+    # the name or id at the end of an ARN, e.g. vol-1 of ...:volume/vol-1 or orders of ...:db:orders
+    return arn.replace("/", ":").rsplit(":", 1)[-1]
+
+
+def select_samples(
+    points: Iterable[RecoveryPoint], per_group: int = DEFAULT_PER_GROUP, seed: int = None
+) -> List[RecoveryPoint]:
+    """
+    Pick up to per_group recovery points of each vault class and resource type that can be drilled.
+
+    :param points: The newest restorable recovery point of each resource, see RecoveryPointCatalog.restorable.
+    :param seed: Seeds the pick, so a drill can be repeated on the same resources.
+    :type seed: int
+    """
+    groups: Dict[Tuple[str, str], List[RecoveryPoint]] = {}
+    for point in points:
+        if point.resource_type in DRILL_METADATA:
+            groups.setdefault((point.vault_class, point.resource_type), []).append(point)
+    generator = random.Random(seed)
+    samples = []
+    for key in sorted(groups):
+        group = groups[key]
+        samples.extend(generator.sample(group, min(per_group, len(group))))
+    return samples
+
+
+def stack_backup_role(client, stack_name: str) -> str:
+    """
+    The ARN of a backup stack's backup role, read from its outputs, or None if it has none or the
+    stack doesn't exist.
+
+    :param client: A CloudFormation client in the stack's account and region.
+    """
+    stack = describe_stack(client, stack_name)
+    if stack is None:
+        return None
+    for output in stack.get("Outputs", ()):
+        if ROLE_OUTPUT_ID in output["OutputKey"]:
+            return output["OutputValue"]
+    return None
+
+
+def wait_for_restore(
+    client,
+    restore_job_id: str,
+    sleep: Callable[[float], None] = time.sleep,
+    clock: Callable[[], float] = time.monotonic,
+    timeout: float = DEFAULT_TIMEOUT_SECONDS,
+) -> Dict:
+    """
+    Poll a restore job, waiting longer between each poll, until it finishes or the timeout passes.
+
+    :return: The last describe_restore_job response.
+    :raises TimeoutError: if the job is still running after the timeout.
+    """
+    deadline = clock() + timeout
+    delay = POLL_INITIAL_SECONDS
+    while True:
+        job = client.describe_restore_job(RestoreJobId=restore_job_id)
+        if job["Status"] in FINISHED_RESTORE_STATES:
+            return job
+        if clock() + delay > deadline:
+            raise TimeoutError(f"restore job {restore_job_id} is still {job['Status']} after {timeout:.0f}s")
+        sleep(delay)
+        delay = min(POLL_MAX_SECONDS, delay * POLL_BACKOFF)
+
+
+def _restore_seconds(job: Dict, started: float, finished: float) -> float:
+    # AWS Backup's own times where it gives them, otherwise when the drill saw the job start and finish
+    if job.get("CreationDate") and job.get("CompletionDate"):
+        return (job["CompletionDate"] - job["CreationDate"]).total_seconds()
+    return finished - started
+
+
+def cleanup(client_factory: Callable, point: RecoveryPoint, created_resource_arn: str) -> None:
+    """
+    Delete a resource restored from a recovery point.
+
+    :param client_factory: Makes the boto3 client of an account, region and service.
+    """
+    service, method, argument, arguments = CLEANUP[point.resource_type]
+    region, account = created_resource_arn.split(":")[3:5]
+    client = client_factory(account, region, service)
+    getattr(client, method)(**{argument: _last_arn_part(created_resource_arn), **arguments})
+
+
+def drill(
+    client_factory: Callable,
+    point: RecoveryPoint,
+    role_arn: str,
+    drill_id: str,
+    keep: bool = False,
+    sleep: Callable[[float], None] = time.sleep,
+    clock: Callable[[], float] = time.monotonic,
+    timeout: float = DEFAULT_TIMEOUT_SECONDS,
+    cleanup_timeout: float = DEFAULT_CLEANUP_TIMEOUT_SECONDS,
+) -> DrillResult:
+    """
+    Restore a recovery point as a new resource, time the restore and delete what it restored.
+
+    A restore that times out or fails to be timed is waited on for cleanup_timeout longer, and what
+    it restored is deleted. One still running then is reported as needing cleanup by hand.
+
+    :param role_arn: The role the restore job runs as, the backup role of the vault's stack.
+    :param drill_id: Added to the name of the restored resource, so drills don't collide.
+    :param keep: Keep the restored resource rather than deleting it.
+    """
+    result = DrillResult(point.recovery_point_arn, point.resource_arn, point.resource_type, point.vault_class)
+    if role_arn is None:
+        return result._replace(error="no backup role, the vault's stack doesn't exist or has no role output")
+    vault_arn_parts = point.vault_arn.split(":")
+    region, account, vault_name = vault_arn_parts[3], vault_arn_parts[4], vault_arn_parts[-1]
+    client = client_factory(account, region, "backup")
+    try:
+        metadata = client.get_recovery_point_restore_metadata(
+            BackupVaultName=vault_name, RecoveryPointArn=point.recovery_point_arn
+        )["RestoreMetadata"]
+        name = f"{_last_arn_part(point.resource_arn)[:40]}-drill-{drill_id}"
+        metadata = {**metadata, **DRILL_METADATA[point.resource_type](metadata, name)}
+        started = clock()
+        restore_job_id = client.start_restore_job(
+            RecoveryPointArn=point.recovery_point_arn,
+            Metadata=metadata,
+            IamRoleArn=role_arn,
+            ResourceType=point.resource_type,
+        )["RestoreJobId"]
+        result = result._replace(restore_job_id=restore_job_id)
+        job = wait_for_restore(client, restore_job_id, sleep, clock, timeout)
+        result = result._replace(
+            status=job["Status"],
+            seconds=_restore_seconds(job, started, clock()),
+            created_resource_arn=job.get("CreatedResourceArn"),
+        )
+        if job["Status"] != "COMPLETED":
+            result = result._replace(error=job.get("StatusMessage") or job["Status"])
+    except Exception as e:
+        result = result._replace(error=f"{type(e).__name__}: {e}")
+        if result.restore_job_id is None:
+            return result
+        # the job started, so it may yet restore a resource that has to be deleted
+        try:
+            job = wait_for_restore(client, result.restore_job_id, sleep, clock, cleanup_timeout)
+        except Exception:
+            return result._replace(
+                error=f"{result.error}, restore job {result.restore_job_id} needs cleanup by hand",
+                needs_cleanup=not keep,
+            )
+        result = result._replace(created_resource_arn=job.get("CreatedResourceArn"))
+    if result.created_resource_arn and not keep:
+        try:
+            cleanup(client_factory, point, result.created_resource_arn)
+            result = result._replace(cleaned_up=True)
+        except Exception as e:
+            cleanup_error = f"cleanup failed, {type(e).__name__}: {e}"
+            result = result._replace(
+                error=f"{result.error}, {cleanup_error}" if result.error else cleanup_error,
+                needs_cleanup=True,
+            )
+    return result
+
+
+def run_drills(
+    samples: Sequence[RecoveryPoint],
+    client_factory: Callable,
+    role_for: Callable[[str, str], str],
+    workers: int = DEFAULT_WORKERS,
+    keep: bool = False,
+    sleep: Callable[[float], None] = time.sleep,
+    clock: Callable[[], float] = time.monotonic,
+    timeout: float = DEFAULT_TIMEOUT_SECONDS,
+    cleanup_timeout: float = DEFAULT_CLEANUP_TIMEOUT_SECONDS,
+) -> List[DrillResult]:
+    """
+    Drill the samples on a bounded thread pool, returning the results in sample order.
+
+    :param role_for: Gives the backup role of an account and region, see stack_backup_role.
+    :type role_for: Callable[[str, str], str]
+    """
+    if not samples:
+        return []
+    drill_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S")
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(samples)))) as pool:
+        futures = []
+        for number, point in enumerate(samples):
+            region, account = point.vault_arn.split(":")[3:5]
+            futures.append(
+                pool.submit(
+                    drill,
+                    client_factory,
+                    point,
+                    role_for(account, region),
+                    f"{drill_id}-{number}",
+                    keep,
+                    sleep,
+                    clock,
+                    timeout,
+                    cleanup_timeout,
+                )
+            )
+        return [future.result() for future in futures]
+
+
+def _percentile(values: Sequence[float], share: float) -> float:
+    # the nearest rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def _bucket(seconds: float) -> str:
+    for minutes, bucket in zip(HISTOGRAM_MINUTES, HISTOGRAM_BUCKETS):
+        if seconds <= minutes * 60:
+            return bucket
+    return HISTOGRAM_BUCKETS[-1]
+
+
+def summarize(results: Iterable[DrillResult]) -> Dict[str, Dict]:
+    """
+    The time to restore of each vault class: how many restores, percentiles and a histogram.
+    """
+    summary: Dict[str, Dict] = {}
+    for result in results:
+        vault_class = summary.setdefault(
+            result.vault_class,
+            {
+                "restores": 0,
+                "failed": 0,
+                "histogram": dict.fromkeys(HISTOGRAM_BUCKETS, 0),
+                "seconds": [],
+            },
+        )
+        vault_class["restores"] += 1
+        if result.status != "COMPLETED":
+            vault_class["failed"] += 1
+            continue
+        vault_class["histogram"][_bucket(result.seconds)] += 1
+        vault_class["seconds"].append(result.seconds)
+    for vault_class in summary.values():
+        seconds = vault_class.pop("seconds")
+        vault_class.update(
+            p50_seconds=_percentile(seconds, 0.5) if seconds else None,
+            p95_seconds=_percentile(seconds, 0.95) if seconds else None,
+            max_seconds=max(seconds) if seconds else None,
+        )
+    return dict(sorted(summary.items()))
+
+
+def write_report(results: Sequence[DrillResult], report_path: str = None, csv_path: str = None) -> Dict:
+    """
+    Write the summary and every result as JSON, and every result as a CSV row, returning the report.
+    """
+    report = {
+        "classes": summarize(results),
+        "drills": [result._asdict() for result in results],
+    }
+    if report_path:
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+            report_file.write("\n")
+    if csv_path:
+        with open(csv_path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(DrillResult._fields)
+            writer.writerows(results)
+    return report
+
+
+class ScaledClock:
+    """
+    A clock running scale times faster than real time, whose sleeps are as much shorter.
+    """
+
+    def __init__(self, scale: float = 1.0) -> None:
+        self.scale = scale
+        self._started = time.monotonic()
+
+    def __call__(self) -> float:
+        return (time.monotonic() - self._started) * self.scale
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds / self.scale)
+
+
+class SimulatedAws:
+    """
+    Stands in for every client a drill uses, completing each restore after a simulated latency.
+
+    :param latencies: The mean minutes to restore of each (vault class, resource type), or of each
+        resource type under (None, resource type). Each restore takes within a quarter of its mean.
+    :type latencies: Dict[Tuple[str, str], float]
+    :param failure_rate: The share of restores that fail.
+    :type failure_rate: float
+    """
+
+    # the minutes a restore takes when no latency is given for it
+    DEFAULT_LATENCY_MINUTES = 30.0
+
+    def __init__(
+        self,
+        clock: Callable[[], float],
+        latencies: Dict[Tuple[str, str], float] = None,
+        failure_rate: float = 0.0,
+        seed: int = None,
+    ) -> None:
+        self.clock = clock
+        self.latencies = latencies or {}
+        self.failure_rate = failure_rate
+        self.jobs: Dict[str, Dict] = {}
+        self.deleted: List[Tuple[str, Dict]] = []
+        self.vault_classes: Dict[str, str] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, account: str, region: str, service: str) -> "SimulatedAws":
+        # the client factory, handing out this simulator for every service
+        return self
+
+    def _now(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.clock(), datetime.timezone.utc)
+
+    def get_recovery_point_restore_metadata(self, BackupVaultName: str, RecoveryPointArn: str) -> Dict:
+        # the vault class is the suffix of the vault's name, as in ipa-backup-vault-gold
+        self.vault_classes[RecoveryPointArn] = BackupVaultName.rsplit("-", 1)[-1]
+        return {"BackupVaultArn": BackupVaultName, "RecoveryPointArn": RecoveryPointArn, "RestoreMetadata": {}}
+
+    def start_restore_job(self, RecoveryPointArn: str, Metadata: Dict, IamRoleArn: str, ResourceType: str) -> Dict:
+        vault_class = self.vault_classes.get(RecoveryPointArn)
+        minutes = self.latencies.get(
+            (vault_class, ResourceType), self.latencies.get((None, ResourceType), self.DEFAULT_LATENCY_MINUTES)
+        )
+        with self._lock:
+            job_id = f"restore-{len(self.jobs) + 1}"
+            seconds = minutes * 60 * self._random.uniform(0.75, 1.25)
+            fails = self._random.random() < self.failure_rate
+            name = next(iter(Metadata.values()), job_id)
+            # restored into the region of the recovery point and the account of the role
+            region, account = RecoveryPointArn.split(":")[3], IamRoleArn.split(":")[4]
+            self.jobs[job_id] = {
+                "RestoreJobId": job_id,
+                "CreationDate": self._now(),
+                "seconds": seconds,
+                "fails": fails,
+                "CreatedResourceArn": f"arn:aws:simulated:{region}:{account}:restored/{name}",
+                "IamRoleArn": IamRoleArn,
+                "ResourceType": ResourceType,
+                "Metadata": Metadata,
+            }
+        return {"RestoreJobId": job_id}
+
+    def describe_restore_job(self, RestoreJobId: str) -> Dict:
+        job = self.jobs[RestoreJobId]
+        created = job["CreationDate"]
+        finished_at = created + datetime.timedelta(seconds=job["seconds"])
+        if self._now() < finished_at:
+            return {"RestoreJobId": RestoreJobId, "Status": "RUNNING", "CreationDate": created}
+        if job["fails"]:
+            return {"RestoreJobId": RestoreJobId, "Status": "FAILED", "StatusMessage": "simulated failure", "CreationDate": created}
+        return {
+            "RestoreJobId": RestoreJobId,
+            "Status": "COMPLETED",
+            "CreationDate": created,
+            "CompletionDate": finished_at,
+            "CreatedResourceArn": job["CreatedResourceArn"],
+        }
+
+    def __getattr__(self, name: str) -> Callable:
+        # the delete calls of every service's cleanup
+        if not name.startswith("delete_"):
+            raise AttributeError(name)
+
+        def delete(**arguments) -> Dict:
+            with self._lock:
+                self.deleted.append((name, arguments))
+            return {}
+
+        return delete
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="the recovery point catalog to sample from")
+    parser.add_argument("--vault-class", nargs="*", choices=("silver", "gold", "platinum"), help="defaults to every class")
+    parser.add_argument("--resource-type", nargs="*", choices=sorted(DRILL_METADATA), help="defaults to every type")
+    parser.add_argument("--per-group", type=int, default=DEFAULT_PER_GROUP, help="samples of each class and resource type")
+    parser.add_argument("--seed", type=int, help="seeds the samples, to drill the same resources again")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT_SECONDS, help="seconds to wait for each restore")
+    parser.add_argument("--cleanup-timeout", type=float, default=DEFAULT_CLEANUP_TIMEOUT_SECONDS, help="seconds more to wait on a timed out restore")
+    parser.add_argument("--keep", action="store_true", help="keep the restored resources")
+    parser.add_argument("--report", default="restore-drill.json", help="the JSON report")
+    parser.add_argument("--csv", help="a CSV file of every restore")
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION, help="the region of the pipeline")
+    add_stack_arguments(parser)
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help="the role assumed in each account")
+    parser.add_argument("--simulate", action="store_true", help="restore against SimulatedAws rather than AWS")
+    parser.add_argument("--time-scale", type=float, default=600.0, help="how much faster simulated time runs")
+    args = parser.parse_args(argv)
+
+    catalog = RecoveryPointCatalog(args.catalog)
+    try:
+        points = [
+            point
+            for point in catalog.restorable()
+            if (not args.vault_class or point.vault_class in args.vault_class)
+            and (not args.resource_type or point.resource_type in args.resource_type)
+        ]
+    finally:
+        catalog.close()
+    samples = select_samples(points, args.per_group, args.seed)
+
+    if args.simulate:
+        clock = ScaledClock(args.time_scale)
+        client_factory, sleep = SimulatedAws(clock, seed=args.seed), clock.sleep
+
+        def role_for(account: str, region: str) -> str:
+            return f"arn:aws:iam::{account}:role/simulated-backup-role"
+
+    else:
+        sessions = AccountSessions(role_name=args.role_name)
+        client_factory, sleep, clock = sessions.client, time.sleep, time.monotonic
+        roles: Dict[Tuple[str, str], str] = {}
+        roles_lock = threading.Lock()
+
+        def role_for(account: str, region: str) -> str:
+            with roles_lock:
+                if (account, region) not in roles:
+                    stack_name = backup_stack_name(account, region, args)
+                    roles[account, region] = stack_backup_role(
+                        sessions.client(account, region, "cloudformation"), stack_name
+                    )
+                return roles[account, region]
+
+    results = run_drills(
+        samples, client_factory, role_for, args.workers, args.keep, sleep, clock, args.timeout, args.cleanup_timeout
+    )
+    report = write_report(results, args.report, args.csv)
+
+    print(f"{'class':<10}{'restores':>9}{'failed':>7}{'p50':>9}{'p95':>9}{'max':>9}")
+    for vault_class, summary in report["classes"].items():
+        minutes = [
+            "-" if summary[key] is None else f"{summary[key] / 60:.1f}m"
+            for key in ("p50_seconds", "p95_seconds", "max_seconds")
+        ]
+        print(f"{vault_class:<10}{summary['restores']:>9}{summary['failed']:>7}{minutes[0]:>9}{minutes[1]:>9}{minutes[2]:>9}")
+    for result in results:
+        if result.error:
+            print(f"{result.recovery_point_arn}: {result.error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Stagger the backup windows of every plan across a maintenance envelope, and report the load.
+
+AWS Backup starts a plan's jobs inside the start window of its rule, so plans built from the
+stock BackupPlanRule presets all start at 05:00 UTC and every resource in the fleet is snapshotted
+at once. Each plan here gets its own window instead, picked from a hash of the account, vault class
+and frequency, so a plan keeps its window across synths while the fleet spreads over the envelope:
+
+    python -m ipa_backup.schedule --start-hour 12 --hours 8
+"""
+import argparse
+import hashlib
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+from ipa_backup.manifest import DEFAULT_HOME_REGION, FREQUENCIES, Manifest, load_manifest
+
+
+WEEKDAYS = ("SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT")
+
+# when the presets run, and the windows AWS Backup applies when a rule doesn't set its own
+STOCK_MINUTE_OF_DAY = 5 * 60
+STOCK_WEEKDAY = "SAT"
+STOCK_MONTH_DAY = 1
+STOCK_START_WINDOW_MINUTES = 8 * 60
+STOCK_COMPLETION_WINDOW_MINUTES = 7 * 24 * 60
+
+# AWS Backup's shortest start window, and the least it needs between the start and completion windows
+MIN_START_WINDOW_MINUTES = 60
+MIN_COMPLETION_MARGIN_MINUTES = 60
+
+# start times are picked on a grid, which keeps the cron expressions readable
+SLOT_MINUTES = 15
+
+# the context keys that move the envelope, e.g. cdk synth -c ipa-backup:backup-window-start=14
+ENVELOPE_START_CONTEXT_KEY = "ipa-backup:backup-window-start"
+ENVELOPE_HOURS_CONTEXT_KEY = "ipa-backup:backup-window-hours"
+
+
+class MaintenanceEnvelope(NamedTuple):
+    """
+    The hours, in UTC, that backups may run in, and the days weekly and monthly backups may run on.
+
+    :param start_hour: The hour of the day the envelope opens, in UTC.
+    :type start_hour: int
+    :param hours: How long the envelope stays open. It may run past midnight.
+    :type hours: int
+    :param weekdays: The days weekly backups may be scheduled on.
+    :type weekdays: Tuple[str, ...]
+    :param month_days: The days of the month monthly backups may be scheduled on.
+    :type month_days: Tuple[int, ...]
+    :param start_window_minutes: How long after its scheduled time a job may start.
+    :type start_window_minutes: int
+    """
+
+    start_hour: int = 12
+    hours: int = 8
+    weekdays: Tuple[str, ...] = WEEKDAYS
+    month_days: Tuple[int, ...] = tuple(range(1, 29))
+    start_window_minutes: int = MIN_START_WINDOW_MINUTES
+
+    def validate(self) -> "MaintenanceEnvelope":
+        if not 0 <= self.start_hour <= 23:
+            raise ValueError(f"the envelope must start between hour 0 and 23, not {self.start_hour}")
+        if not 1 <= self.hours <= 24:
+            raise ValueError(f"the envelope must be open for 1 to 24 hours, not {self.hours}")
+        if self.start_window_minutes < MIN_START_WINDOW_MINUTES:
+            raise ValueError(
+                f"the start window must be at least {MIN_START_WINDOW_MINUTES} minutes"
+            )
+        if self.start_window_minutes + MIN_COMPLETION_MARGIN_MINUTES > self.hours * 60:
+            raise ValueError("the start and completion windows must fit inside the envelope")
+        if not self.weekdays or set(self.weekdays) - set(WEEKDAYS):
+            raise ValueError(f"weekdays must be some of {', '.join(WEEKDAYS)}")
+        if not self.month_days or not all(1 <= day <= 28 for day in self.month_days):
+            # days 29 to 31 are missing from some months, which would skip a monthly backup
+            raise ValueError("month days must be between 1 and 28")
+        return self
+
+    @classmethod
+    def from_context(cls, node) -> "MaintenanceEnvelope":
+        """
+        The default envelope, moved by the ipa-backup:backup-window-start and -hours context.
+
+        :param node: The node of any construct in the app.
+        """
+        default = cls()
+        start_hour = node.try_get_context(ENVELOPE_START_CONTEXT_KEY)
+        hours = node.try_get_context(ENVELOPE_HOURS_CONTEXT_KEY)
+        return cls(
+            start_hour=default.start_hour if start_hour is None else int(start_hour),
+            hours=default.hours if hours is None else int(hours),
+        ).validate()
+
+
+class BackupWindow(NamedTuple):
+    """
+    When a plan's jobs start, and how long they have to start and to finish.
+
+    :param frequency: The plan's frequency, one of daily, weekly or monthly.
+    :type frequency: str
+    :param minute_of_day: When the jobs are scheduled, in minutes after midnight UTC.
+    :type minute_of_day: int
+    :param weekday: The day weekly jobs run on.
+    :type weekday: str
+    :param month_day: The day of the month monthly jobs run on.
+    :type month_day: int
+    """
+
+    frequency: str
+    minute_of_day: int
+    weekday: str
+    month_day: int
+    start_window_minutes: int
+    completion_window_minutes: int
+
+    def schedule_expression(self) -> str:
+        hour, minute = divmod(self.minute_of_day, 60)
+        if self.frequency == "weekly":
+            return f"cron({minute} {hour} ? * {self.weekday} *)"
+        if self.frequency == "monthly":
+            return f"cron({minute} {hour} {self.month_day} * ? *)"
+        return f"cron({minute} {hour} * * ? *)"
+
+    def start_days(self, days: int) -> List[int]:
+        # the days, counted from a Sunday that is also the 1st, the window opens on in a period
+        if self.frequency == "weekly":
+            weekday = WEEKDAYS.index(self.weekday)
+            return [day for day in range(days) if day % 7 == weekday]
+        if self.frequency == "monthly":
+            return [self.month_day - 1] if self.month_day <= days else []
+        return list(range(days))
+
+
+def stock_window(frequency: str) -> BackupWindow:
+    """
+    The window of the stock BackupPlanRule preset for a frequency, which every plan used to share.
+    """
+    return BackupWindow(
+        frequency=frequency,
+        minute_of_day=STOCK_MINUTE_OF_DAY,
+        weekday=STOCK_WEEKDAY,
+        month_day=STOCK_MONTH_DAY,
+        start_window_minutes=STOCK_START_WINDOW_MINUTES,
+        completion_window_minutes=STOCK_COMPLETION_WINDOW_MINUTES,
+    )
+
+
+def backup_window(
+    account: str,
+    class_value: str,
+    frequency: str,
+    envelope: MaintenanceEnvelope = None,
+    region: str = None,
+) -> BackupWindow:
+    """
+    Pick the window of one plan, deterministically, from a hash of what the plan backs up.
+
+    The start time is one of the slots that leave room for the shortest completion window AWS Backup
+    allows, and the completion window runs to the envelope's close, so jobs are done before business
+    hours.
+
+    :param account: The account the plan is deployed to.
+    :type account: str
+    :param class_value: The class of the vault the plan belongs to.
+    :type class_value: str
+    :param frequency: The plan's frequency, one of daily, weekly or monthly.
+    :type frequency: str
+    :param envelope: The hours and days backups may run in. Defaults to MaintenanceEnvelope().
+    :type envelope: MaintenanceEnvelope
+    :param region: The region the plan is deployed to, so each region of an account starts in its own
+        window. Without it, for a stack with no region yet, the window only depends on the account.
+    :type region: str
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"unknown frequency '{frequency}'")
+    envelope = (envelope or MaintenanceEnvelope()).validate()
+    plan_key = f"{account}/{class_value}/{frequency}"
+    if region is not None:
+        plan_key = f"{account}/{region}/{class_value}/{frequency}"
+    digest = hashlib.sha256(plan_key.encode("utf-8")).digest()
+
+    envelope_minutes = envelope.hours * 60
+    shortest_completion = envelope.start_window_minutes + MIN_COMPLETION_MARGIN_MINUTES
+    slots = (envelope_minutes - shortest_completion) // SLOT_MINUTES + 1
+    offset = int.from_bytes(digest[0:8], "big") % slots * SLOT_MINUTES
+    return BackupWindow(
+        frequency=frequency,
+        minute_of_day=(envelope.start_hour * 60 + offset) % (24 * 60),
+        weekday=envelope.weekdays[int.from_bytes(digest[8:16], "big") % len(envelope.weekdays)],
+        month_day=envelope.month_days[
+            int.from_bytes(digest[16:24], "big") % len(envelope.month_days)
+        ],
+        start_window_minutes=envelope.start_window_minutes,
+        completion_window_minutes=envelope_minutes - offset,
+    )
+
+
+def plan_windows(
+    account: str, class_value: str, envelope: MaintenanceEnvelope = None, region: str = None
+) -> Dict[str, BackupWindow]:
+    """
+    The window of each of a vault's daily, weekly and monthly plans, see backup_window.
+    """
+    return {
+        frequency: backup_window(account, class_value, frequency, envelope, region)
+        for frequency in FREQUENCIES
+    }
+
+
+def hourly_load(
+    plans: Iterable[Tuple[BackupWindow, int]], job_minutes: int = 60, days: int = 28
+) -> List[int]:
+    """
+    The most backup jobs running at once in each hour of a period.
+
+    AWS Backup starts a plan's jobs as soon as its window opens, so every job is assumed to start at
+    its scheduled time and run for ``job_minutes``. The period starts on a Sunday that is also the
+    1st of the month and wraps around, so jobs running past its last midnight count towards its
+    first day.
+
+    :param plans: Each plan's window and the number of resources it backs up.
+    :type plans: Iterable[Tuple[BackupWindow, int]]
+    :param job_minutes: How long a backup job is assumed to run.
+    :type job_minutes: int
+    :param days: The length of the period.
+    :type days: int
+    :return: The peak number of running jobs in each hour of the period.
+    :rtype: List[int]
+    """
+    plans = list(plans)
+    period = days * 24 * 60
+    # jobs starting and finishing, as a difference array over the minutes of the period
+    changes = [0] * period
+    for window, jobs in plans:
+        for day in window.start_days(days):
+            begin = (day * 24 * 60 + window.minute_of_day) % period
+            changes[begin] += jobs
+            changes[(begin + job_minutes) % period] -= jobs
+
+    # jobs still running across the end of the period were started before its first minute
+    running = sum(
+        jobs
+        for window, jobs in plans
+        for day in window.start_days(days)
+        if (day * 24 * 60 + window.minute_of_day) % period + job_minutes > period
+    )
+    load = []
+    for hour in range(days * 24):
+        peak = 0
+        for minute in range(hour * 60, hour * 60 + 60):
+            running += changes[minute]
+            peak = max(peak, running)
+        load.append(peak)
+    return load
+
+
+def manifest_plans(
+    manifest: Manifest,
+    envelope: MaintenanceEnvelope = None,
+    staggered: bool = True,
+    home_region: str = DEFAULT_HOME_REGION,
+) -> List[Tuple[BackupWindow, int]]:
+    """
+    The window and resource count of the plan backing up each account/region's resources of each frequency.
+
+    Tag selections are left out, as the number of resources they match isn't known until deployment.
+
+    :param staggered: Use the windows the stacks are deployed with, or the stock preset windows.
+    :type staggered: bool
+    :param home_region: The region that resources without a region, such as s3 buckets, are backed up from.
+    :type home_region: str
+    """
+    plans = []
+    for account, region in manifest.targets(home_region):
+        for frequency in manifest.frequencies(account):
+            jobs = len(manifest.resources(account, frequency, region, home_region))
+            if staggered:
+                window = backup_window(
+                    account, manifest.vault_class(account), frequency, envelope, region
+                )
+            else:
+                window = stock_window(frequency)
+            plans.append((window, jobs))
+    return plans
+
+
+def load_report(
+    manifest: Manifest,
+    envelope: MaintenanceEnvelope = None,
+    job_minutes: int = 60,
+    days: int = 28,
+    home_region: str = DEFAULT_HOME_REGION,
+) -> Dict:
+    """
+    Compare the expected concurrent jobs of the staggered windows against the stock windows.
+
+    :return: The peak of each, and for each hour of the day in UTC its busiest and mean load.
+    :rtype: Dict
+    """
+    loads = {
+        name: hourly_load(manifest_plans(manifest, envelope, staggered, home_region), job_minutes, days)
+        for name, staggered in (("staggered", True), ("stock", False))
+    }
+    hours = []
+    for hour in range(24):
+        row = {"hour": hour}
+        for name, load in loads.items():
+            samples = load[hour::24]
+            row[f"{name}_peak"] = max(samples)
+            row[f"{name}_mean"] = round(sum(samples) / len(samples), 1)
+        hours.append(row)
+    return {
+        "staggered_peak": max(loads["staggered"]),
+        "stock_peak": max(loads["stock"]),
+        "hours": hours,
+    }
+
+
+def main(argv: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    default = MaintenanceEnvelope()
+    parser.add_argument("--manifest", default=None, help="the resource manifest to report on")
+    parser.add_argument("--start-hour", type=int, default=default.start_hour, help="UTC hour the envelope opens")
+    parser.add_argument("--hours", type=int, default=default.hours, help="how long the envelope is open")
+    parser.add_argument("--job-minutes", type=int, default=60, help="the assumed length of a backup job")
+    parser.add_argument("--home-region", default=DEFAULT_HOME_REGION, help="the region of the pipeline")
+    args = parser.parse_args(argv)
+
+    envelope = MaintenanceEnvelope(start_hour=args.start_hour, hours=args.hours).validate()
+    report = load_report(load_manifest(args.manifest), envelope, args.job_minutes, home_region=args.home_region)
+    print("hour (UTC)  staggered peak  staggered mean  stock peak  stock mean")
+    for row in report["hours"]:
+        print(
+            f"{row['hour']:02d}:00       {row['staggered_peak']:>14}  {row['staggered_mean']:>14}"
+            f"  {row['stock_peak']:>10}  {row['stock_mean']:>10}"
+        )
+    print(f"peak concurrent jobs: {report['staggered_peak']} staggered, {report['stock_peak']} stock")
+
+
+if __name__ == "__main__":
+    main()
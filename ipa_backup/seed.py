@@ -0,0 +1,209 @@
+import hashlib
+import os
+import re
+import zipfile
+from os import path
+from shutil import copyfileobj
+from typing import List, Tuple
+
+from ipa_backup.profiling import profiled
+
+
+dirname = path.dirname(__file__)
+
+# the repository the seed archive is built from
+REPOSITORY_ROOT = path.abspath(path.join(dirname, ".."))
+
+# where built archives are kept, named by the digest of their content
+SEED_CACHE_DIRECTORY = ".seed-cache"
+
+# never shipped in the seed, whatever the .gitignore says
+DEFAULT_IGNORE_PATTERNS = (
+    ".git/",
+    ".venv/",
+    "cdk.out/",
+    "build/",
+    f"{SEED_CACHE_DIRECTORY}/",
+    "__pycache__/",
+    "*.pyc",
+    "*.zip",
+)
+
+# how many archives to keep in the cache once a new one has been built
+CACHED_ARCHIVES = 3
+
+# zip entries are written with a fixed timestamp so identical trees give identical archives
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def _translate(pattern: str) -> str:
+    # translate the glob part of a .gitignore pattern into a regular expression
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern[i : i + 3] == "**/":
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern[i : i + 2] == "**":
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1 :]:
+            end = pattern.index("]", i + 1)
+            characters = pattern[i + 1 : end]
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            regex += f"[{characters}]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """
+    The subset of .gitignore semantics needed to pick the files that belong in the seed.
+
+    Supports comments, negation with ``!``, directory-only patterns ending in ``/``, patterns
+    anchored to the root by a leading or inner ``/``, and ``*``, ``?``, ``[...]`` and ``**`` globs.
+    Later patterns override earlier ones, as they do in git.
+
+    :param patterns: The lines of a .gitignore file.
+    :type patterns: List[str]
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        self._rules: List[Tuple[re.Pattern, bool, bool]] = []
+        for line in patterns:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if "/" in line:
+                # anchored to the root of the repository
+                regex = _translate(line.lstrip("/"))
+            else:
+                # matches the name at any depth
+                regex = "(?:.*/)?" + _translate(line)
+            self._rules.append((re.compile(f"^{regex}$"), negated, directory_only))
+
+    @classmethod
+    def for_repository(cls, root: str) -> "IgnoreRules":
+        patterns = list(DEFAULT_IGNORE_PATTERNS)
+        gitignore = path.join(root, ".gitignore")
+        if path.isfile(gitignore):
+            with open(gitignore, "r") as f:
+                patterns.extend(f.readlines())
+        return cls(patterns)
+
+    def ignored(self, relative_path: str, is_directory: bool = False) -> bool:
+        ignored = False
+        for regex, negated, directory_only in self._rules:
+            if directory_only and not is_directory:
+                continue
+            if regex.match(relative_path):
+                ignored = not negated
+        return ignored
+
+
+def list_seed_files(root: str = REPOSITORY_ROOT, rules: IgnoreRules = None) -> List[str]:
+    """
+    List the files that belong in the seed, as sorted root-relative posix paths.
+
+    Ignored directories are pruned from the walk rather than filtered afterwards, so a large
+    .venv or cdk.out costs nothing.
+    """
+    rules = rules or IgnoreRules.for_repository(root)
+    files = []
+    for current, directories, filenames in os.walk(root):
+        relative = path.relpath(current, root).replace(os.sep, "/")
+        relative = "" if relative == "." else relative + "/"
+        directories[:] = [
+            d for d in directories if not rules.ignored(relative + d, is_directory=True)
+        ]
+        files.extend(
+            relative + f for f in filenames if not rules.ignored(relative + f)
+        )
+    return sorted(files)
+
+
+def seed_digest(root: str, files: List[str]) -> str:
+    # the digest covers the name, mode and content of every file in the seed
+    digest = hashlib.sha256()
+    for relative in files:
+        full_path = path.join(root, relative)
+        digest.update(relative.encode("utf-8") + b"\0")
+        digest.update(oct(os.stat(full_path).st_mode & 0o777).encode("ascii") + b"\0")
+        with open(full_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _write_archive(root: str, files: List[str], archive_path: str) -> None:
+    # stream each file straight into the archive, there is no staging copy of the tree
+    partial_path = archive_path + ".partial"
+    with zipfile.ZipFile(partial_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for relative in files:
+            full_path = path.join(root, relative)
+            info = zipfile.ZipInfo(relative, date_time=ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (os.stat(full_path).st_mode & 0o777 | 0o100000) << 16
+            with open(full_path, "rb") as source, archive.open(info, "w") as target:
+                copyfileobj(source, target, 1 << 20)
+    os.replace(partial_path, archive_path)
+
+
+def _prune_cache(cache_directory: str, keep: str) -> None:
+    archives = [
+        path.join(cache_directory, name)
+        for name in os.listdir(cache_directory)
+        if name.endswith(".zip")
+    ]
+    archives.sort(key=path.getmtime, reverse=True)
+    for archive in archives[CACHED_ARCHIVES:]:
+        if archive != keep:
+            os.remove(archive)
+
+
+@profiled
+def build_seed_archive(root: str = REPOSITORY_ROOT, cache_directory: str = None) -> str:
+    """
+    Build the zip used to seed the CodeCommit repository, or reuse the cached one.
+
+    The archive is content addressed: it is named after a digest of the included files, and an
+    unchanged tree reuses the archive from the previous synth instead of zipping it again.
+    Archives are byte-for-byte reproducible, so the asset hash only moves when the code does.
+
+    :param root: The repository to archive. Defaults to this repository.
+    :type root: str
+    :param cache_directory: Where archives are cached. Defaults to .seed-cache under the root.
+    :type cache_directory: str
+    :return: The path of the archive.
+    :rtype: str
+    """
+    root = path.abspath(root)
+    cache_directory = cache_directory or path.join(root, SEED_CACHE_DIRECTORY)
+    files = list_seed_files(root)
+    archive_path = path.join(cache_directory, f"seed-{seed_digest(root, files)}.zip")
+
+    if path.isfile(archive_path):
+        # mark it as recently used so it survives pruning
+        os.utime(archive_path)
+        return archive_path
+
+    os.makedirs(cache_directory, exist_ok=True)
+    _write_archive(root, files, archive_path)
+    _prune_cache(cache_directory, keep=archive_path)
+    return archive_path
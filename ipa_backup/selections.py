@@ -0,0 +1,179 @@
+import hashlib
+import re
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+# AWS Backup accepts up to 500 ARNs in a single selection, but only 30 of them may contain wildcards
+MAX_RESOURCES_PER_SELECTION = 500
+MAX_WILDCARDS_PER_SELECTION = 30
+
+# the resource types a tag selection can be scoped to, and the wildcard ARN that covers each of them
+RESOURCE_TYPE_ARNS = {
+    "Aurora": "arn:aws:rds:*:*:cluster:*",
+    "DynamoDB": "arn:aws:dynamodb:*:*:table/*",
+    "EBS": "arn:aws:ec2:*:*:volume/*",
+    "EC2": "arn:aws:ec2:*:*:instance/*",
+    "EFS": "arn:aws:elasticfilesystem:*:*:file-system/*",
+    "FSx": "arn:aws:fsx:*:*:file-system/*",
+    "RDS": "arn:aws:rds:*:*:db:*",
+    "S3": "arn:aws:s3:::*",
+    "StorageGateway": "arn:aws:storagegateway:*:*:gateway/*",
+}
+
+# the resources AWS Backup can back up continuously for point-in-time restores, by the service and
+# resource type in their ARN. None allows every resource of the service.
+CONTINUOUS_BACKUP_RESOURCES = {
+    "rds": ("db", "cluster"),
+    "s3": None,
+}
+
+
+class TagSelection(NamedTuple):
+    """
+    A selection that enrolls resources by tag instead of by ARN.
+
+    :param selection_id: The id of the selection within its plan.
+    :param frequency: The plan the selection belongs to, one of daily, weekly or monthly.
+    :param tags: The tag key/value pairs a resource must carry, all of them, to be selected.
+    :param resource_types: The resource types to select from, see RESOURCE_TYPE_ARNS. Empty selects every type.
+    """
+
+    selection_id: str
+    frequency: str
+    tags: Tuple[Tuple[str, str], ...]
+    resource_types: Tuple[str, ...] = ()
+
+    @property
+    def name(self) -> str:
+        # the construct id of the selection
+        return f"{self.frequency.capitalize()}TagSelection-{self.selection_id}"
+
+    def resource_arns(self) -> Tuple[str, ...]:
+        if not self.resource_types:
+            return ("*",)
+        return tuple(RESOURCE_TYPE_ARNS[resource_type] for resource_type in self.resource_types)
+
+    def conditions(self) -> Dict[str, List[Dict[str, str]]]:
+        # the CloudFormation form of the selection's conditions, every one of which must match
+        return {
+            "StringEquals": [
+                {"ConditionKey": f"aws:ResourceTag/{key}", "ConditionValue": value}
+                for key, value in self.tags
+            ]
+        }
+
+
+def selection_name(frequency: str, selection_id: str, shard_key: str = "") -> str:
+    """
+    The construct id of a selection of ARNs: a list that fits in one selection keeps the unsharded
+    id, otherwise each shard's key is appended to it.
+    """
+    name = f"{frequency.capitalize()}BackupSelection-{selection_id}"
+    return f"{name}-{shard_key}" if shard_key else name
+
+
+def _is_wildcard(arn: str) -> bool:
+    return "*" in arn
+
+
+def supports_continuous_backup(arn: str) -> bool:
+    # arn:partition:service:region:account:resource-type:name, except s3's arn:aws:s3:::bucket
+    parts = arn.split(":")
+    if len(parts) < 6 or parts[2] not in CONTINUOUS_BACKUP_RESOURCES:
+        return False
+    resource_types = CONTINUOUS_BACKUP_RESOURCES[parts[2]]
+    return resource_types is None or parts[5] in resource_types
+
+
+def split_continuous_arns(
+    resource_arns: Iterable[str],
+) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Split ARNs into those that can be backed up continuously and those that need snapshots.
+
+    :return: The continuous ARNs and the snapshot ARNs, each in their original order.
+    :rtype: Tuple[Tuple[str, ...], Tuple[str, ...]]
+    """
+    continuous, snapshot = [], []
+    for arn in resource_arns:
+        (continuous if supports_continuous_backup(arn) else snapshot).append(arn)
+    return tuple(continuous), tuple(snapshot)
+
+
+def coalesce_arns(resource_arns: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Drop duplicate ARNs and any ARN already covered by a wildcard ARN in the same list.
+
+    For example ``arn:aws:ec2:ap-southeast-2:111111111111:volume/vol-1`` is dropped when
+    ``arn:aws:ec2:ap-southeast-2:111111111111:volume/*`` is also selected. Order is kept.
+    """
+    arns = list(dict.fromkeys(resource_arns))
+    wildcards = [arn for arn in arns if _is_wildcard(arn)]
+    if not wildcards:
+        return tuple(arns)
+
+    # only compare against wildcards sharing the literal prefix before their first '*'. AWS Backup
+    # only treats '*' as a wildcard, so '?' and '[' in an ARN match themselves
+    prefixes: Dict[str, List[Tuple[str, re.Pattern]]] = {}
+    for pattern in wildcards:
+        matcher = re.compile(re.escape(pattern).replace(r"\*", ".*"), re.DOTALL)
+        prefixes.setdefault(pattern.split("*", 1)[0], []).append((pattern, matcher))
+
+    def covered(arn: str) -> bool:
+        for prefix, patterns in prefixes.items():
+            if not arn.startswith(prefix):
+                continue
+            for pattern, matcher in patterns:
+                if pattern != arn and matcher.fullmatch(arn):
+                    return True
+        return False
+
+    return tuple(arn for arn in arns if not covered(arn))
+
+
+def _arn_hash(arn: str) -> bytes:
+    # the digest orders like the big endian number it spells, and compares faster than one
+    return hashlib.sha256(arn.encode("utf-8")).digest()
+
+
+def shard_arns(
+    resource_arns: Iterable[str],
+    max_resources: int = MAX_RESOURCES_PER_SELECTION,
+    max_wildcards: int = MAX_WILDCARDS_PER_SELECTION,
+) -> Dict[str, Tuple[str, ...]]:
+    """
+    Split ARNs into shards that each fit in a single AWS Backup selection.
+
+    Shards are the leaves of a binary trie over the sha256 of each ARN. A shard is only split,
+    on the next bit of the hash, while it holds too many ARNs or wildcards. The shard key is the
+    bit prefix it covers, with ``""`` for a list that fits in a single selection. Because an ARN
+    always hashes to the same place, adding or removing one ARN only touches the shard that holds it.
+
+    :return: The ARNs of each shard, sorted, keyed by shard key in key order.
+    :rtype: Dict[str, Tuple[str, ...]]
+    """
+    # with the ARNs in hash order every shard is a contiguous range of them, so a split is a binary
+    # search for where the next bit turns on, and a shard's wildcards a difference of running counts
+    by_hash = {_arn_hash(arn): arn for arn in set(resource_arns)}
+    hashes = sorted(by_hash)
+    wildcards = list(accumulate((_is_wildcard(by_hash[hash_]) for hash_ in hashes), initial=0))
+
+    shards = {}
+    pending = [("", 0, len(hashes))]
+    while pending:
+        key, start, end = pending.pop()
+        if start == end and key:
+            # one side of a split can come up empty, and there is nothing to select there
+            continue
+        fits = end - start <= max_resources and wildcards[end] - wildcards[start] <= max_wildcards
+        if fits or len(key) >= 256:
+            shards[key] = tuple(sorted(by_hash[hash_] for hash_ in hashes[start:end]))
+            continue
+        bit = 255 - len(key)
+        first_one = ((int(key or "0", 2) << 1 | 1) << bit).to_bytes(32, "big")
+        middle = bisect_left(hashes, first_one, start, end)
+        pending.append((key + "1", middle, end))
+        pending.append((key + "0", start, middle))
+    return dict(sorted(shards.items()))
@@ -0,0 +1,94 @@
+"""
+Build only the stacks of the cdk app that are asked for.
+
+Each top level stack of app.py is registered as a factory, and only the factories of the selected
+stacks run. A factory imports what its stack needs when it runs, so a stack that isn't selected
+costs nothing, not even its imports. The selection is a comma separated list of stack names or
+globs in the ipa-backup:stacks context or the IPA_BACKUP_STACKS environment variable, and every
+stack is built without one. The cdk cli doesn't tell the app which stacks it was asked for, so pass
+the same names to both:
+
+    cdk synth -c ipa-backup:stacks=ipa-backup-pipeline-construct ipa-backup-pipeline-construct
+"""
+import os
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+# the stacks to build, by name or glob
+STACKS_CONTEXT_KEY = "ipa-backup:stacks"
+STACKS_ENV_VAR = "IPA_BACKUP_STACKS"
+
+
+def selection_from(app) -> List[str]:
+    """
+    The stack names or globs the environment variable or the app's context asks for, if any.
+
+    :param app: The cdk App, whose context may carry the ipa-backup:stacks selection.
+    """
+    value = os.environ.get(STACKS_ENV_VAR) or app.node.try_get_context(STACKS_CONTEXT_KEY)
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [pattern.strip() for pattern in value if pattern.strip()]
+
+
+class StackRegistry:
+    """
+    The factories of an app's top level stacks, by construct id, in the order they were registered.
+    """
+
+    def __init__(self) -> None:
+        self._factories: Dict[str, Callable] = {}
+
+    def register(self, construct_id: str) -> Callable:
+        """
+        Register a function taking the app and the construct id, and returning the stack, as a factory.
+        """
+
+        def decorator(factory: Callable) -> Callable:
+            if construct_id in self._factories:
+                raise ValueError(f"a stack factory is already registered for {construct_id}")
+            self._factories[construct_id] = factory
+            return factory
+
+        return decorator
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(self._factories)
+
+    def selected(self, patterns: Sequence[str] = None) -> List[str]:
+        """
+        The registered stacks matching any of the patterns, every stack without any.
+
+        :raises ValueError: if a pattern matches no stack, which is most likely a typo.
+        """
+        if not patterns:
+            return list(self._factories)
+        unmatched = [
+            pattern
+            for pattern in patterns
+            if not any(fnmatchcase(name, pattern) for name in self._factories)
+        ]
+        if unmatched:
+            raise ValueError(
+                f"no stack matches {', '.join(unmatched)}, the stacks are {', '.join(self._factories)}"
+            )
+        return [
+            name
+            for name in self._factories
+            if any(fnmatchcase(name, pattern) for pattern in patterns)
+        ]
+
+    def build(self, app, patterns: Sequence[str] = None) -> Dict[str, object]:
+        """
+        Run the factories of the selected stacks and return the stacks they built.
+
+        :param app: The cdk App to build the stacks in.
+        :param patterns: The stacks to build. Defaults to the app's selection, see selection_from.
+        :type patterns: Sequence[str]
+        """
+        patterns = selection_from(app) if patterns is None else patterns
+        return {name: self._factories[name](app, name) for name in self.selected(patterns)}
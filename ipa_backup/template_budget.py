@@ -0,0 +1,144 @@
+import hashlib
+from itertools import count
+from typing import Dict, Iterable, Iterator
+
+
+# CloudFormation's limits for a single template. The cdk uploads templates to s3 before
+# deploying them, so the byte limit is the one for a template given by url.
+MAX_TEMPLATE_RESOURCES = 500
+MAX_TEMPLATE_BYTES = 1_000_000
+
+# stop filling a template once an estimate passes this share of a limit, which absorbs the
+# error in the estimates below and leaves room for a few hand-added resources
+HEADROOM = 0.8
+
+# what the cdk renders, measured from synthesized templates: a backup selection costs about
+# 450 bytes plus its ARNs, each ARN costs its length plus about 11 bytes of indent and quoting,
+# and the vault, role, key and plan resources average about 950 bytes each
+SELECTION_BYTES = 500
+ARN_OVERHEAD_BYTES = 12
+RESOURCE_BYTES = 1_000
+
+# a nested stack costs its parent a resource plus a parameter for each value shared with it
+NESTED_STACK_BYTES = 2_000
+NESTED_TEMPLATE_BYTES = 1_000
+
+# once the stack's own template is full, each selection goes into the nested template its key hashes
+# to, out of this many, so adding or removing one selection doesn't move the others. A selection
+# whose template is full goes into the next one with room, and past the last into a new one.
+NESTED_SLOTS = 4
+
+
+def selection_bytes(resource_arns: Iterable[str]) -> int:
+    """
+    Estimate how many bytes a backup selection of these ARNs adds to its template.
+    """
+    resource_arns = tuple(resource_arns)
+    return SELECTION_BYTES + sum(map(len, resource_arns)) + ARN_OVERHEAD_BYTES * len(resource_arns)
+
+
+def nested_slot(key: str, slots: int = NESTED_SLOTS) -> int:
+    """
+    The nested template, from 1 to slots, a selection goes into unless that template is full.
+
+    :param key: What identifies the selection within its stack, such as its construct id.
+    :type key: str
+    """
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big") % slots + 1
+
+
+class TemplateBudget:
+    """
+    A running estimate of a template's resources and bytes against CloudFormation's limits.
+
+    :param resources: The resources already in the template.
+    :type resources: int
+    :param size: The estimated bytes already in the template.
+    :type size: int
+    """
+
+    def __init__(
+        self,
+        resources: int = 0,
+        size: int = 0,
+        max_resources: int = MAX_TEMPLATE_RESOURCES,
+        max_bytes: int = MAX_TEMPLATE_BYTES,
+        headroom: float = HEADROOM,
+    ) -> None:
+        self.resources = resources
+        self.size = size
+        self.resource_limit = int(max_resources * headroom)
+        self.byte_limit = int(max_bytes * headroom)
+
+    def fits(self, resources: int, size: int) -> bool:
+        return (
+            self.resources + resources <= self.resource_limit
+            and self.size + size <= self.byte_limit
+        )
+
+    def add(self, resources: int, size: int) -> None:
+        self.resources += resources
+        self.size += size
+
+
+class TemplatePlanner:
+    """
+    Decides which template each new group of resources goes into, without building anything.
+
+    Resources stay in the stack's own template until it nears CloudFormation's limits. After that
+    each group goes into the nested template its key hashes to, see nested_slot, or the next one
+    with room when that is full. Each nested template costs the stack a resource of its own.
+
+    :param budget: The stack's own template, with what it holds before the first placement.
+    :type budget: TemplateBudget
+    """
+
+    def __init__(self, budget: TemplateBudget) -> None:
+        self.budget = budget
+        self.nested: Dict[int, TemplateBudget] = {}
+        # what the planner put into the stack's own template, kept apart so the rest can be remeasured
+        self.placed = TemplateBudget()
+
+    def remeasure(self, resources: int, size: int) -> None:
+        """
+        Replace the estimate of what the stack's own template holds besides what was placed in it,
+        for resources added to the stack since the planner was made.
+        """
+        self.budget.resources = resources + self.placed.resources
+        self.budget.size = size + self.placed.size
+
+    def _add_to_stack(self, resources: int, size: int) -> None:
+        self.budget.add(resources, size)
+        self.placed.add(resources, size)
+
+    def _candidates(self, key: str) -> Iterator[int]:
+        # the template the key hashes to, then the other slots in turn, then new templates past them
+        first = 1 if key is None else nested_slot(key)
+        yield from range(first, NESTED_SLOTS + 1)
+        yield from range(1, first)
+        yield from count(NESTED_SLOTS + 1)
+
+    def place(self, resources: int, size: int, key: str = None) -> int:
+        """
+        Reserve room for new resources and return the template they go into.
+
+        :param key: What identifies the resources within the stack, which picks their nested
+            template. Without one they go into the first nested template with room.
+        :type key: str
+        :return: 0 for the stack's own template, n for its nested template n.
+        """
+        if not self.nested and self.budget.fits(resources, size):
+            self._add_to_stack(resources, size)
+            return 0
+
+        for template in self._candidates(key):
+            nested = self.nested.get(template)
+            if nested is None:
+                self._add_to_stack(1, NESTED_STACK_BYTES)
+                nested = self.nested[template] = TemplateBudget(size=NESTED_TEMPLATE_BYTES)
+                # an empty template takes whatever it is given, a single selection is always under the limits
+                nested.add(resources, size)
+                return template
+            if nested.fits(resources, size):
+                nested.add(resources, size)
+                return template
@@ -0,0 +1,102 @@
+"""
+Synthesize one benchmark case in a fresh process and print its measurements as JSON.
+
+Each case runs in its own interpreter, and so its own jsii node process, so peak RSS is the
+case's own and not the high-water mark of everything that ran before it:
+
+    python -m tests.benchmarks.synth_case --vault-class gold --accounts 1 --arns-per-account 1000
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import aws_cdk as core
+
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+from tests.factories import make_manifest, write_manifest
+
+
+def _peak_rss_kib(pid: int) -> int:
+    # VmHWM is the peak resident set of a live process, which ru_maxrss can't give for the node child
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _process_tree(pid: int):
+    # the jsii runtime is a node wrapper that runs the kernel in a node child of its own
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _jsii_pid() -> int:
+    import jsii
+
+    process = getattr(jsii.kernel.provider, "_process", None)
+    process = getattr(process, "_process", None)
+    return getattr(process, "pid", 0)
+
+
+def run(vault_class: str, accounts: int, arns_per_account: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = make_manifest(accounts, arns_per_account, vault_class=vault_class)
+        manifest_path = write_manifest(directory, manifest)
+        outdir = os.path.join(directory, "cdk.out")
+
+        started = time.perf_counter()
+        app = core.App(outdir=outdir)
+        for account in manifest:
+            IpaBackupStack(
+                app,
+                f"ipa-backup-{account}",
+                env=core.Environment(account=account, region="ap-southeast-2"),
+                manifest_path=manifest_path,
+            )
+        app.synth()
+        seconds = time.perf_counter() - started
+
+        template_bytes = sum(
+            os.path.getsize(os.path.join(outdir, name))
+            for name in os.listdir(outdir)
+            if name.endswith(".template.json")
+        )
+
+    python_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(
+            (python_kib + sum(_peak_rss_kib(pid) for pid in _process_tree(_jsii_pid()))) / 1024, 1
+        ),
+        "template_bytes": template_bytes,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vault-class", default="silver")
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--arns-per-account", type=int, default=10)
+    args = parser.parse_args(argv)
+    result = run(args.vault_class, args.accounts, args.arns_per_account)
+    # the vault constructs print warnings, so the result always goes out on the last line
+    sys.stdout.write("\n" + json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
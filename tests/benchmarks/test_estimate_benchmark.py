@@ -0,0 +1,29 @@
+import time
+
+from ipa_backup.estimate import estimate_manifest
+from ipa_backup.manifest import parse_manifest
+from ipa_backup.template_budget import NESTED_SLOTS
+from tests.factories import make_manifest
+
+
+def test_estimating_the_whole_organization_takes_under_a_second():
+    # 500 accounts of 100 ARNs, and ten that spill into nested stacks with 20,000 each
+    document = make_manifest(500, 100)
+    large = make_manifest(510, 20_000)
+    for account in list(large)[500:]:
+        document[account] = large[account]
+    manifest = parse_manifest(document)
+
+    # the best of three runs, so a busy machine doesn't fail the benchmark
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        estimates = estimate_manifest(manifest)
+        timings.append(time.perf_counter() - started)
+    elapsed = min(timings)
+
+    print(f"\n{len(estimates)} stacks and {manifest.arn_count():,} ARNs estimated in {elapsed * 1000:.0f}ms")
+    assert len(estimates) == 510
+    # each large account spreads the selections it spills over every nested slot
+    assert sum(estimate.nested_stacks for estimate in estimates) == 10 * NESTED_SLOTS
+    assert elapsed < 1
@@ -0,0 +1,30 @@
+import time
+
+from ipa_backup.manifest import clear_cache, load_manifest
+from tests.factories import make_manifest, write_manifest
+
+
+# 500 accounts x 100 ARNs = a 50k ARN organisation manifest
+ACCOUNTS = 500
+ARNS_PER_ACCOUNT = 100
+
+
+def test_manifest_load_500_accounts_50k_arns(tmp_path):
+    manifest_path = write_manifest(tmp_path, make_manifest(ACCOUNTS, ARNS_PER_ACCOUNT))
+    clear_cache()
+
+    started = time.perf_counter()
+    manifest = load_manifest(manifest_path)
+    cold = time.perf_counter() - started
+
+    # every stack in the app asks for the manifest, and all but the first should hit the cache
+    started = time.perf_counter()
+    for account in manifest.accounts:
+        for frequency in ("daily", "weekly", "monthly"):
+            load_manifest(manifest_path).resources(account, frequency)
+    warm = time.perf_counter() - started
+
+    print(f"\ncold load: {cold * 1000:.1f}ms, {ACCOUNTS * 3} memoized lookups: {warm * 1000:.1f}ms")
+    assert manifest.arn_count() == ACCOUNTS * ARNS_PER_ACCOUNT
+    assert cold < 2.0
+    assert warm < cold
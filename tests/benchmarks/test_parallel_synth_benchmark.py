@@ -0,0 +1,34 @@
+import os
+import time
+
+import pytest
+
+from ipa_backup.manifest import load_manifest
+from ipa_backup.parallel_synth import parallel_synth, synth_targets
+from tests.factories import make_manifest, write_manifest
+
+
+ACCOUNTS = 200
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="needs more than one cpu")
+def test_parallel_synth_scales_with_cores(tmp_path):
+    manifest_path = write_manifest(tmp_path, make_manifest(ACCOUNTS, 30))
+    targets = load_manifest(manifest_path).targets()
+    workers = min(os.cpu_count(), 8)
+
+    started = time.perf_counter()
+    synth_targets(str(tmp_path / "single"), targets, manifest_path)
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    parallel_synth(str(tmp_path / "parallel"), workers=workers, manifest_path=manifest_path)
+    parallel = time.perf_counter() - started
+
+    speedup = single / parallel
+    print(
+        f"\n{ACCOUNTS} accounts: single process {single:.1f}s, "
+        f"{workers} workers {parallel:.1f}s ({speedup:.1f}x)"
+    )
+    # each worker pays for its own jsii runtime, so allow for that start up cost
+    assert speedup > workers * 0.4
@@ -0,0 +1,42 @@
+import time
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from ipa_backup.manifest import clear_cache
+from ipa_backup.pipeline_stack import Pipeline
+from tests.factories import make_manifest, write_manifest
+
+
+ACCOUNTS = 200
+WAVE_WIDTH = 25
+
+
+def test_200_account_pipeline_synth(tmp_path):
+    manifest_path = write_manifest(tmp_path, make_manifest(ACCOUNTS, 3))
+    clear_cache()
+
+    started = time.perf_counter()
+    app = core.App(context={"ipa-backup:wave-width": WAVE_WIDTH})
+    stack = Pipeline(
+        app,
+        "pipeline",
+        repository_name="ipa-backup",
+        branch_name="master",
+        manifest_path=manifest_path,
+        env=core.Environment(account="100000000000", region="ap-southeast-2"),
+    )
+    template = assertions.Template.from_stack(stack)
+    elapsed = time.perf_counter() - started
+
+    (pipeline,) = template.find_resources("AWS::CodePipeline::Pipeline").values()
+    waves = [s for s in pipeline["Properties"]["Stages"] if s["Name"].startswith("wave-")]
+    deploys = [
+        [a for a in wave["Actions"] if a["Name"].endswith(".Deploy")] for wave in waves
+    ]
+    print(f"\n{ACCOUNTS} account pipeline synthesized in {elapsed:.1f}s")
+    assert len(waves) == ACCOUNTS // WAVE_WIDTH
+    assert all(len(actions) == WAVE_WIDTH for actions in deploys)
+    # every stage in a wave deploys at the same time
+    assert all(len({a["RunOrder"] for a in actions}) == 1 for actions in deploys)
+    assert elapsed < 300
@@ -0,0 +1,29 @@
+import time
+
+from ipa_backup.seed import build_seed_archive, list_seed_files
+
+
+def test_seed_build_on_a_tree_with_a_large_venv_and_cdk_out(tmp_path):
+    # a small repository next to a virtualenv and cloud assembly of 20k files between them
+    for i in range(50):
+        (tmp_path / "ipa_backup").mkdir(exist_ok=True)
+        (tmp_path / "ipa_backup" / f"module_{i}.py").write_text("x = 1\n" * 200)
+    for directory in (".venv/lib/site-packages", "cdk.out"):
+        for package in range(100):
+            package_path = tmp_path / directory / f"package_{package}"
+            package_path.mkdir(parents=True)
+            for i in range(100):
+                (package_path / f"file_{i}.py").write_text("y = 2\n" * 50)
+    cache = str(tmp_path / ".seed-cache")
+
+    started = time.perf_counter()
+    archive = build_seed_archive(str(tmp_path), cache)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    assert build_seed_archive(str(tmp_path), cache) == archive
+    warm = time.perf_counter() - started
+
+    print(f"\ncold seed build: {cold * 1000:.1f}ms, unchanged tree: {warm * 1000:.1f}ms")
+    assert len(list_seed_files(str(tmp_path))) == 50
+    assert warm < 0.5
@@ -0,0 +1,44 @@
+import json
+import time
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from ipa_backup.constructs.vaults import SilverIpaVaultCustomConstruct
+from tests.factories import make_manifest
+
+
+ACCOUNT = "100000000000"
+
+
+def synth(add_selections):
+    app = core.App()
+    stack = core.Stack(app, "selection-mode")
+    vault = SilverIpaVaultCustomConstruct(stack, "silver", organization_id="o-test")
+    started = time.perf_counter()
+    add_selections(vault)
+    template = assertions.Template.from_stack(stack).to_json()
+    return time.perf_counter() - started, len(json.dumps(template))
+
+
+@pytest.mark.parametrize("fleet_size", [1_000, 10_000, 50_000])
+def test_tag_mode_template_size_is_independent_of_fleet_size(fleet_size):
+    arns = make_manifest(1, fleet_size, frequencies=("daily",))[ACCOUNT]["daily"]
+
+    arn_seconds, arn_bytes = synth(
+        lambda vault: vault.add_resource_to_daily_plan(resource_arns=arns, selection_id="all")
+    )
+    # the fleet is enrolled by tagging the volumes, so the selection is the same at any size
+    tag_seconds, tag_bytes = synth(
+        lambda vault: vault.add_tag_selection(
+            frequency="daily", tags={"backup-class": "silver"}, resource_types=["EBS"]
+        )
+    )
+
+    print(
+        f"\n{fleet_size} resources: arn mode {arn_bytes} bytes in {arn_seconds:.2f}s, "
+        f"tag mode {tag_bytes} bytes in {tag_seconds:.2f}s"
+    )
+    assert tag_bytes < 20_000
+    assert tag_bytes < arn_bytes
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from os import path
+
+
+REPOSITORY_ROOT = path.abspath(path.join(path.dirname(__file__), "..", ".."))
+
+# what the cdk cli runs, every stack as for `cdk ls`, and a single stack as for `cdk synth <stack>`
+SELECTIONS = {
+    "every stack": None,
+    "pipeline only": "ipa-backup-pipeline-construct",
+    "code repository only": "ipa-backup-code-construct",
+}
+
+
+def run_app(outdir: str, selection: str = None) -> float:
+    # app.py in a fresh process, the way the cdk cli runs it, returning its wall time
+    environment = dict(os.environ, CDK_OUTDIR=outdir)
+    environment.pop("IPA_BACKUP_STACKS", None)
+    if selection:
+        environment["CDK_CONTEXT_JSON"] = json.dumps({"ipa-backup:stacks": selection})
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "app.py"],
+        cwd=REPOSITORY_ROOT,
+        env=environment,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def test_single_stack_startup_skips_the_other_stacks(tmp_path):
+    # the first run warms the seed cache and the jsii bundle, as any run after the first would find them
+    run_app(str(tmp_path / "warm-up"))
+    timings = {
+        name: run_app(str(tmp_path / name.replace(" ", "-")), selection)
+        for name, selection in SELECTIONS.items()
+    }
+    print("\n" + ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in timings.items()))
+
+    assert not any(
+        name.startswith("asset.") for name in os.listdir(tmp_path / "pipeline-only")
+    ), "the seed archive is only staged when the code repository stack is built"
+    assert timings["pipeline only"] < timings["every stack"]
+    assert timings["code repository only"] < timings["every stack"]
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+from os import path
+
+import pytest
+
+
+# the baselines are recorded on the build agent with:
+#   python -m pytest tests/benchmarks/test_synth_scaling.py --run-benchmarks --update-baselines
+BASELINES_PATH = path.join(path.dirname(__file__), "baselines.json")
+
+# how far a measurement may drift above its baseline before the benchmark fails. Timings and
+# memory vary between machines, template bytes are deterministic and only get a little slack.
+TOLERANCES = {
+    "seconds": float(os.environ.get("IPA_BACKUP_BENCHMARK_TIME_TOLERANCE", "0.5")),
+    "peak_rss_mb": float(os.environ.get("IPA_BACKUP_BENCHMARK_RSS_TOLERANCE", "0.3")),
+    "template_bytes": 0.02,
+}
+
+VAULT_CLASSES = ["silver", "gold", "platinum"]
+
+# one account with a growing number of ARNs, then a growing number of accounts with 100 ARNs each
+CASES = [(1, arns) for arns in (10, 1_000, 10_000, 50_000)] + [
+    (accounts, 100) for accounts in (50, 500)
+]
+
+REPOSITORY_ROOT = path.abspath(path.join(path.dirname(__file__), "..", ".."))
+
+
+def case_id(vault_class: str, accounts: int, arns_per_account: int) -> str:
+    return f"{vault_class}-{accounts}x{arns_per_account}"
+
+
+def load_baselines() -> dict:
+    if not path.isfile(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def baselines(request):
+    baselines = load_baselines()
+    yield baselines
+    if request.config.getoption("--update-baselines"):
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+
+
+def synth_case(vault_class: str, accounts: int, arns_per_account: int) -> dict:
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "tests.benchmarks.synth_case",
+            f"--vault-class={vault_class}",
+            f"--accounts={accounts}",
+            f"--arns-per-account={arns_per_account}",
+        ],
+        cwd=REPOSITORY_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("accounts,arns_per_account", CASES)
+@pytest.mark.parametrize("vault_class", VAULT_CLASSES)
+def test_synth_scaling(request, baselines, vault_class, accounts, arns_per_account):
+    name = case_id(vault_class, accounts, arns_per_account)
+    result = synth_case(vault_class, accounts, arns_per_account)
+    print(f"\n{name}: {result}")
+
+    if request.config.getoption("--update-baselines"):
+        baselines[name] = result
+        return
+
+    baseline = baselines.get(name)
+    if baseline is None:
+        pytest.skip(f"no baseline recorded for {name}, run with --update-baselines")
+    regressions = [
+        f"{metric} {result[metric]} is more than {tolerance:.0%} over the baseline {baseline[metric]}"
+        for metric, tolerance in TOLERANCES.items()
+        if result[metric] > baseline[metric] * (1 + tolerance)
+    ]
+    assert not regressions, f"{name} regressed: " + "; ".join(regressions)
@@ -0,0 +1,40 @@
+import pytest
+
+
+# the benchmarks are slow and timing sensitive, so they only run when asked for:
+#   python -m pytest tests/benchmarks --run-benchmarks
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-benchmarks",
+        action="store_true",
+        default=False,
+        help="run the synthesis and manifest benchmarks",
+    )
+    parser.addoption(
+        "--update-baselines",
+        action="store_true",
+        default=False,
+        help="record the benchmark results as the new baselines instead of comparing against them",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --run-benchmarks")
+    for item in items:
+        if "benchmarks" in item.nodeid.split("/"):
+            item.add_marker(skip)
+
+
+# synthesized templates are cached across runs in pytest's cache directory, see tests/synth_cache.py.
+# python -m pytest --cache-clear synthesizes everything again.
+@pytest.fixture(scope="session")
+def synth_cache(request, tmp_path_factory):
+    from tests.synth_cache import SynthCache
+
+    cache = getattr(request.config, "cache", None)
+    if cache is None:
+        # the cache provider is disabled, so the templates are only kept for this session
+        return SynthCache(tmp_path_factory.mktemp("synth-cache"))
+    return SynthCache(cache.mkdir("ipa-backup-synth"))
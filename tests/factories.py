@@ -0,0 +1,33 @@
+import json
+from os import path
+from typing import Dict, List
+
+
+def make_manifest(
+    accounts: int,
+    arns_per_account: int,
+    frequencies=("daily", "weekly", "monthly"),
+    vault_class: str = None,
+) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Build a synthetic resource manifest with unique volume ARNs spread over the frequencies.
+    """
+    manifest = {}
+    for a in range(accounts):
+        account = f"{100000000000 + a}"
+        manifest[account] = {frequency: [] for frequency in frequencies}
+        if vault_class:
+            manifest[account]["vault_class"] = vault_class
+        for r in range(arns_per_account):
+            frequency = frequencies[r % len(frequencies)]
+            manifest[account][frequency].append(
+                f"arn:aws:ec2:ap-southeast-2:{account}:volume/vol-{a:05d}{r:012x}"
+            )
+    return manifest
+
+
+def write_manifest(directory, manifest: dict, name: str = "resources.json") -> str:
+    manifest_path = path.join(str(directory), name)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    return manifest_path
@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from importlib import metadata
+from os import path
+from typing import Dict, List, NamedTuple, Tuple
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+from ipa_backup.manifest import clear_cache
+from tests.factories import write_manifest
+
+
+PACKAGE_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))), "ipa_backup")
+
+# the files a template is built from: the constructs, the lambdas shipped as assets and the default manifest
+SOURCE_SUFFIXES = (".py", ".json")
+
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint() -> str:
+    """
+    A digest of the package's source files and the CDK version, worked out once per session.
+    """
+    digest = hashlib.sha256(metadata.version("aws-cdk-lib").encode("utf-8"))
+    for directory, directories, files in sorted(os.walk(PACKAGE_PATH)):
+        directories[:] = sorted(name for name in directories if name != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(SOURCE_SUFFIXES):
+                file_path = path.join(directory, name)
+                digest.update(path.relpath(file_path, PACKAGE_PATH).encode("utf-8"))
+                with open(file_path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class SynthesizedStack(NamedTuple):
+    """
+    The templates an IpaBackupStack synthesized to, as they were written to the cloud assembly.
+
+    :param files: The text of every template file, by file name, the stack's own first and then
+        its nested templates.
+    """
+
+    stack_name: str
+    files: Dict[str, str]
+
+    @property
+    def template(self) -> assertions.Template:
+        return assertions.Template.from_json(json.loads(self.files[f"{self.stack_name}.template.json"]))
+
+    def templates(self) -> List[Tuple[str, dict]]:
+        return [(name, json.loads(text)) for name, text in self.files.items()]
+
+
+class SynthCache:
+    """
+    Synthesize IpaBackupStacks once and keep their templates on disk, for this and later test runs.
+
+    An entry is keyed on the package's source files, the manifest, the context and the stack's
+    arguments, so any change to those synthesizes again. Entries are written to a temporary file
+    and renamed into place, so test processes running in parallel can share the directory.
+
+    :param directory: Where the templates are kept.
+    :type directory: str
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = str(directory)
+        self.synthesized = 0
+        self._memory: Dict[str, SynthesizedStack] = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(
+        self,
+        construct_id: str,
+        account: str = None,
+        region: str = None,
+        context: Dict = None,
+        manifest: Dict = None,
+        **stack_kwargs,
+    ) -> str:
+        inputs = {
+            "source": source_fingerprint(),
+            "construct_id": construct_id,
+            "account": account,
+            "region": region,
+            "context": context or {},
+            "manifest": manifest,
+            "stack_kwargs": stack_kwargs,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def synth(
+        self,
+        construct_id: str = "ipa-backup",
+        account: str = None,
+        region: str = None,
+        context: Dict = None,
+        manifest: Dict = None,
+        **stack_kwargs,
+    ) -> SynthesizedStack:
+        """
+        The templates of an IpaBackupStack, synthesized only if they aren't cached already.
+
+        :param account: The account of the stack's environment. Without it the stack is environment agnostic.
+        :param context: The context of the app the stack is built in.
+        :param manifest: The resource manifest, as a dictionary. Defaults to the package's manifest.
+        :param stack_kwargs: Any other IpaBackupStack arguments, which must be JSON serializable.
+        """
+        key = self.key(construct_id, account, region, context, manifest, **stack_kwargs)
+        if key in self._memory:
+            return self._memory[key]
+        entry_path = path.join(self.directory, f"{key}.json")
+        if path.exists(entry_path):
+            with open(entry_path) as f:
+                synthesized = SynthesizedStack(**json.load(f))
+        else:
+            synthesized = self._synth(construct_id, account, region, context, manifest, stack_kwargs)
+            handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(handle, "w") as f:
+                json.dump(synthesized._asdict(), f)
+            os.replace(temporary_path, entry_path)
+        self._memory[key] = synthesized
+        return synthesized
+
+    def _synth(self, construct_id, account, region, context, manifest, stack_kwargs) -> SynthesizedStack:
+        self.synthesized += 1
+        with tempfile.TemporaryDirectory() as directory:
+            if manifest is not None:
+                clear_cache()
+                stack_kwargs = dict(stack_kwargs, manifest_path=write_manifest(directory, manifest))
+            outdir = path.join(directory, "cdk.out")
+            app = core.App(outdir=outdir, context=context)
+            environment = core.Environment(account=account, region=region) if account or region else None
+            stack = IpaBackupStack(app, construct_id, env=environment, **stack_kwargs)
+            app.synth()
+            names = sorted(
+                (name for name in os.listdir(outdir) if name.endswith(".template.json")),
+                key=lambda name: (name != f"{stack.artifact_id}.template.json", name),
+            )
+            files = {}
+            for name in names:
+                with open(path.join(outdir, name)) as f:
+                    files[name] = f.read()
+        return SynthesizedStack(stack.artifact_id, files)
@@ -0,0 +1,82 @@
+import json
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from ipa_backup.constructs.account_resources import legacy_logical_id
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+from tests.factories import make_manifest, write_manifest
+
+
+ACCOUNT = "100000000000"
+
+
+def _stack(tmp_path, vault_classes=None, context=None):
+    # a gold account, with the other classes asked for
+    app = core.App(context=context)
+    stack = IpaBackupStack(
+        app,
+        "ipa-backup",
+        env=core.Environment(account=ACCOUNT, region="ap-southeast-2"),
+        vault_classes=vault_classes,
+        manifest_path=write_manifest(tmp_path, make_manifest(1, 3, vault_class="gold")),
+    )
+    return stack, assertions.Template.from_stack(stack)
+
+
+def _shared_ids(template):
+    resources = template.to_json()["Resources"]
+    return {
+        logical_id: resource["Type"]
+        for logical_id, resource in resources.items()
+        if resource["Type"] in ("AWS::KMS::Key", "AWS::IAM::Role", "AWS::IAM::Policy")
+    }
+
+
+def test_all_three_tiers_share_one_role_and_key(tmp_path):
+    stack, template = _stack(tmp_path, vault_classes=["silver", "gold", "platinum"])
+    template.resource_count_is("AWS::Backup::BackupVault", 3)
+    template.resource_count_is("AWS::IAM::Role", 1)
+    # the iam:PassRole policy and the role's default policy with the key grant
+    template.resource_count_is("AWS::IAM::Policy", 2)
+    template.resource_count_is("AWS::KMS::Key", 1)
+    roles = {vault.account_role.node.path for vault in stack.vaults.values()}
+    assert roles == {"ipa-backup/account-backup-resources/backup-role"}
+
+    (key_id,) = template.find_resources("AWS::KMS::Key")
+    for vault in template.find_resources("AWS::Backup::BackupVault").values():
+        assert vault["Properties"]["EncryptionKeyArn"] == {"Fn::GetAtt": [key_id, "Arn"]}
+
+
+def test_the_role_and_key_keep_the_logical_ids_of_the_account_vault(tmp_path):
+    _, alone = _stack(tmp_path)
+    # the ids the gold vault gave them before they were shared
+    assert _shared_ids(alone) == {
+        legacy_logical_id(["gold", "MemberAccountBackupKey", "Resource"]): "AWS::KMS::Key",
+        legacy_logical_id(["gold", "backup-role", "Resource"]): "AWS::IAM::Role",
+        legacy_logical_id(["gold", "backup-role", "DefaultPolicy", "Resource"]): "AWS::IAM::Policy",
+        legacy_logical_id(["gold", "iam-pass-role", "Resource"]): "AWS::IAM::Policy",
+    }
+    assert "goldMemberAccountBackupKeyBB8C58FF" in _shared_ids(alone)
+    assert any("backuprolearnoutput" in output_id for output_id in alone.to_json()["Outputs"])
+
+    # other classes coming and going leave them, and the vault they encrypt, where they are
+    for vault_classes in (["silver"], ["silver", "platinum"], ["platinum"]):
+        _, template = _stack(tmp_path, vault_classes=vault_classes)
+        assert _shared_ids(template) == _shared_ids(alone)
+        gold_vault = template.find_resources("AWS::Backup::BackupVault", {"Properties": {"BackupVaultTags": {"Class": "gold"}}})
+        assert gold_vault == alone.find_resources("AWS::Backup::BackupVault")
+
+
+def test_key_groups_give_a_class_its_own_key(tmp_path):
+    key_groups = {"platinum": "platinum"}
+    # as cdk.json sets the context, and as -c on the command line does
+    for context in ({"ipa-backup:key-groups": key_groups}, {"ipa-backup:key-groups": json.dumps(key_groups)}):
+        _, template = _stack(tmp_path, vault_classes=["silver", "platinum"], context=context)
+        template.resource_count_is("AWS::IAM::Role", 1)
+        keys = template.find_resources("AWS::KMS::Key")
+        # silver shares the gold vault's key, platinum has its own
+        assert set(keys) == {
+            "goldMemberAccountBackupKeyBB8C58FF",
+            legacy_logical_id(["account-backup-resources", "platinum-backup-key", "Resource"]),
+        }
@@ -0,0 +1,247 @@
+import argparse
+import datetime
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from ipa_backup.catalog import (
+    DEFAULT_PIPELINE_ACCOUNT,
+    WATERMARK_OVERLAP_SECONDS,
+    CatalogVault,
+    RecoveryPoint,
+    RecoveryPointCatalog,
+    add_stack_arguments,
+    backup_stack_name,
+    find_vaults,
+    refresh,
+    stack_vaults,
+)
+
+
+ACCOUNT = "123456789012"
+REGION = "ap-southeast-2"
+SILVER = CatalogVault(f"arn:aws:backup:{REGION}:{ACCOUNT}:backup-vault:ipa-backup-vault-silver", "silver")
+GOLD = CatalogVault(f"arn:aws:backup:{REGION}:{ACCOUNT}:backup-vault:gold-vault-1a2b", "gold")
+ORDERS = f"arn:aws:rds:{REGION}:{ACCOUNT}:db:orders"
+
+
+def _at(day, hour=0):
+    return datetime.datetime(2026, 3, day, hour, tzinfo=datetime.timezone.utc)
+
+
+def _point(vault, name, day, status="COMPLETED", resource_arn=ORDERS, delete_day=None):
+    point = {
+        "RecoveryPointArn": f"arn:aws:backup:{REGION}:{ACCOUNT}:recovery-point:{name}",
+        "ResourceArn": resource_arn,
+        "ResourceType": "RDS",
+        "BackupVaultArn": vault.vault_arn,
+        "CreationDate": _at(day),
+        "Status": status,
+    }
+    if delete_day:
+        point["CalculatedLifecycle"] = {"DeleteAt": _at(delete_day)}
+    return point
+
+
+def _backup_client(pages_by_vault):
+    # an AWS Backup client answering one listing per vault, in the order they are given
+    client = boto3.Session(
+        aws_access_key_id="testing", aws_secret_access_key="testing", region_name=REGION
+    ).client("backup")
+    stubber = Stubber(client)
+    for expected_params, pages in pages_by_vault:
+        for number, page in enumerate(pages):
+            params = dict(expected_params)
+            response = {"RecoveryPoints": page}
+            if number:
+                params["NextToken"] = f"page-{number}"
+            if number < len(pages) - 1:
+                response["NextToken"] = f"page-{number + 1}"
+            stubber.add_response("list_recovery_points_by_backup_vault", response, params)
+    stubber.activate()
+    return client, stubber
+
+
+def test_vaults_are_found_through_the_stack_outputs():
+    client = boto3.Session(
+        aws_access_key_id="testing", aws_secret_access_key="testing", region_name=REGION
+    ).client("cloudformation")
+    with Stubber(client) as stubber:
+        stubber.add_response(
+            "describe_stacks",
+            {
+                "Stacks": [
+                    {
+                        "StackName": "ipa-backup",
+                        "CreationTime": _at(1),
+                        "StackStatus": "UPDATE_COMPLETE",
+                        "Outputs": [
+                            {"OutputKey": "silverbackuprolearnoutputC291B5BB", "OutputValue": "arn:aws:iam::x"},
+                            {"OutputKey": "silverMemberAccountBackupVaultOutput98D80434", "OutputValue": SILVER.vault_arn},
+                            {"OutputKey": "silverMemberAccountBackupKeyOutputB3BC4C92", "OutputValue": "arn:aws:kms:x"},
+                            {"OutputKey": "goldMemberAccountBackupVaultOutput03F4122B", "OutputValue": GOLD.vault_arn},
+                        ],
+                    }
+                ]
+            },
+            {"StackName": "ipa-backup"},
+        )
+        assert stack_vaults(client, "ipa-backup") == [SILVER, GOLD]
+    assert (GOLD.account, GOLD.region, GOLD.vault_name) == (ACCOUNT, REGION, "gold-vault-1a2b")
+
+
+def test_stacks_are_named_as_the_pipeline_deploys_them_and_missing_ones_skipped():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--home-region", default=REGION)
+    add_stack_arguments(parser)
+    args = parser.parse_args([])
+    # the pipeline's own account and region keeps the stage name without a suffix
+    assert backup_stack_name(DEFAULT_PIPELINE_ACCOUNT, REGION, args) == "ipa-backup-pipeline-construct-master-stage"
+    assert backup_stack_name(ACCOUNT, "us-east-1", args) == f"ipa-backup-pipeline-construct-master-{ACCOUNT}-us-east-1-stage"
+    args = parser.parse_args(["--stack-name", "ipa-backup-{account}-{region}"])
+    assert backup_stack_name(ACCOUNT, REGION, args) == f"ipa-backup-{ACCOUNT}-{REGION}"
+
+    client = boto3.Session(
+        aws_access_key_id="testing", aws_secret_access_key="testing", region_name=REGION
+    ).client("cloudformation")
+    with Stubber(client) as stubber:
+        stubber.add_client_error(
+            "describe_stacks",
+            service_error_code="ValidationError",
+            service_message="Stack with id ipa-backup does not exist",
+            expected_params={"StackName": "ipa-backup"},
+        )
+        assert stack_vaults(client, "ipa-backup") is None
+
+
+def test_refreshes_only_list_points_since_the_watermark():
+    catalog = RecoveryPointCatalog(":memory:")
+    first, first_stubber = _backup_client(
+        [
+            (
+                {"BackupVaultName": "ipa-backup-vault-silver"},
+                [[_point(SILVER, "s-1", 1), _point(SILVER, "s-2", 2)], [_point(SILVER, "s-3", 3, status="CREATING")]],
+            ),
+            ({"BackupVaultName": "gold-vault-1a2b"}, [[_point(GOLD, "g-1", 2, delete_day=5)]]),
+        ]
+    )
+    # one worker, so the vaults are listed in the order the stubs expect
+    assert refresh(catalog, [SILVER, GOLD], lambda *key: first, workers=1, now=_at(4).timestamp()) == 4
+    first_stubber.assert_no_pending_responses()
+    assert catalog.watermark(SILVER.vault_arn) == _at(3).timestamp()
+    assert catalog.latest(ORDERS).recovery_point_arn.endswith("s-2")
+
+    # the point still being created last time is listed again, now completed
+    since = datetime.datetime.fromtimestamp(_at(3).timestamp() - WATERMARK_OVERLAP_SECONDS, datetime.timezone.utc)
+    second, second_stubber = _backup_client(
+        [
+            (
+                {"BackupVaultName": "ipa-backup-vault-silver", "ByCreatedAfter": since},
+                [[_point(SILVER, "s-3", 3)]],
+            ),
+            (
+                {
+                    "BackupVaultName": "gold-vault-1a2b",
+                    "ByCreatedAfter": datetime.datetime.fromtimestamp(
+                        _at(2).timestamp() - WATERMARK_OVERLAP_SECONDS, datetime.timezone.utc
+                    ),
+                },
+                [[]],
+            ),
+        ]
+    )
+    assert refresh(catalog, [SILVER, GOLD], lambda *key: second, workers=1, now=_at(4, 12).timestamp()) == 1
+    second_stubber.assert_no_pending_responses()
+    assert len(catalog) == 4
+    assert catalog.latest(ORDERS).recovery_point_arn.endswith("s-3")
+
+
+def test_deleted_and_expired_points_leave_the_catalog():
+    catalog = RecoveryPointCatalog(":memory:")
+    first, _ = _backup_client(
+        [
+            (
+                {"BackupVaultName": "ipa-backup-vault-silver"},
+                [[_point(SILVER, "s-1", 1), _point(SILVER, "s-2", 2), _point(SILVER, "s-3", 3, delete_day=5)]],
+            ),
+        ]
+    )
+    assert refresh(catalog, [SILVER], lambda *key: first, now=_at(4).timestamp()) == 3
+    assert catalog.listed_at(SILVER.vault_arn) == _at(4).timestamp()
+
+    # a day later s-2 has been deleted by hand and s-3 by its lifecycle, so the vault is listed in full
+    second, second_stubber = _backup_client(
+        [({"BackupVaultName": "ipa-backup-vault-silver"}, [[_point(SILVER, "s-1", 1), _point(SILVER, "s-4", 5)]])]
+    )
+    assert refresh(catalog, [SILVER], lambda *key: second, now=_at(5, 1).timestamp()) == 2
+    second_stubber.assert_no_pending_responses()
+    assert len(catalog) == 2
+    assert catalog.latest(ORDERS, now=0).recovery_point_arn.endswith("s-4")
+    assert [point.recovery_point_arn[-3:] for point in catalog.history(ORDERS, now=0)] == ["s-4", "s-1"]
+    assert catalog.prune(now=_at(30).timestamp()) == 0
+
+
+def test_stacks_are_looked_up_concurrently_and_missing_ones_listed():
+    targets = [(f"{100000000000 + number}", REGION) for number in range(4)]
+    looked_up = []
+
+    class CloudFormation:
+        def __init__(self, account):
+            self.account = account
+
+        def describe_stacks(self, StackName):
+            looked_up.append(StackName)
+            if self.account.endswith("2"):
+                error = {"Error": {"Code": "ValidationError", "Message": f"Stack with id {StackName} does not exist"}}
+                raise ClientError(error, "DescribeStacks")
+            vault_arn = f"arn:aws:backup:{REGION}:{self.account}:backup-vault:ipa-backup-vault-silver"
+            return {"Stacks": [{"Outputs": [{"OutputKey": "silverMemberAccountBackupVaultOutput98D80434", "OutputValue": vault_arn}]}]}
+
+    vaults, missing = find_vaults(
+        targets, lambda account, region: f"backup-{account}", lambda account, region, service: CloudFormation(account), workers=4
+    )
+    assert [vault.account for vault in vaults] == ["100000000000", "100000000001", "100000000003"]
+    assert missing == [f"backup-100000000002 in 100000000002/{REGION}"]
+    assert sorted(looked_up) == [f"backup-{account}" for account, _ in targets]
+
+
+def test_latest_skips_expired_and_unrestorable_points():
+    catalog = RecoveryPointCatalog(":memory:")
+
+    def point(name, vault, day, status="COMPLETED", delete_day=None):
+        return RecoveryPoint(
+            name, ORDERS, "RDS", vault.vault_arn, vault.vault_class, _at(day).timestamp(), status,
+            _at(delete_day).timestamp() if delete_day else None,
+        )
+
+    catalog.record(SILVER, [point("s-1", SILVER, 1), point("s-4", SILVER, 4, status="PARTIAL")])
+    catalog.record(GOLD, [point("g-2", GOLD, 2), point("g-3", GOLD, 3, delete_day=10)])
+    assert catalog.latest(ORDERS, now=_at(9).timestamp()).recovery_point_arn == "g-3"
+    assert catalog.latest(ORDERS, now=_at(11).timestamp()).recovery_point_arn == "g-2"
+    assert catalog.latest(ORDERS, vault_class="silver").recovery_point_arn == "s-1"
+    assert [p.recovery_point_arn for p in catalog.history(ORDERS, now=_at(9).timestamp())] == ["g-3", "g-2", "s-1"]
+    assert catalog.latest(f"arn:aws:rds:{REGION}:{ACCOUNT}:db:missing") is None
+
+
+def test_lookups_use_the_resource_index(tmp_path):
+    catalog = RecoveryPointCatalog(str(tmp_path / "catalog.sqlite"))
+    catalog.record(
+        SILVER,
+        [
+            RecoveryPoint(f"point-{n}", f"arn:aws:ec2:{REGION}:{ACCOUNT}:volume/vol-{n % 1000}", "EBS",
+                          SILVER.vault_arn, "silver", float(n), "COMPLETED")
+            for n in range(20000)
+        ],
+    )
+    plan = catalog._connection.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM recovery_points WHERE resource_arn = ? ORDER BY created_at DESC",
+        (ORDERS,),
+    ).fetchall()
+    assert "recovery_points_by_resource" in str(plan)
+    catalog.close()
+    # the catalog survives a reopen
+    reopened = RecoveryPointCatalog(str(tmp_path / "catalog.sqlite"))
+    assert reopened.latest(f"arn:aws:ec2:{REGION}:{ACCOUNT}:volume/vol-7", now=0).created_at == 19007.0
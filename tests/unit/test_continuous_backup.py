@@ -0,0 +1,106 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from ipa_backup.constructs.vaults import PlatinumIpaVaultCustomConstruct
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+from ipa_backup.selections import split_continuous_arns
+from tests.factories import write_manifest
+
+
+ACCOUNT = "100000000000"
+
+# one daily ARN per service prefix, and the rule it should be backed up by on a platinum vault
+ROUTES = {
+    f"arn:aws:rds:ap-southeast-2:{ACCOUNT}:db:orders": "Continuous",
+    f"arn:aws:rds:ap-southeast-2:{ACCOUNT}:cluster:ledger": "Continuous",
+    "arn:aws:s3:::ipa-reports": "Continuous",
+    f"arn:aws:rds:ap-southeast-2:{ACCOUNT}:snapshot:manual": "Daily",
+    f"arn:aws:dynamodb:ap-southeast-2:{ACCOUNT}:table/sessions": "Daily",
+    f"arn:aws:ec2:ap-southeast-2:{ACCOUNT}:volume/vol-0123456789abcdef0": "Daily",
+    f"arn:aws:elasticfilesystem:ap-southeast-2:{ACCOUNT}:file-system/fs-01234567": "Daily",
+}
+
+
+def test_split_continuous_arns_keeps_order():
+    continuous, snapshot = split_continuous_arns(list(ROUTES))
+    assert continuous == tuple(arn for arn, rule in ROUTES.items() if rule == "Continuous")
+    assert snapshot == tuple(arn for arn, rule in ROUTES.items() if rule == "Daily")
+
+
+@pytest.fixture(scope="module")
+def platinum_template(tmp_path_factory):
+    manifest = {
+        ACCOUNT: {
+            "vault_class": "platinum",
+            "daily": list(ROUTES),
+            "weekly": [f"arn:aws:rds:ap-southeast-2:{ACCOUNT}:db:orders"],
+        }
+    }
+    app = core.App()
+    stack = IpaBackupStack(
+        app,
+        "ipa-backup-platinum",
+        env=core.Environment(account=ACCOUNT, region="ap-southeast-2"),
+        manifest_path=write_manifest(tmp_path_factory.mktemp("manifest"), manifest),
+    )
+    return assertions.Template.from_stack(stack).to_json()["Resources"]
+
+
+def _rule_of_each_arn(resources):
+    rules = {}
+    for resource in resources.values():
+        if resource["Type"] != "AWS::Backup::BackupSelection":
+            continue
+        plan = resources[resource["Properties"]["BackupPlanId"]["Fn::GetAtt"][0]]
+        (rule,) = plan["Properties"]["BackupPlan"]["BackupPlanRule"]
+        for arn in resource["Properties"]["BackupSelection"]["Resources"]:
+            rules.setdefault(arn, []).append(rule["RuleName"])
+    return rules
+
+
+@pytest.mark.parametrize("arn", list(ROUTES))
+def test_each_daily_arn_gets_the_rule_of_its_service(platinum_template, arn):
+    rules = _rule_of_each_arn(platinum_template)[arn]
+    assert ROUTES[arn] in rules
+    # continuous resources aren't snapshotted daily as well
+    assert not {"Continuous", "Daily"} <= set(rules)
+
+
+def test_weekly_snapshots_are_kept_for_continuous_resources(platinum_template):
+    rules = _rule_of_each_arn(platinum_template)
+    assert sorted(rules[f"arn:aws:rds:ap-southeast-2:{ACCOUNT}:db:orders"]) == [
+        "Continuous",
+        "Weekly",
+    ]
+
+
+def test_continuous_rule_keeps_a_point_in_time_window(platinum_template):
+    (rule,) = [
+        rule
+        for resource in platinum_template.values()
+        if resource["Type"] == "AWS::Backup::BackupPlan"
+        for rule in resource["Properties"]["BackupPlan"]["BackupPlanRule"]
+        if rule["RuleName"] == "Continuous"
+    ]
+    assert rule["EnableContinuousBackup"] is True
+    assert rule["Lifecycle"] == {"DeleteAfterDays": 35}
+    assert "MoveToColdStorageAfterDays" not in rule["Lifecycle"]
+
+
+def test_silver_and_gold_have_no_continuous_rule():
+    app = core.App()
+    stack = IpaBackupStack(app, "ipa-backup", vault_classes=["silver", "gold"])
+    for plan in assertions.Template.from_stack(stack).find_resources(
+        "AWS::Backup::BackupPlan"
+    ).values():
+        for rule in plan["Properties"]["BackupPlan"]["BackupPlanRule"]:
+            assert "EnableContinuousBackup" not in rule
+
+
+def test_a_bad_point_in_time_window_leaves_nothing_in_the_tree():
+    stack = core.Stack(core.App(), "vaults")
+    for days in (0, 36):
+        with pytest.raises(ValueError, match="point-in-time restore window"):
+            PlatinumIpaVaultCustomConstruct(stack, "platinum", organization_id="o-test", point_in_time_days=days)
+    assert stack.node.children == []
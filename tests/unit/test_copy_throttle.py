@@ -0,0 +1,257 @@
+import heapq
+import itertools
+import json
+
+from ipa_backup.lambdas.copy_throttle import (
+    BACKUP_JOB_STATE_CHANGE,
+    COPY_JOB_STATE_CHANGE,
+    CopyRequest,
+    CopyThrottle,
+    PacingState,
+    Quota,
+    TokenBucket,
+)
+
+
+ACCOUNT = "123456789012"
+ROLE = f"arn:aws:iam::{ACCOUNT}:role/backup-role"
+SYDNEY_DR = "arn:aws:backup:ap-southeast-4:999999999999:backup-vault:ipa-backup-vault-gold"
+OREGON_DR = "arn:aws:backup:us-west-2:999999999999:backup-vault:ipa-backup-vault-gold"
+COPY_TARGETS = {
+    "gold-monthly-plan": [
+        {"destination_vault_arn": SYDNEY_DR, "iam_role_arn": ROLE, "delete_after_days": 365},
+        {"destination_vault_arn": OREGON_DR, "iam_role_arn": ROLE, "delete_after_days": 365},
+    ]
+}
+QUOTAS = {
+    "default": Quota(max_in_flight=4, jobs_per_minute=6, burst=4),
+    "us-west-2": Quota(max_in_flight=2, jobs_per_minute=2, burst=2),
+}
+
+
+class MemoryStore:
+    # the DynamoStore interface over dictionaries
+    def __init__(self):
+        self.states = {}
+        self.queues = {}
+
+    def state(self, key, quota, now):
+        state = self.states.get(key) or PacingState(TokenBucket(float(quota.burst), now), {})
+        return state._replace(in_flight=dict(state.in_flight))
+
+    def save(self, key, state):
+        self.states[key] = state
+
+    def enqueue(self, request):
+        self.queues.setdefault(request.pacing_key, {})[request.entry] = request
+
+    def queued(self, key, limit):
+        queue = self.queues.get(key, {})
+        return [queue[entry] for entry in sorted(queue)[: max(0, limit)]]
+
+    def remove(self, request):
+        del self.queues[request.pacing_key][request.entry]
+
+    def keys(self):
+        queued = {key for key, queue in self.queues.items() if queue}
+        return queued | {key for key, state in self.states.items() if state.in_flight}
+
+
+class SimulatedBackup:
+    """
+    Runs each copy for a fixed time, failing every nth one on a quota and losing the state change
+    event of every nth one if asked, and tracks how many run at once. Like AWS Backup, a start with
+    an idempotency token seen before returns the job it started the first time.
+    """
+
+    def __init__(self, clock, copy_seconds=180, fail_every=7, lose_every=None):
+        self.clock = clock
+        self.copy_seconds = copy_seconds
+        self.fail_every = fail_every
+        self.lose_every = lose_every
+        self.finishing = []
+        self.running = {}
+        self.peak = {}
+        self.starts = []
+        self.copied = set()
+        self.jobs = {}
+        self.tokens = {}
+        self._ids = itertools.count(1)
+
+    def start_copy_job(self, **arguments):
+        if arguments["IdempotencyToken"] in self.tokens:
+            return {"CopyJobId": self.tokens[arguments["IdempotencyToken"]]}
+        job_id = f"copy-{next(self._ids)}"
+        self.tokens[arguments["IdempotencyToken"]] = job_id
+        self.jobs[job_id] = {"State": "RUNNING"}
+        request = (arguments["SourceBackupVaultName"], arguments["DestinationBackupVaultArn"].split(":")[3])
+        self.running[job_id] = request
+        self.peak[request] = max(self.peak.get(request, 0), sum(r == request for r in self.running.values()))
+        self.starts.append((self.clock.now, request))
+        fails = int(job_id.split("-")[1]) % self.fail_every == 0
+        heapq.heappush(self.finishing, (self.clock.now + self.copy_seconds, job_id, arguments, fails))
+        return {"CopyJobId": job_id}
+
+    def finished_events(self):
+        while self.finishing and self.finishing[0][0] <= self.clock.now:
+            _, job_id, arguments, fails = heapq.heappop(self.finishing)
+            del self.running[job_id]
+            if not fails:
+                self.copied.add((arguments["RecoveryPointArn"], arguments["DestinationBackupVaultArn"]))
+            self.jobs[job_id] = {
+                "State": "FAILED" if fails else "COMPLETED",
+                "StatusMessage": "Copy job limit exceeded" if fails else "",
+            }
+            if self.lose_every and int(job_id.split("-")[1]) % self.lose_every == 0:
+                continue
+            yield {
+                "detail-type": COPY_JOB_STATE_CHANGE,
+                "detail": {
+                    "copyJobId": job_id,
+                    "state": "FAILED" if fails else "COMPLETED",
+                    "statusMessage": "Copy job limit exceeded" if fails else "",
+                    "sourceBackupVaultArn": f"arn:aws:backup:ap-southeast-2:{ACCOUNT}:backup-vault:{arguments['SourceBackupVaultName']}",
+                    "destinationBackupVaultArn": arguments["DestinationBackupVaultArn"],
+                },
+            }
+
+    def describe_copy_job(self, CopyJobId):
+        return {"CopyJob": dict(self.jobs[CopyJobId], CopyJobId=CopyJobId)}
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def backup_completed(number, vault_name="gold-vault"):
+    return {
+        "detail-type": BACKUP_JOB_STATE_CHANGE,
+        "detail": {
+            "backupJobId": f"backup-{number}",
+            "state": "COMPLETED",
+            "backupVaultName": vault_name,
+            "recoveryPointArn": f"arn:aws:backup:ap-southeast-2:{ACCOUNT}:recovery-point:{number}",
+            "createdBy": {"backupPlanId": "gold-monthly-plan"},
+        },
+    }
+
+
+def run_burst(controller, backup, clock, hours=4):
+    # 60 backups complete in the first five minutes, each wanting two copies
+    arrivals = {second: backup_completed(second // 5) for second in range(0, 300, 5)}
+    for second in range(0, hours * 3600, 5):
+        clock.now = float(second)
+        if second in arrivals:
+            controller.handle(arrivals[second])
+        for event in list(backup.finished_events()):
+            controller.handle(event)
+        if second % 60 == 0:
+            controller.handle({"detail-type": "Scheduled Event", "detail": {}})
+
+
+def test_a_burst_of_backups_is_copied_within_the_quotas():
+    clock = Clock()
+    backup = SimulatedBackup(clock)
+    controller = CopyThrottle(MemoryStore(), backup, COPY_TARGETS, QUOTAS, clock=clock)
+    run_burst(controller, backup, clock)
+
+    # every copy was made, those that failed on a quota were queued and made again
+    assert len(backup.copied) == 120
+    assert len(backup.starts) > 120
+    sydney, oregon = ("gold-vault", "ap-southeast-4"), ("gold-vault", "us-west-2")
+    assert backup.peak == {sydney: 4, oregon: 2}
+    # no ten minute span starts more copies than the bucket holds plus ten minutes of refill
+    for region_key, quota in ((sydney, QUOTAS["default"]), (oregon, QUOTAS["us-west-2"])):
+        starts = [at for at, key in backup.starts if key == region_key]
+        for at in starts:
+            in_span = sum(at <= other < at + 600 for other in starts)
+            assert in_span <= quota.burst + 10 * quota.jobs_per_minute
+    # copies run at the pace of the quota, not one by one
+    last_start = max(at for at, _ in backup.starts)
+    assert last_start < 2 * 3600
+
+
+def test_copies_whose_events_are_lost_are_reconciled_on_the_schedule():
+    clock = Clock()
+    store = MemoryStore()
+    backup = SimulatedBackup(clock, lose_every=5)
+    controller = CopyThrottle(store, backup, COPY_TARGETS, QUOTAS, clock=clock)
+    run_burst(controller, backup, clock, hours=8)
+
+    # the slots of the lost copies were freed and the quota failures among them made again
+    assert len(backup.copied) == 120
+    assert all(not state.in_flight for state in store.states.values())
+
+
+class RefusingBackup:
+    def __init__(self):
+        self.calls = 0
+
+    def start_copy_job(self, **arguments):
+        self.calls += 1
+        if self.calls > 1:
+            error = Exception("too many copy jobs")
+            error.response = {"Error": {"Code": "LimitExceededException"}}
+            raise error
+        return {"CopyJobId": "copy-1"}
+
+
+def test_copies_refused_on_a_quota_stay_queued_and_keep_their_tokens():
+    clock = Clock()
+    store = MemoryStore()
+    controller = CopyThrottle(store, RefusingBackup(), COPY_TARGETS, QUOTAS, clock=clock)
+    started = controller.handle(backup_completed(1))
+    controller.handle(backup_completed(2))
+    assert started == {"gold-vault|ap-southeast-4": 1, "gold-vault|us-west-2": 0}
+    key = "gold-vault|ap-southeast-4"
+    assert len(store.queued(key, 10)) == 1
+    assert store.states[key].bucket.tokens == 3.0
+    assert list(store.states[key].in_flight) == ["copy-1"]
+
+
+def test_copy_requests_start_with_their_lifecycle_and_an_idempotency_token():
+    request = CopyRequest("arn:rp", "gold-vault", OREGON_DR, ROLE, delete_after_days=365, queued_at=12.5)
+    arguments = request.start_copy_job_arguments()
+    assert arguments["Lifecycle"] == {"DeleteAfterDays": 365}
+    assert arguments["IdempotencyToken"] == request.entry.split("#", 1)[1] + "#0"
+    assert request.pacing_key == "gold-vault|us-west-2"
+    # a retry keeps its place in the queue under a token of its own
+    retry = request._replace(started_at=30.0).retry()
+    assert (retry.entry, retry.started_at) == (request.entry, None)
+    assert retry.start_copy_job_arguments()["IdempotencyToken"] != arguments["IdempotencyToken"]
+
+
+def test_paced_copies_are_made_by_the_controller_instead_of_the_plans(synth_cache):
+    template = synth_cache.synth(
+        account=ACCOUNT,
+        region="ap-southeast-2",
+        context={
+            "ipa-backup:dr-region": "ap-southeast-4",
+            "ipa-backup:copy-throttle": "true",
+            # as -c on the command line sets it
+            "ipa-backup:copy-quotas": '{"default": {"max_in_flight": 5}}',
+        },
+        vault_classes=["gold"],
+    ).template
+    for plan in template.find_resources("AWS::Backup::BackupPlan").values():
+        assert "CopyActions" not in plan["Properties"]["BackupPlan"]["BackupPlanRule"][0]
+    template.resource_count_is("AWS::Lambda::Function", 1)
+    template.resource_count_is("AWS::Events::Rule", 2)
+    template.has_resource_properties("AWS::Lambda::Function", {"ReservedConcurrentExecutions": 1})
+    (function,) = template.find_resources("AWS::Lambda::Function").values()
+    copy_targets = json.dumps(function["Properties"]["Environment"]["Variables"]["COPY_TARGETS"])
+    # gold copies its weekly and monthly recovery points
+    assert copy_targets.count("ipa-backup-vault-gold") == 2
+    assert json.loads(function["Properties"]["Environment"]["Variables"]["QUOTAS"]) == {"default": {"max_in_flight": 5}}
+
+    # without the context the plans copy for themselves
+    unpaced = synth_cache.synth(
+        account=ACCOUNT,
+        region="ap-southeast-2",
+        context={"ipa-backup:dr-region": "ap-southeast-4"},
+        vault_classes=["gold"],
+    )
+    unpaced.template.resource_count_is("AWS::Lambda::Function", 0)
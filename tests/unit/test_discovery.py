@@ -0,0 +1,245 @@
+import datetime
+import json
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+from botocore.stub import Stubber
+
+from ipa_backup.discovery import (
+    AccountSessions,
+    DiscoveryCache,
+    build_manifest,
+    discover,
+    frequencies_from_tags,
+    main,
+)
+from ipa_backup.manifest import load_manifest
+
+
+HOME = "ap-southeast-2"
+OTHER = "us-east-1"
+A = "111111111111"
+B = "222222222222"
+
+
+def _tags(value):
+    return [{"Key": "backup-frequency", "Value": value}]
+
+
+# the calls each scan makes of an account with nothing in it
+EMPTY = {
+    "rds": [("describe_db_clusters", {"DBClusters": []}), ("describe_db_instances", {"DBInstances": []})],
+    "ec2": [("describe_volumes", {"Volumes": []})],
+    "efs": [("describe_file_systems", {"FileSystems": []})],
+    "dynamodb": [("list_tables", {"TableNames": []})],
+    "s3": [("list_buckets", {"Buckets": []})],
+}
+
+RESPONSES = {
+    (A, HOME, "rds"): [
+        (
+            "describe_db_clusters",
+            {"DBClusters": [{"DBClusterArn": f"arn:aws:rds:{HOME}:{A}:cluster:ledger", "TagList": _tags("daily,monthly")}]},
+        ),
+        (
+            "describe_db_instances",
+            {
+                "DBInstances": [
+                    # an Aurora instance, backed up through its cluster
+                    {"DBInstanceArn": f"arn:aws:rds:{HOME}:{A}:db:ledger-1", "DBClusterIdentifier": "ledger", "TagList": _tags("daily")},
+                    {"DBInstanceArn": f"arn:aws:rds:{HOME}:{A}:db:orders", "TagList": _tags("weekly")},
+                ]
+            },
+        ),
+    ],
+    (A, HOME, "ec2"): [
+        ("describe_volumes", {"Volumes": [{"VolumeId": "vol-1", "Tags": _tags("daily")}], "NextToken": "page-2"}),
+        ("describe_volumes", {"Volumes": [{"VolumeId": "vol-2"}]}, {"NextToken": "page-2"}),
+    ],
+    (A, HOME, "efs"): [
+        (
+            "describe_file_systems",
+            {
+                "FileSystems": [
+                    {
+                        "OwnerId": A,
+                        "CreationToken": "shared",
+                        "FileSystemId": "fs-01234567",
+                        "FileSystemArn": f"arn:aws:elasticfilesystem:{HOME}:{A}:file-system/fs-01234567",
+                        "CreationTime": datetime.datetime(2024, 1, 1),
+                        "LifeCycleState": "available",
+                        "NumberOfMountTargets": 1,
+                        "SizeInBytes": {"Value": 1024},
+                        "PerformanceMode": "generalPurpose",
+                        "Tags": _tags(" Monthly "),
+                    }
+                ]
+            },
+        )
+    ],
+    (A, HOME, "dynamodb"): [
+        ("list_tables", {"TableNames": ["sessions"]}),
+        ("list_tags_of_resource", {"Tags": _tags("daily")}, {"ResourceArn": f"arn:aws:dynamodb:{HOME}:{A}:table/sessions"}),
+    ],
+    (A, HOME, "s3"): [
+        ("list_buckets", {"Buckets": [{"Name": "reports"}, {"Name": "logs"}]}),
+        ("get_bucket_tagging", {"TagSet": _tags("weekly")}, {"Bucket": "reports"}),
+    ],
+    (A, OTHER, "ec2"): [
+        ("describe_volumes", {"Volumes": [{"VolumeId": "vol-9", "Tags": _tags("daily")}]}),
+    ],
+}
+
+EXPECTED = {
+    A: {
+        "daily": [
+            f"arn:aws:dynamodb:{HOME}:{A}:table/sessions",
+            f"arn:aws:ec2:{HOME}:{A}:volume/vol-1",
+            f"arn:aws:ec2:{OTHER}:{A}:volume/vol-9",
+            f"arn:aws:rds:{HOME}:{A}:cluster:ledger",
+        ],
+        "weekly": [f"arn:aws:rds:{HOME}:{A}:db:orders", "arn:aws:s3:::reports"],
+        "monthly": [
+            f"arn:aws:elasticfilesystem:{HOME}:{A}:file-system/fs-01234567",
+            f"arn:aws:rds:{HOME}:{A}:cluster:ledger",
+        ],
+    }
+}
+
+
+@pytest.fixture
+def stubbed_clients():
+    # a stubbed client for every scan, made up front as boto3 sessions aren't thread safe
+    clients = {}
+    stubbers = []
+    for account in (A, B):
+        for region in (HOME, OTHER):
+            for service in EMPTY:
+                if service == "s3" and region != HOME:
+                    continue
+                session = boto3.Session(
+                    aws_access_key_id="testing", aws_secret_access_key="testing", region_name=region
+                )
+                client = session.client(service)
+                stubber = Stubber(client)
+                for response in RESPONSES.get((account, region, service), EMPTY[service]):
+                    method, body = response[0], response[1]
+                    stubber.add_response(method, body, response[2] if len(response) > 2 else None)
+                    if (account, region, service) == (A, HOME, "s3") and method == "get_bucket_tagging":
+                        stubber.add_client_error(
+                            "get_bucket_tagging",
+                            service_error_code="NoSuchTagSet",
+                            http_status_code=404,
+                            expected_params={"Bucket": "logs"},
+                        )
+                stubber.activate()
+                stubbers.append(stubber)
+                clients[(account, region, service)] = client
+    yield clients
+    for stubber in stubbers:
+        stubber.assert_no_pending_responses()
+
+
+def test_frequencies_from_tags():
+    assert frequencies_from_tags({"backup-frequency": "monthly, DAILY,hourly"}) == ("daily", "monthly")
+    assert frequencies_from_tags({"team": "ipa"}) == ()
+
+
+def test_discovery_pages_through_every_account_and_region(stubbed_clients):
+    calls = []
+
+    def client_factory(account, region, service):
+        calls.append((account, region, service))
+        return stubbed_clients[(account, region, service)]
+
+    discovered = discover([A, B], [HOME, OTHER], client_factory, home_region=HOME, workers=4)
+    assert discovered == EXPECTED
+    # s3 is global, and only scanned from the home region
+    assert len(calls) == 2 * (5 + 4)
+
+
+def test_cached_scans_are_reused_until_they_go_stale(stubbed_clients, tmp_path):
+    cache_path = str(tmp_path / "cache.json")
+    discover([A, B], [HOME, OTHER], lambda *key: stubbed_clients[key], HOME, cache=DiscoveryCache(cache_path))
+
+    def unreachable(*key):
+        raise AssertionError(f"{key} should have come from the cache")
+
+    cache = DiscoveryCache(cache_path)
+    assert discover([A, B], [HOME, OTHER], unreachable, HOME, cache=cache) == EXPECTED
+    with pytest.raises(AssertionError):
+        discover([A], [HOME], unreachable, HOME, cache=cache, max_age=0)
+
+
+def test_the_manifest_keeps_what_discovery_cannot_find(stubbed_clients, tmp_path):
+    existing = {
+        A: {
+            "vault_class": "gold",
+            "daily": [f"arn:aws:rds:{HOME}:{A}:db:*", f"arn:aws:ec2:{HOME}:{A}:volume/vol-gone"],
+        },
+        B: {"tag_selections": [{"frequency": "daily", "tags": {"backup": "yes"}}]},
+    }
+    discovered = discover([A, B], [HOME, OTHER], lambda *key: stubbed_clients[key], HOME)
+    manifest = build_manifest(discovered, existing)
+    assert manifest[A]["vault_class"] == "gold"
+    assert manifest[A]["daily"] == sorted(EXPECTED[A]["daily"] + [f"arn:aws:rds:{HOME}:{A}:db:*"])
+    assert manifest[B] == existing[B]
+
+    manifest_path = tmp_path / "resources.json"
+    manifest_path.write_text(json.dumps(manifest))
+    assert load_manifest(str(manifest_path)).vault_class(A) == "gold"
+
+
+def test_a_partial_scan_keeps_the_accounts_and_regions_it_did_not_scan():
+    existing = {
+        "111111111111": {"daily": ["arn:aws:ec2:ap-southeast-2:111111111111:volume/vol-1"]},
+        "222222222222": {"weekly": ["arn:aws:rds:ap-southeast-2:222222222222:db:orders"]},
+        "333333333333": {
+            "daily": [
+                "arn:aws:ec2:ap-southeast-2:333333333333:volume/vol-gone",
+                "arn:aws:ec2:us-east-1:333333333333:volume/vol-elsewhere",
+            ]
+        },
+    }
+    discovered = {"333333333333": {"daily": ["arn:aws:ec2:ap-southeast-2:333333333333:volume/vol-new"]}}
+    manifest = build_manifest(discovered, existing, scanned=[("333333333333", "ap-southeast-2")])
+    assert manifest["111111111111"] == existing["111111111111"]
+    assert manifest["222222222222"] == existing["222222222222"]
+    # the scanned region is replaced, the region that wasn't scanned is kept
+    assert manifest["333333333333"]["daily"] == [
+        "arn:aws:ec2:ap-southeast-2:333333333333:volume/vol-new",
+        "arn:aws:ec2:us-east-1:333333333333:volume/vol-elsewhere",
+    ]
+
+
+def test_role_credentials_are_refreshed_before_they_expire():
+    session = boto3.Session(aws_access_key_id="testing", aws_secret_access_key="testing", region_name=HOME)
+    sts = session.client("sts")
+    stubber = Stubber(sts)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expected = {"RoleArn": f"arn:aws:iam::{A}:role/backup-reader", "RoleSessionName": "ipa-backup-discovery"}
+    # the first role session is about to expire, as it would be an hour into a long scan
+    for number, lifetime in ((1, datetime.timedelta(minutes=1)), (2, datetime.timedelta(hours=1))):
+        credentials = {
+            "AccessKeyId": f"ASIA{number:016d}",
+            "SecretAccessKey": "secret",
+            "SessionToken": f"token-{number}",
+            "Expiration": now + lifetime,
+        }
+        stubber.add_response("assume_role", {"Credentials": credentials}, expected)
+    stubber.activate()
+
+    sessions = AccountSessions(role_name="backup-reader", session=session, sts=sts)
+    client = sessions.client(A, HOME, "ec2")
+    account_credentials = sessions.session(A).get_credentials()
+    assert account_credentials.get_frozen_credentials().access_key == "ASIA0000000000000002"
+    # the refreshed session isn't close to expiring, so the role isn't assumed again
+    assert account_credentials.get_frozen_credentials().token == "token-2"
+    assert sessions.client(A, HOME, "ec2") is client
+    stubber.assert_no_pending_responses()
+
+
+def test_cli_requires_accounts_or_the_organization():
+    with pytest.raises(SystemExit):
+        main(["--output", "resources.json"])
@@ -0,0 +1,76 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from ipa_backup.estimate import estimate_manifest, estimate_stack
+from ipa_backup.manifest import parse_manifest
+from tests.factories import make_manifest, write_manifest
+
+
+A = "100000000000"
+REGION = "ap-southeast-2"
+
+
+def synthesized_templates(synth_cache, manifest):
+    # the resource count and bytes of the stack's template, then of each nested template
+    synthesized = synth_cache.synth(account=A, region=REGION, manifest=manifest)
+    return [
+        (len(json.loads(text)["Resources"]), len(text.encode("utf-8")))
+        for text in synthesized.files.values()
+    ]
+
+
+def mixed_platinum_manifest():
+    manifest = make_manifest(1, 30, vault_class="platinum")
+    manifest[A]["daily"] += [
+        f"arn:aws:rds:{REGION}:{A}:db:orders",
+        f"arn:aws:rds:{REGION}:{A}:cluster:ledger",
+        "arn:aws:s3:::reports",
+        f"arn:aws:ec2:{REGION}:{A}:volume/*",
+    ]
+    manifest[A]["tag_selections"] = [
+        {"frequency": "weekly", "tags": {"backup": "yes", "team": "ipa"}, "resource_types": ["EBS", "RDS"]}
+    ]
+    return manifest
+
+
+@pytest.mark.parametrize(
+    "manifest",
+    [make_manifest(1, 30, vault_class="gold"), mixed_platinum_manifest(), make_manifest(1, 12000)],
+    ids=["gold", "platinum-with-tags", "silver-spilling-into-a-nested-stack"],
+)
+def test_estimates_match_the_synthesized_templates(synth_cache, manifest):
+    estimate = estimate_stack(parse_manifest(manifest), A, REGION)
+    templates = synthesized_templates(synth_cache, manifest)
+    assert [t.resources for t in estimate.templates] == [resources for resources, _ in templates]
+    for estimated, (_, size) in zip(estimate.templates, templates):
+        assert estimated.size == pytest.approx(size, rel=0.02)
+
+
+def test_headroom_is_the_nearer_limit():
+    (estimate,) = estimate_manifest(parse_manifest(make_manifest(1, 9000)))
+    assert estimate.nested_stacks == 0
+    assert estimate.headroom == pytest.approx(1 - estimate.template_bytes / 1_000_000)
+    assert estimate.headroom < 0.4
+
+
+def test_the_estimator_never_loads_the_cdk(tmp_path, capsys):
+    manifest_path = write_manifest(tmp_path, make_manifest(3, 10))
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from ipa_backup.estimate import main; main(sys.argv[1:]); "
+            "assert 'aws_cdk' not in sys.modules and 'jsii' not in sys.modules",
+            "--manifest",
+            manifest_path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = completed.stdout.splitlines()
+    assert len(lines) == 5
+    assert lines[-1].startswith("3 stacks, 33 resources")
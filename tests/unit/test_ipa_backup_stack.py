@@ -2,6 +2,7 @@ import aws_cdk as core
 import aws_cdk.assertions as assertions
 
 from ipa_backup.ipa_backup_stack import IpaBackupStack
+from tests.factories import make_manifest, write_manifest
 
 
 # example tests. To run these tests, uncomment this file along with the example
@@ -15,3 +16,64 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_manifest_resources_are_added_to_each_plan(synth_cache):
+    template = synth_cache.synth(
+        "ipa-backup-account", account="832435373672", region="ap-southeast-2"
+    ).template
+    template.resource_count_is("AWS::Backup::BackupSelection", 3)
+    template.has_resource_properties(
+        "AWS::Backup::BackupSelection",
+        {
+            "BackupSelection": assertions.Match.object_like(
+                {
+                    "SelectionName": "DailyBackupSelection-all",
+                    "Resources": [
+                        "arn:aws:dynamodb:ap-southeast-2:832435373672:table/*",
+                        "arn:aws:ec2:ap-southeast-2:832435373672:instance/*",
+                        "arn:aws:ec2:ap-southeast-2:832435373672:volume/*",
+                    ],
+                }
+            )
+        },
+    )
+
+
+def test_resources_go_to_the_vault_class_of_the_account(tmp_path):
+    manifest = make_manifest(1, 3, vault_class="gold")
+    app = core.App()
+    stack = IpaBackupStack(
+        app,
+        "ipa-backup-gold",
+        env=core.Environment(account="100000000000", region="ap-southeast-2"),
+        vault_classes=["silver", "platinum"],
+        manifest_path=write_manifest(tmp_path, manifest),
+    )
+    assert list(stack.vaults) == ["silver", "gold", "platinum"]
+    template = assertions.Template.from_stack(stack)
+    template.resource_count_is("AWS::Backup::BackupVault", 3)
+    selections = template.find_resources("AWS::Backup::BackupSelection")
+    assert len(selections) == 3
+    assert all("gold" in logical_id for logical_id in selections)
+
+
+def test_plans_are_scheduled_in_their_own_window_of_the_envelope(synth_cache):
+    expressions = set()
+    for account in ("111111111111", "222222222222", "333333333333"):
+        template = synth_cache.synth(
+            f"ipa-backup-{account}",
+            account=account,
+            region="ap-southeast-2",
+            context={"ipa-backup:backup-window-start": 22, "ipa-backup:backup-window-hours": 6},
+        ).template
+        plans = template.find_resources("AWS::Backup::BackupPlan")
+        for plan in plans.values():
+            (rule,) = plan["Properties"]["BackupPlan"]["BackupPlanRule"]
+            expressions.add(rule["ScheduleExpression"])
+            hour = int(rule["ScheduleExpression"].split()[1])
+            assert hour in (22, 23, 0, 1, 2, 3)
+            assert rule["StartWindowMinutes"] == 60
+            assert rule["CompletionWindowMinutes"] <= 6 * 60
+    # three accounts with three plans each don't all start together
+    assert len(expressions) > 3
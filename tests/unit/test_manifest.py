@@ -0,0 +1,140 @@
+import os
+
+import pytest
+
+from ipa_backup.manifest import (
+    DEFAULT_MANIFEST_PATH,
+    ManifestError,
+    clear_cache,
+    load_manifest,
+    normalise_arns,
+    parse_manifest,
+)
+from tests.factories import make_manifest, write_manifest
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+
+def test_default_manifest_is_resolved_from_the_package(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = load_manifest()
+    assert manifest.source == DEFAULT_MANIFEST_PATH
+    assert "832435373672" in manifest
+    assert len(manifest.resources("832435373672", "daily")) == 3
+
+
+def test_index_by_account_and_frequency(tmp_path):
+    manifest = load_manifest(write_manifest(tmp_path, make_manifest(3, 9)))
+    assert manifest.accounts == ("100000000000", "100000000001", "100000000002")
+    assert len(manifest.resources("100000000001", "weekly")) == 3
+    assert manifest.resources("999999999999", "daily") == ()
+    assert manifest.arn_count() == 27
+    # the index is shared by every stack, so callers can't change it
+    with pytest.raises(TypeError):
+        manifest.frequencies("100000000001")["daily"] = ()
+    assert len(manifest.resources("100000000001", "daily")) == 3
+
+
+def test_load_is_memoized_until_the_content_changes(tmp_path):
+    manifest_path = write_manifest(tmp_path, make_manifest(1, 3))
+    first = load_manifest(manifest_path)
+    assert load_manifest(manifest_path) is first
+
+    # touching the file without changing it keeps the index
+    os.utime(manifest_path, ns=(0, 0))
+    assert load_manifest(manifest_path) is first
+
+    write_manifest(tmp_path, make_manifest(2, 3))
+    changed = load_manifest(manifest_path)
+    assert changed is not first
+    assert len(changed) == 2
+
+
+def test_all_problems_are_reported_together():
+    document = {
+        "832435373672": {
+            "daily": ["arn:aws:s3:::bucket", "arn:aws:s3:::bucket"],
+            "hourly": ["arn:aws:s3:::other"],
+            "weekly": ["not-an-arn"],
+        },
+        "1234": {},
+    }
+    with pytest.raises(ManifestError) as e:
+        parse_manifest(document)
+    assert len(e.value.errors) == 4
+    message = str(e.value)
+    assert "duplicate ARN arn:aws:s3:::bucket" in message
+    assert "832435373672.hourly: unknown frequency" in message
+    assert "invalid ARN 'not-an-arn'" in message
+    assert "1234: account ids must be 12 digits" in message
+
+
+def test_vault_class_defaults_to_silver():
+    manifest = parse_manifest(make_manifest(2, 3, vault_class="platinum"))
+    assert manifest.vault_class("100000000000") == "platinum"
+    assert manifest.vault_class("999999999999") == "silver"
+    with pytest.raises(ManifestError):
+        parse_manifest({"832435373672": {"vault_class": "bronze"}})
+
+
+def test_invalid_json_is_a_manifest_error(tmp_path):
+    manifest_path = tmp_path / "resources.json"
+    manifest_path.write_text("{")
+    with pytest.raises(ManifestError):
+        load_manifest(str(manifest_path))
+
+
+def test_unknown_frequency_lookup():
+    with pytest.raises(ManifestError):
+        load_manifest().resources("832435373672", "hourly")
+
+
+def test_normalise_arns_dedupes_in_order():
+    arns = ["arn:aws:s3:::b", "arn:aws:s3:::a", "arn:aws:s3:::b"]
+    assert normalise_arns(arns) == ("arn:aws:s3:::b", "arn:aws:s3:::a")
+    with pytest.raises(ManifestError):
+        normalise_arns(["arn:aws:s3:::a", "bucket"])
+
+
+def test_tag_selections_are_parsed_and_named_after_their_content():
+    document = {
+        "832435373672": {
+            "daily": [],
+            "tag_selections": [
+                {"frequency": "daily", "tags": {"backup-class": "silver"}, "resource_types": ["EBS"]},
+                {"id": "gold-rds", "frequency": "weekly", "tags": {"backup-class": "gold"}},
+            ],
+        }
+    }
+    first, second = parse_manifest(document).tag_selections("832435373672")
+    assert first.frequency == "daily"
+    assert first.tags == (("backup-class", "silver"),)
+    assert first.resource_arns() == ("arn:aws:ec2:*:*:volume/*",)
+    assert len(first.selection_id) == 8
+    assert second.selection_id == "gold-rds"
+    assert second.resource_arns() == ("*",)
+
+    document["832435373672"]["tag_selections"].reverse()
+    assert parse_manifest(document).tag_selections("832435373672")[1] == first
+
+
+def test_invalid_tag_selections_are_reported():
+    document = {
+        "832435373672": {
+            "tag_selections": [
+                {"frequency": "hourly", "tags": {}, "resource_types": ["Tape"], "extra": 1},
+                {"id": "a", "frequency": "daily", "tags": {"k": "v"}},
+                {"id": "a", "frequency": "daily", "tags": {"k": "w"}},
+                {"id": "b", "frequency": "daily", "tags": {"k": "v"}, "resource_types": [["EBS"], {"type": "RDS"}]},
+            ]
+        }
+    }
+    with pytest.raises(ManifestError) as e:
+        parse_manifest(document)
+    assert len(e.value.errors) == 6
+    assert any("[3]: resource_types must be a list" in error for error in e.value.errors)
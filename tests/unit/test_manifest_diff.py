@@ -0,0 +1,90 @@
+import copy
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from ipa_backup.ipa_backup_stack import MANIFEST_FINGERPRINT_METADATA_KEY, IpaBackupStack
+from ipa_backup.manifest import clear_cache, parse_manifest
+from ipa_backup.manifest_diff import AffectedTarget, affected_targets, main
+from tests.factories import make_manifest, write_manifest
+
+
+A = "100000000000"
+B = "100000000001"
+C = "100000000002"
+
+
+def test_fingerprints_only_cover_the_slice_of_the_target():
+    document = make_manifest(2, 6)
+    document[A]["daily"].append(f"arn:aws:ec2:us-east-1:{A}:volume/vol-east")
+    base = parse_manifest(document)
+
+    changed = copy.deepcopy(document)
+    changed[B]["weekly"].pop()
+    changed[A]["daily"].append(f"arn:aws:ec2:us-east-1:{A}:volume/vol-east-2")
+    head = parse_manifest(changed)
+
+    assert head.fingerprint(A, "ap-southeast-2") == base.fingerprint(A, "ap-southeast-2")
+    assert head.fingerprint(A, "us-east-1") != base.fingerprint(A, "us-east-1")
+    assert head.fingerprint(B, "ap-southeast-2") != base.fingerprint(B, "ap-southeast-2")
+
+    # a new vault class rebuilds the stack even though no ARN moved
+    changed[A]["vault_class"] = "gold"
+    assert parse_manifest(changed).fingerprint(A) != base.fingerprint(A)
+
+
+def test_affected_targets_are_added_removed_or_changed():
+    document = make_manifest(3, 3)
+    base = parse_manifest(document)
+    changed = copy.deepcopy(document)
+    del changed[C]
+    changed[B]["daily"] = []
+    changed["100000000009"] = {"daily": ["arn:aws:s3:::new-bucket"]}
+
+    assert affected_targets(base, parse_manifest(changed)) == [
+        AffectedTarget(B, "ap-southeast-2", "changed"),
+        AffectedTarget("100000000009", "ap-southeast-2", "added"),
+        AffectedTarget(C, "ap-southeast-2", "removed"),
+    ]
+    assert affected_targets(base, base) == []
+
+
+def test_an_unchanged_slice_synthesizes_the_same_template(tmp_path):
+    document = make_manifest(2, 9)
+    changed = copy.deepcopy(document)
+    changed[B]["monthly"].pop()
+
+    def synth(manifest, account):
+        clear_cache()
+        stack = IpaBackupStack(
+            core.App(),
+            "stack",
+            env=core.Environment(account=account, region="ap-southeast-2"),
+            manifest_path=write_manifest(tmp_path, manifest, name=f"{id(manifest)}.json"),
+        )
+        return assertions.Template.from_stack(stack).to_json()
+
+    template = synth(document, A)
+    assert template == synth(changed, A)
+    assert template["Metadata"] == {
+        MANIFEST_FINGERPRINT_METADATA_KEY: parse_manifest(document).fingerprint(A, "ap-southeast-2")
+    }
+    assert synth(document, B) != synth(changed, B)
+
+
+def test_cli_prints_the_affected_stages(tmp_path, capsys):
+    document = make_manifest(2, 3)
+    changed = copy.deepcopy(document)
+    changed[A]["weekly"] = []
+    main(
+        [
+            "--base",
+            write_manifest(tmp_path, document, name="base.json"),
+            "--manifest",
+            write_manifest(tmp_path, changed, name="head.json"),
+        ]
+    )
+    assert capsys.readouterr().out.splitlines() == [
+        f"{A} ap-southeast-2 changed",
+        "1 of 2 stages affected",
+    ]
@@ -0,0 +1,47 @@
+import os
+
+from ipa_backup.manifest import load_manifest
+from ipa_backup.parallel_synth import parallel_synth, partition, synth_targets
+from ipa_backup.pipeline_stack import stage_stack_name
+from tests.factories import make_manifest, write_manifest
+
+
+def read_tree(directory):
+    files = {}
+    for current, _, filenames in os.walk(directory):
+        for filename in filenames:
+            full_path = os.path.join(current, filename)
+            with open(full_path, "rb") as f:
+                files[os.path.relpath(full_path, directory)] = f.read()
+    return files
+
+
+def test_partition_keeps_order_and_balances_shards():
+    targets = [(f"{100000000000 + i}", "ap-southeast-2") for i in range(10)]
+    shards = partition(targets, 4)
+    assert [len(shard) for shard in shards] == [3, 3, 2, 2]
+    assert [target for shard in shards for target in shard] == targets
+    assert partition(targets[:2], 8) == [[targets[0]], [targets[1]]]
+
+
+def test_parallel_synth_is_byte_identical_to_a_single_process(tmp_path):
+    manifest = make_manifest(4, 6)
+    manifest["100000000002"]["daily"].append(
+        "arn:aws:ec2:us-east-1:100000000002:volume/vol-1"
+    )
+    manifest_path = write_manifest(tmp_path, manifest)
+    targets = load_manifest(manifest_path).targets()
+
+    single = synth_targets(str(tmp_path / "single"), targets, manifest_path)
+    parallel = parallel_synth(str(tmp_path / "parallel"), workers=2, manifest_path=manifest_path)
+
+    single_files = read_tree(single)
+    parallel_files = read_tree(parallel)
+    assert sorted(parallel_files) == sorted(single_files)
+    assert len([name for name in single_files if name.endswith(".template.json")]) == 5
+    # the stacks are the ones the pipeline deploys to each target
+    for account, region in targets:
+        name = stage_stack_name("ipa-backup-pipeline-construct", "master", account, region, ("832435373672", "ap-southeast-2"))
+        assert f"{name}.template.json" in single_files
+    for name, body in single_files.items():
+        assert parallel_files[name] == body, f"{name} differs"
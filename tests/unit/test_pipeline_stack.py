@@ -0,0 +1,154 @@
+import copy
+import subprocess
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from ipa_backup.manifest import clear_cache, load_manifest, parse_manifest
+from ipa_backup.pipeline_stack import Pipeline, plan_waves, stage_stack_name
+from tests.factories import make_manifest, write_manifest
+
+
+PIPELINE_ENVIRONMENT = core.Environment(account="100000000000", region="ap-southeast-2")
+
+
+def pipeline_stages(stack):
+    template = assertions.Template.from_stack(stack)
+    (pipeline,) = template.find_resources("AWS::CodePipeline::Pipeline").values()
+    return {
+        stage["Name"]: sorted(
+            action["Name"].rsplit(".", 2)[0]
+            for action in stage["Actions"]
+            if action["Name"].endswith("Deploy")
+        )
+        for stage in pipeline["Properties"]["Stages"]
+    }
+
+
+def test_200_accounts_are_planned_into_waves_of_the_configured_width():
+    targets = parse_manifest(make_manifest(200, 3)).targets()
+    waves = plan_waves(targets, 25)
+    assert len(waves) == 8
+    assert all(len(wave) == 25 for wave in waves)
+    assert [target for wave in waves for target in wave] == list(targets)
+    assert len(plan_waves(targets, 30)[-1]) == 20
+    with pytest.raises(ValueError):
+        plan_waves(targets, 0)
+
+
+def test_targets_follow_the_regions_of_each_accounts_arns():
+    manifest = parse_manifest(
+        {
+            "111111111111": {"daily": ["arn:aws:ec2:us-east-1:111111111111:volume/vol-1"]},
+            "222222222222": {
+                "daily": [
+                    "arn:aws:s3:::bucket",
+                    "arn:aws:ec2:eu-west-1:222222222222:volume/vol-2",
+                    "arn:aws:ec2:*:222222222222:volume/*",
+                ]
+            },
+            "333333333333": {},
+        }
+    )
+    assert manifest.targets() == (
+        ("111111111111", "us-east-1"),
+        ("222222222222", "ap-southeast-2"),
+        ("222222222222", "eu-west-1"),
+        ("333333333333", "ap-southeast-2"),
+    )
+    # global ARNs stay in the home region, wildcard regions go everywhere
+    assert manifest.resources("222222222222", "daily", region="eu-west-1") == (
+        "arn:aws:ec2:eu-west-1:222222222222:volume/vol-2",
+        "arn:aws:ec2:*:222222222222:volume/*",
+    )
+    assert "arn:aws:s3:::bucket" in manifest.resources(
+        "222222222222", "daily", region="ap-southeast-2"
+    )
+
+
+def test_pipeline_deploys_a_stage_per_account_region_in_parallel_waves(tmp_path):
+    manifest = make_manifest(3, 3)
+    manifest["100000000001"]["daily"].append(
+        "arn:aws:ec2:us-east-1:100000000001:volume/vol-1"
+    )
+    manifest_path = write_manifest(tmp_path, manifest)
+    clear_cache()
+
+    app = core.App(context={"ipa-backup:wave-width": 3})
+    stack = Pipeline(
+        app,
+        "pipeline",
+        repository_name="ipa-backup",
+        branch_name="master",
+        manifest_path=manifest_path,
+        env=PIPELINE_ENVIRONMENT,
+    )
+
+    stages = pipeline_stages(stack)
+    assert stages["wave-1"] == [
+        "pipeline-master",
+        "pipeline-master-100000000001-ap-southeast-2",
+        "pipeline-master-100000000001-us-east-1",
+    ]
+    # a wave holding a single stage is named after that stage, and a wave of its own tags the deployed revision
+    assert stages["pipeline-master-100000000002-ap-southeast-2"] == ["Deploy"]
+    (pipeline,) = assertions.Template.from_stack(stack).find_resources("AWS::CodePipeline::Pipeline").values()
+    last_stage = pipeline["Properties"]["Stages"][-1]
+    assert last_stage["Actions"][-1]["Name"] == "tag-deployed-revision"
+    # the stage stacks are named as the catalog and restore drill look for them
+    stack_names = {
+        child.node.id: stack.stack_name
+        for child in stack.node.children
+        if isinstance(child, core.Stage)
+        for stack in child.node.children
+        if isinstance(stack, core.Stack)
+    }
+    assert len(stack_names) == 4
+    for stage, stack_name in stack_names.items():
+        suffix = stage[len("pipeline-master-") :]
+        account, region = suffix.split("-", 1) if suffix else ("100000000000", "ap-southeast-2")
+        assert stack_name == stage_stack_name("pipeline", "master", account, region, ("100000000000", "ap-southeast-2"))
+    assert len(load_manifest(manifest_path).targets()) == 4
+
+
+def git(repository, *arguments):
+    subprocess.run(["git", *arguments], cwd=repository, check=True, capture_output=True)
+
+
+def test_only_stages_changed_since_the_deployed_revision_are_deployed(tmp_path):
+    document = make_manifest(3, 3)
+    manifest_path = write_manifest(tmp_path, document)
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", "resources.json")
+    git(tmp_path, "-c", "user.name=ci", "-c", "user.email=ci@example.com", "commit", "-q", "-m", "deployed")
+
+    changed = copy.deepcopy(document)
+    changed["100000000001"]["daily"].pop()
+    write_manifest(tmp_path, changed)
+    clear_cache()
+
+    def stages_since(deployed_ref):
+        stack = Pipeline(
+            core.App(),
+            "pipeline",
+            repository_name="ipa-backup",
+            branch_name="master",
+            manifest_path=manifest_path,
+            env=PIPELINE_ENVIRONMENT,
+            deployed_ref=deployed_ref,
+        )
+        return pipeline_stages(stack)
+
+    assert stages_since("HEAD")["pipeline-master-100000000001-ap-southeast-2"] == ["Deploy"]
+    # source, build, self-mutation, the changed stage and the wave tagging the deployed revision
+    assert len(stages_since("HEAD")) == 5
+    # the first deployment, and any change to the stacks' sources, deploys everything
+    assert stages_since("no-such-tag")["wave-1"] == [
+        "pipeline-master",
+        "pipeline-master-100000000001-ap-southeast-2",
+        "pipeline-master-100000000002-ap-southeast-2",
+    ]
+    (tmp_path / "app.py").write_text("# changed\n")
+    git(tmp_path, "add", "app.py")
+    assert len(stages_since("HEAD")["wave-1"]) == 3
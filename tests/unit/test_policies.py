@@ -0,0 +1,160 @@
+import json
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from ipa_backup.constructs.vaults import SilverIpaVaultCustomConstruct
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+from ipa_backup.manifest import parse_manifest
+from ipa_backup.policies import (
+    CopyAction,
+    DisasterRecovery,
+    PlanPolicy,
+    PolicyError,
+    RetentionTarget,
+    class_policies,
+    cold_storage_after,
+    project_storage,
+    validate_policies,
+)
+from tests.factories import make_manifest
+
+
+def test_cold_storage_only_when_points_stay_cold_for_90_days():
+    assert cold_storage_after(365, warm_days=30) == 30
+    assert cold_storage_after(120, warm_days=30) == 30
+    assert cold_storage_after(119, warm_days=30) is None
+    assert cold_storage_after(365) is None
+
+
+def test_copies_go_to_the_dr_vault_of_the_class():
+    policies = class_policies(
+        "gold", DisasterRecovery(region="ap-southeast-4"), "ap-southeast-2", "123456789012"
+    )
+    assert policies["daily"].copy_actions == ()
+    assert policies["monthly"].copy_actions == (
+        CopyAction(
+            destination_vault_arn="arn:aws:backup:ap-southeast-4:123456789012:backup-vault:ipa-backup-vault-gold",
+            delete_after_days=365,
+            move_to_cold_storage_after_days=30,
+        ),
+    )
+    # a copy into the vault's own region and account is no copy at all
+    local = class_policies(
+        "gold", DisasterRecovery(region="ap-southeast-2"), "ap-southeast-2", "123456789012"
+    )
+    assert all(not policy.copy_actions for policy in local.values())
+
+
+def test_the_dr_vault_of_a_class_can_be_given_by_its_arn():
+    dr_gold = "arn:aws:backup:ap-southeast-4:999999999999:backup-vault:dr-gold"
+    app = core.App(context={"ipa-backup:dr-vault-arns": json.dumps({"gold": dr_gold})})
+    disaster_recovery = DisasterRecovery.from_context(app.node)
+    assert disaster_recovery == DisasterRecovery(vault_arns={"gold": dr_gold})
+    gold = class_policies("gold", disaster_recovery, "ap-southeast-2", "123456789012")
+    assert gold["monthly"].copy_actions[0].destination_vault_arn == dr_gold
+    # platinum has no vault given, and no region or account to copy to
+    platinum = class_policies("platinum", disaster_recovery, "ap-southeast-2", "123456789012")
+    assert all(not policy.copy_actions for policy in platinum.values())
+
+
+def test_aws_constraints_are_reported_together():
+    errors = validate_policies(
+        [
+            PlanPolicy("monthly", delete_after_days=100, move_to_cold_storage_after_days=30),
+            PlanPolicy(
+                "weekly",
+                delete_after_days=90,
+                copy_actions=(CopyAction("arn:aws:backup:x", 0),),
+            ),
+        ],
+        max_retention_days=35,
+    )
+    assert len(errors) == 4
+    assert "cold storage for 90 days" in errors[0]
+    with pytest.raises(PolicyError) as raised:
+        class_policies(
+            "silver",
+            targets={
+                "daily": RetentionTarget(35),
+                "weekly": RetentionTarget(0),
+                "monthly": RetentionTarget(365, warm_days=30),
+            },
+        )
+    assert raised.value.errors == ["weekly plan: recovery points must be kept for at least a day"]
+
+
+def test_invalid_policies_fail_the_synth():
+    app = core.App()
+    stack = core.Stack(app, "stack")
+    policies = class_policies("silver")
+    policies["monthly"] = policies["monthly"]._replace(move_to_cold_storage_after_days=300)
+    with pytest.raises(PolicyError):
+        SilverIpaVaultCustomConstruct(stack, "silver", "o-example", policies=policies)
+
+
+def test_plans_carry_the_lifecycle_and_copies_of_the_class():
+    app = core.App(context={"ipa-backup:dr-account": "999999999999"})
+    stack = IpaBackupStack(
+        app,
+        "ipa-backup",
+        env=core.Environment(account="123456789012", region="ap-southeast-2"),
+        vault_classes=["gold"],
+    )
+    template = assertions.Template.from_stack(stack)
+    template.has_resource_properties(
+        "AWS::Backup::BackupPlan",
+        {
+            "BackupPlan": {
+                "BackupPlanName": "MonthlyIPABackupPlan",
+                "BackupPlanRule": [
+                    assertions.Match.object_like(
+                        {
+                            "Lifecycle": {"DeleteAfterDays": 365, "MoveToColdStorageAfterDays": 30},
+                            "CopyActions": [
+                                {
+                                    "DestinationBackupVaultArn": "arn:aws:backup:ap-southeast-2:999999999999:backup-vault:ipa-backup-vault-gold",
+                                    "Lifecycle": {
+                                        "DeleteAfterDays": 365,
+                                        "MoveToColdStorageAfterDays": 30,
+                                    },
+                                }
+                            ],
+                        }
+                    )
+                ],
+            }
+        },
+    )
+    # the gold lock allows the year the monthly recovery points are kept
+    template.has_resource_properties(
+        "AWS::Backup::BackupVault",
+        {"LockConfiguration": {"ChangeableForDays": 14, "MaxRetentionDays": 365, "MinRetentionDays": 1}},
+    )
+    # silver makes no copies
+    for logical_id, plan in template.find_resources("AWS::Backup::BackupPlan").items():
+        if logical_id.startswith("silver"):
+            assert "CopyActions" not in plan["Properties"]["BackupPlan"]["BackupPlanRule"][0]
+
+
+def test_cold_storage_makes_the_projection_cheaper():
+    projections = project_storage(parse_manifest(make_manifest(10, 30)), size_gb=100, change_rate=0.05)
+    by_frequency = {p.frequency: p for p in projections}
+    assert set(by_frequency) == {"daily", "weekly", "monthly"}
+    assert all(p.resources == 100 for p in projections)
+    monthly = by_frequency["monthly"]
+    assert monthly.cold_gb > 0
+    assert monthly.monthly_cost < monthly.warm_only_cost
+    assert by_frequency["daily"].monthly_cost == by_frequency["daily"].warm_only_cost
+
+
+def test_resources_in_the_dr_account_are_not_copied():
+    manifest = parse_manifest(make_manifest(2, 30, vault_class="gold"))
+    copied = project_storage(manifest, disaster_recovery=DisasterRecovery(account="999999999999"))
+    # the first account is the disaster recovery account, so only the second copies its resources
+    half = project_storage(manifest, disaster_recovery=DisasterRecovery(account="100000000000"))
+    for everywhere, elsewhere in zip(copied, half):
+        assert (everywhere.frequency, everywhere.warm_gb) == (elsewhere.frequency, elsewhere.warm_gb)
+        assert elsewhere.copy_gb == round(everywhere.copy_gb / 2, 1)
+    assert {p.frequency: p.copy_gb > 0 for p in copied} == {"daily": False, "weekly": True, "monthly": True}
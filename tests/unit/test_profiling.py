@@ -0,0 +1,66 @@
+import json
+
+import aws_cdk as core
+import pytest
+
+from ipa_backup import profiling
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+
+
+@pytest.fixture
+def profiler():
+    profiler = profiling.enable()
+    yield profiler
+    profiling.disable()
+
+
+def test_profiling_is_off_unless_asked_for(monkeypatch):
+    monkeypatch.delenv(profiling.PROFILE_ENV_VAR, raising=False)
+    assert profiling.enable_from(core.App()) is None
+    assert profiling.active_profiler() is None
+    try:
+        assert profiling.enable_from(core.App(context={"ipa-backup:profile": "true"}))
+    finally:
+        profiling.disable()
+
+
+def test_report_and_folded_stacks_are_written_next_to_the_assembly(profiler, tmp_path):
+    app = core.App(outdir=str(tmp_path / "cdk.out"))
+    IpaBackupStack(
+        app,
+        "ipa-backup",
+        env=core.Environment(account="832435373672", region="ap-southeast-2"),
+    )
+    report_path = profiling.write_report(app.synth())
+    assert report_path == str(tmp_path / "synth-profile.json")
+
+    with open(report_path) as f:
+        report = json.load(f)
+    frames = {tuple(frame["stack"]): frame for frame in report["frames"]}
+    stack_frame = frames[("IpaBackupStack.__init__",)]
+    vault_frame = frames[("IpaBackupStack.__init__", "SilverIpaVaultCustomConstruct.__init__")]
+    daily_frame = frames[
+        (
+            "IpaBackupStack.__init__",
+            "SilverIpaVaultCustomConstruct.add_resources_from_manifest",
+            "SilverIpaVaultCustomConstruct.add_resource_to_daily_plan",
+        )
+    ]
+    assert vault_frame["jsii_calls"] > 0
+    assert daily_frame["calls"] == 1 and daily_frame["jsii_calls"] > 0
+    assert stack_frame["jsii_calls"] >= vault_frame["jsii_calls"] + daily_frame["jsii_calls"]
+    assert stack_frame["self_jsii_calls"] < stack_frame["jsii_calls"]
+    assert report["templates"] == [
+        {
+            "template": "ipa-backup.template.json",
+            "resources": report["template_resources"],
+            "bytes": report["template_bytes"],
+        }
+    ]
+    assert report["template_resources"] > 0
+
+    folded = (tmp_path / "synth-profile.folded").read_text().splitlines()
+    assert any(
+        line.startswith("IpaBackupStack.__init__;SilverIpaVaultCustomConstruct.__init__ ")
+        for line in folded
+    )
@@ -0,0 +1,240 @@
+import csv
+import json
+import threading
+
+from ipa_backup.catalog import CatalogVault, RecoveryPoint, RecoveryPointCatalog
+from ipa_backup.restore_drill import (
+    HISTOGRAM_BUCKETS,
+    POLL_MAX_SECONDS,
+    ScaledClock,
+    SimulatedAws,
+    main,
+    run_drills,
+    select_samples,
+    stack_backup_role,
+    wait_for_restore,
+    write_report,
+)
+
+
+ACCOUNT = "123456789012"
+REGION = "ap-southeast-2"
+LATENCIES = {
+    ("silver", "EBS"): 90,
+    ("gold", "EBS"): 40,
+    ("platinum", "EBS"): 10,
+    ("silver", "RDS"): 180,
+    ("gold", "RDS"): 60,
+    ("platinum", "RDS"): 20,
+}
+RESOURCES = {
+    "EBS": "arn:aws:ec2:ap-southeast-2:123456789012:volume/vol-{number}",
+    "RDS": "arn:aws:rds:ap-southeast-2:123456789012:db:orders-{number}",
+    "EFS": "arn:aws:elasticfilesystem:ap-southeast-2:123456789012:file-system/fs-{number}",
+    "S3": "arn:aws:s3:::bucket-{number}",
+}
+
+
+def vault(vault_class):
+    return CatalogVault(f"arn:aws:backup:{REGION}:{ACCOUNT}:backup-vault:ipa-backup-vault-{vault_class}", vault_class)
+
+
+def catalog_of(points_per_resource=2):
+    catalog = RecoveryPointCatalog(":memory:")
+    for vault_class in ("silver", "gold", "platinum"):
+        points = []
+        for resource_type, resource_arn in RESOURCES.items():
+            for number in range(3):
+                for day in range(points_per_resource):
+                    points.append(
+                        RecoveryPoint(
+                            recovery_point_arn=f"arn:aws:backup:{REGION}:{ACCOUNT}:recovery-point:{vault_class}-{resource_type}-{number}-{day}",
+                            resource_arn=resource_arn.format(number=number),
+                            resource_type=resource_type,
+                            vault_arn=vault(vault_class).vault_arn,
+                            vault_class=vault_class,
+                            created_at=1_790_000_000 + day * 86400,
+                            status="COMPLETED",
+                        )
+                    )
+        catalog.record(vault(vault_class), points)
+    return catalog
+
+
+def role_for(account, region):
+    return f"arn:aws:iam::{account}:role/backup-role"
+
+
+class CountingAws(SimulatedAws):
+    # tracks how many restores run at once
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = 0
+        self.peak = 0
+        self._count_lock = threading.Lock()
+
+    def start_restore_job(self, **arguments):
+        with self._count_lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        return super().start_restore_job(**arguments)
+
+    def delete_volume(self, **arguments):
+        with self._count_lock:
+            self.running -= 1
+        self.deleted.append(("delete_volume", arguments))
+
+    def delete_db_instance(self, **arguments):
+        with self._count_lock:
+            self.running -= 1
+        self.deleted.append(("delete_db_instance", arguments))
+
+
+def test_samples_are_the_newest_points_of_each_class_and_drillable_type():
+    points = catalog_of().restorable()
+    samples = select_samples(points, per_group=2, seed=1)
+    # three classes of EBS, RDS and EFS, s3 can't be restored as a new resource
+    assert len(samples) == 3 * 3 * 2
+    assert {point.resource_type for point in samples} == {"EBS", "RDS", "EFS"}
+    assert all(point.recovery_point_arn.endswith("-1") for point in samples)
+    assert select_samples(points, per_group=2, seed=1) == samples
+
+
+def test_drills_restore_concurrently_and_report_the_time_to_restore_of_each_class(tmp_path):
+    samples = select_samples(
+        [point for point in catalog_of().restorable() if point.resource_type in ("EBS", "RDS")],
+        per_group=3,
+    )
+    clock = ScaledClock(scale=20_000)
+    aws = CountingAws(clock, LATENCIES, seed=3)
+    results = run_drills(samples, aws, role_for, workers=6, sleep=clock.sleep, clock=clock)
+
+    assert [result.recovery_point_arn for result in results] == [point.recovery_point_arn for point in samples]
+    assert all(result.status == "COMPLETED" and result.cleaned_up for result in results)
+    assert aws.peak == 6
+    # every restore made a new resource, under a name of its own, and that resource was deleted
+    for job in aws.jobs.values():
+        if job["ResourceType"] == "RDS":
+            assert job["Metadata"]["DBInstanceIdentifier"].startswith("orders-")
+            assert "-drill-" in job["Metadata"]["DBInstanceIdentifier"]
+        assert job["IamRoleArn"] == role_for(ACCOUNT, REGION)
+    deleted = {arguments.get("VolumeId") or arguments.get("DBInstanceIdentifier") for _, arguments in aws.deleted}
+    assert len(deleted) == len(results) == 18
+
+    report = write_report(results, tmp_path / "drill.json", tmp_path / "drill.csv")
+    assert json.loads((tmp_path / "drill.json").read_text()) == report
+    classes = report["classes"]
+    assert list(classes) == ["gold", "platinum", "silver"]
+    for vault_class, summary in classes.items():
+        assert summary["restores"] == 6 and summary["failed"] == 0
+        assert list(summary["histogram"]) == list(HISTOGRAM_BUCKETS)
+        assert sum(summary["histogram"].values()) == 6
+        # each latency is within a quarter of the simulated mean
+        slowest = max(minutes for (latency_class, _), minutes in LATENCIES.items() if latency_class == vault_class)
+        assert summary["max_seconds"] <= slowest * 60 * 1.25
+    assert classes["platinum"]["p95_seconds"] < classes["gold"]["p95_seconds"] < classes["silver"]["p95_seconds"]
+    with open(tmp_path / "drill.csv", newline="") as csv_file:
+        assert len(list(csv.DictReader(csv_file))) == 18
+
+
+def test_failed_restores_are_reported_without_cleanup():
+    samples = select_samples(catalog_of().restorable(), per_group=1, seed=2)
+    clock = ScaledClock(scale=20_000)
+    aws = SimulatedAws(clock, LATENCIES, failure_rate=1.0)
+    results = run_drills(samples, aws, role_for, workers=4, sleep=clock.sleep, clock=clock)
+    assert all(result.status == "FAILED" and result.error == "simulated failure" for result in results)
+    assert not aws.deleted
+    summary = write_report(results)["classes"]["gold"]
+    assert (summary["failed"], summary["p95_seconds"]) == (3, None)
+
+
+def test_restores_that_time_out_are_cleaned_up_once_they_finish():
+    samples = select_samples(
+        [point for point in catalog_of().restorable() if point.resource_type == "EBS"], per_group=1
+    )
+    clock = ScaledClock(scale=20_000)
+    aws = SimulatedAws(clock, LATENCIES, seed=4)
+    # every restore takes longer than the drill waits for it, and finishes within the cleanup timeout
+    results = run_drills(
+        samples, aws, role_for, workers=3, sleep=clock.sleep, clock=clock, timeout=60, cleanup_timeout=3 * 3600
+    )
+    assert all(result.status is None and result.error.startswith("TimeoutError") for result in results)
+    assert all(result.cleaned_up and not result.needs_cleanup for result in results)
+    assert len(aws.deleted) == 3
+
+    # restores still running after the cleanup timeout are left to be deleted by hand
+    aws = SimulatedAws(clock, LATENCIES, seed=4)
+    results = run_drills(samples, aws, role_for, workers=3, sleep=clock.sleep, clock=clock, timeout=60, cleanup_timeout=60)
+    assert all(result.needs_cleanup and not result.cleaned_up for result in results)
+    assert all(f"restore job {result.restore_job_id} needs cleanup by hand" in result.error for result in results)
+    assert not aws.deleted
+
+
+class RunningClient:
+    def __init__(self, polls_before_done):
+        self.polls = 0
+        self.polls_before_done = polls_before_done
+
+    def describe_restore_job(self, RestoreJobId):
+        self.polls += 1
+        return {"Status": "COMPLETED" if self.polls > self.polls_before_done else "RUNNING"}
+
+
+def test_restore_jobs_are_polled_with_backoff_until_the_timeout():
+    sleeps = []
+    now = [0.0]
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    job = wait_for_restore(RunningClient(7), "restore-1", sleep=sleep, clock=lambda: now[0])
+    assert job["Status"] == "COMPLETED"
+    assert sleeps == [15, 30, 60, 120, 240, POLL_MAX_SECONDS, POLL_MAX_SECONDS]
+
+    try:
+        wait_for_restore(RunningClient(100), "restore-2", sleep=sleep, clock=lambda: now[0], timeout=600)
+    except TimeoutError as e:
+        assert "restore-2 is still RUNNING" in str(e)
+    else:
+        raise AssertionError("the restore should have timed out")
+
+
+def test_the_backup_role_is_read_from_the_stack_outputs():
+    class CloudFormation:
+        def describe_stacks(self, StackName):
+            assert StackName == f"ipa-backup-{ACCOUNT}-{REGION}"
+            return {
+                "Stacks": [
+                    {
+                        "Outputs": [
+                            {"OutputKey": "silverMemberAccountBackupVaultOutput98D80434", "OutputValue": vault("silver").vault_arn},
+                            {"OutputKey": "silverbackuprolearnoutputC291B5BB", "OutputValue": role_for(ACCOUNT, REGION)},
+                        ]
+                    }
+                ]
+            }
+
+    assert stack_backup_role(CloudFormation(), f"ipa-backup-{ACCOUNT}-{REGION}") == role_for(ACCOUNT, REGION)
+
+
+def test_the_cli_drills_offline_against_the_simulator(tmp_path, capsys):
+    catalog = RecoveryPointCatalog(str(tmp_path / "catalog.sqlite"))
+    source = catalog_of()
+    for vault_class in ("silver", "gold", "platinum"):
+        catalog.record(vault(vault_class), [point for point in source.restorable(vault_class)])
+    catalog.close()
+
+    main([
+        "--catalog", str(tmp_path / "catalog.sqlite"),
+        "--resource-type", "EBS",
+        "--simulate", "--time-scale", "50000",
+        "--report", str(tmp_path / "drill.json"),
+    ])
+    report = json.loads((tmp_path / "drill.json").read_text())
+    assert {vault_class: summary["restores"] for vault_class, summary in report["classes"].items()} == {
+        "gold": 1,
+        "platinum": 1,
+        "silver": 1,
+    }
+    assert capsys.readouterr().out.splitlines()[0].split() == ["class", "restores", "failed", "p50", "p95", "max"]
@@ -0,0 +1,67 @@
+import pytest
+
+from ipa_backup.manifest import parse_manifest
+from ipa_backup.schedule import (
+    MaintenanceEnvelope,
+    backup_window,
+    hourly_load,
+    load_report,
+    plan_windows,
+    stock_window,
+)
+from tests.factories import make_manifest
+
+
+def test_windows_are_deterministic_and_inside_the_envelope():
+    envelope = MaintenanceEnvelope(start_hour=20, hours=8)
+    for number in range(200):
+        account = str(100000000000 + number)
+        for frequency, window in plan_windows(account, "silver", envelope).items():
+            assert window == backup_window(account, "silver", frequency, envelope)
+            # the envelope runs past midnight, from 20:00 to 04:00 UTC
+            offset = (window.minute_of_day - 20 * 60) % (24 * 60)
+            assert offset + window.start_window_minutes <= 8 * 60
+            assert offset + window.completion_window_minutes <= 8 * 60
+            assert window.minute_of_day % 15 == 0
+            assert window.completion_window_minutes >= window.start_window_minutes + 60
+
+
+def test_each_region_of_an_account_gets_its_own_windows():
+    account = "123456789012"
+    regions = ["ap-southeast-2", "us-east-1", "eu-west-1", "us-west-2"]
+    windows = [plan_windows(account, "gold", region=region) for region in regions]
+    assert windows[0]["daily"] != windows[1]["daily"]
+    assert len({window["daily"].minute_of_day for window in windows}) > 1
+
+
+def test_schedule_expressions():
+    assert stock_window("daily").schedule_expression() == "cron(0 5 * * ? *)"
+    assert stock_window("weekly").schedule_expression() == "cron(0 5 ? * SAT *)"
+    assert stock_window("monthly").schedule_expression() == "cron(0 5 1 * ? *)"
+    window = backup_window("123456789012", "gold", "monthly")
+    assert window.schedule_expression().endswith(f" {window.month_day} * ? *)")
+
+
+def test_invalid_envelopes_are_rejected():
+    with pytest.raises(ValueError):
+        MaintenanceEnvelope(start_hour=24).validate()
+    with pytest.raises(ValueError):
+        MaintenanceEnvelope(month_days=(30,)).validate()
+    with pytest.raises(ValueError):
+        backup_window("123456789012", "silver", "hourly")
+
+
+def test_hourly_load_wraps_around_the_period():
+    # a daily job at 23:30 for an hour runs into the next day, and the last day into the first
+    window = backup_window("123456789012", "silver", "daily")._replace(minute_of_day=23 * 60 + 30)
+    load = hourly_load([(window, 10)], job_minutes=60, days=2)
+    assert load == [10] + [0] * 22 + [10, 10] + [0] * 22 + [10]
+
+
+def test_staggering_flattens_the_fleet_peak():
+    report = load_report(parse_manifest(make_manifest(200, 5)))
+    assert report["staggered_peak"] * 4 < report["stock_peak"]
+    # the stock presets all run at 05:00 UTC, the staggered windows never leave the envelope
+    assert {row["hour"] for row in report["hours"] if row["stock_peak"]} == {5}
+    busy = {row["hour"] for row in report["hours"] if row["staggered_peak"]}
+    assert busy <= set(range(12, 21))
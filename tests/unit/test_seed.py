@@ -0,0 +1,70 @@
+import os
+import zipfile
+
+from ipa_backup.seed import IgnoreRules, build_seed_archive, list_seed_files
+
+
+def make_tree(root, files):
+    for relative, content in files.items():
+        full_path = root / relative
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_text(content)
+
+
+def test_gitignore_rules():
+    rules = IgnoreRules(["# comment", "*.py[cod]", "/build.txt", "logs/", "!keep.pyc", "docs/**/*.tmp"])
+    assert rules.ignored("a/b/module.pyc")
+    assert not rules.ignored("a/b/module.py")
+    assert not rules.ignored("a/keep.pyc")
+    assert rules.ignored("build.txt")
+    assert not rules.ignored("nested/build.txt")
+    assert rules.ignored("a/logs", is_directory=True)
+    assert not rules.ignored("a/logs")
+    assert rules.ignored("docs/x/y/z.tmp")
+    assert rules.ignored("docs/z.tmp")
+
+
+def test_seed_honours_gitignore_and_default_patterns(tmp_path):
+    make_tree(
+        tmp_path,
+        {
+            ".gitignore": "/secret.txt\n",
+            "app.py": "app",
+            "secret.txt": "secret",
+            "pkg/module.py": "module",
+            "pkg/__pycache__/module.cpython-311.pyc": "cache",
+            "pkg/stale.pyc": "cache",
+            ".venv/lib/site.py": "venv",
+            "cdk.out/manifest.json": "{}",
+            ".git/HEAD": "ref",
+        },
+    )
+    assert list_seed_files(str(tmp_path)) == [".gitignore", "app.py", "pkg/module.py"]
+
+
+def test_archive_is_content_addressed_and_reused(tmp_path):
+    make_tree(tmp_path, {"app.py": "app", "pkg/module.py": "module"})
+    cache = str(tmp_path / ".seed-cache")
+
+    first = build_seed_archive(str(tmp_path), cache)
+    with open(first, "rb") as f:
+        first_bytes = f.read()
+    with zipfile.ZipFile(first) as archive:
+        assert archive.namelist() == ["app.py", "pkg/module.py"]
+        assert archive.read("pkg/module.py") == b"module"
+
+    # an unchanged tree reuses the cached archive, even with new timestamps
+    os.utime(tmp_path / "app.py", (0, 0))
+    assert build_seed_archive(str(tmp_path), cache) == first
+
+    (tmp_path / "app.py").write_text("changed")
+    second = build_seed_archive(str(tmp_path), cache)
+    assert second != first
+
+    # changing it back gives back the same bytes, so the asset hash is stable too
+    (tmp_path / "app.py").write_text("app")
+    os.remove(first)
+    rebuilt = build_seed_archive(str(tmp_path), cache)
+    assert rebuilt == first
+    with open(rebuilt, "rb") as f:
+        assert f.read() == first_bytes
@@ -0,0 +1,141 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from ipa_backup.constructs.spillover import SelectionSpillover
+from ipa_backup.constructs.vaults import SilverIpaVaultCustomConstruct
+from ipa_backup.selections import (
+    MAX_RESOURCES_PER_SELECTION,
+    MAX_WILDCARDS_PER_SELECTION,
+    coalesce_arns,
+    shard_arns,
+)
+from tests.factories import make_manifest
+
+
+ACCOUNT = "100000000000"
+
+
+def volume_arns(count: int):
+    return make_manifest(1, count, frequencies=("daily",))[ACCOUNT]["daily"]
+
+
+def test_small_lists_keep_a_single_unsharded_selection():
+    arns = volume_arns(10)
+    assert shard_arns(arns) == {"": tuple(sorted(arns))}
+
+
+def test_10k_arns_are_split_into_shards_under_the_limit():
+    arns = volume_arns(10_000)
+    shards = shard_arns(arns)
+    sizes = [len(shard) for shard in shards.values()]
+    assert sum(sizes) == 10_000
+    assert max(sizes) <= MAX_RESOURCES_PER_SELECTION
+    # a binary split of 10k ARNs stops between 20 and 64 shards
+    assert 20 <= len(shards) <= 64
+    assert all(key and set(key) <= {"0", "1"} for key in shards)
+    # every ARN lands in exactly one shard
+    assert len({arn for shard in shards.values() for arn in shard}) == 10_000
+
+
+def test_adding_an_arn_only_touches_one_shard():
+    arns = volume_arns(10_000)
+    before = shard_arns(arns)
+    after = shard_arns(arns + ["arn:aws:ec2:ap-southeast-2:100000000000:volume/vol-new"])
+    changed = {key for key in set(before) | set(after) if before.get(key) != after.get(key)}
+    # either the ARN joined a shard, or that shard was split in two
+    assert 1 <= len(changed) <= 3
+    assert shard_arns(list(reversed(arns))) == before
+
+
+def test_wildcards_are_capped_per_shard():
+    arns = [f"arn:aws:ec2:ap-southeast-2:{ACCOUNT}:volume/vol-{i:03d}*" for i in range(100)]
+    shards = shard_arns(arns)
+    assert len(shards) > 1
+    assert all(len(shard) <= MAX_WILDCARDS_PER_SELECTION for shard in shards.values())
+
+
+def test_wildcards_coalesce_the_arns_they_cover():
+    arns = [
+        "arn:aws:ec2:ap-southeast-2:111111111111:volume/vol-1",
+        "arn:aws:ec2:ap-southeast-2:111111111111:volume/*",
+        "arn:aws:ec2:ap-southeast-2:111111111111:instance/i-1",
+        "arn:aws:ec2:ap-southeast-2:111111111111:volume/vol-2",
+        "arn:aws:ec2:ap-southeast-2:111111111111:instance/i-1",
+    ]
+    assert coalesce_arns(arns) == (
+        "arn:aws:ec2:ap-southeast-2:111111111111:volume/*",
+        "arn:aws:ec2:ap-southeast-2:111111111111:instance/i-1",
+    )
+
+
+def test_only_stars_are_wildcards_when_coalescing():
+    arns = [
+        "arn:aws:s3:::bucket-?",
+        "arn:aws:s3:::bucket-1",
+        "arn:aws:s3:::logs-[ab]*",
+        "arn:aws:s3:::logs-a",
+        "arn:aws:s3:::logs-[ab]-2026",
+    ]
+    assert coalesce_arns(arns) == (
+        "arn:aws:s3:::bucket-?",
+        "arn:aws:s3:::bucket-1",
+        "arn:aws:s3:::logs-[ab]*",
+        "arn:aws:s3:::logs-a",
+    )
+
+
+def synth_selection_ids(arns):
+    app = core.App()
+    stack = core.Stack(app, "selections")
+    vault = SilverIpaVaultCustomConstruct(stack, "silver", organization_id="o-test")
+    vault.add_resource_to_daily_plan(resource_arns=arns, selection_id="all")
+    # selections past the stack's template limits spill into nested stacks
+    selections = {}
+    stacks = [stack] + [nested for nested, _ in SelectionSpillover.of(stack).nested_stacks.values()]
+    for template_stack in stacks:
+        template = assertions.Template.from_stack(template_stack)
+        selections.update(template.find_resources("AWS::Backup::BackupSelection"))
+    return selections
+
+
+def test_10k_arn_account_synthesizes_stable_shards():
+    arns = volume_arns(10_000)
+    first = synth_selection_ids(arns)
+    second = synth_selection_ids(list(reversed(arns)))
+
+    assert len(first) == len(shard_arns(arns))
+    assert first.keys() == second.keys()
+    sizes = [len(s["Properties"]["BackupSelection"]["Resources"]) for s in first.values()]
+    assert sum(sizes) == 10_000
+    assert max(sizes) <= MAX_RESOURCES_PER_SELECTION
+
+
+def test_tag_selection_emits_conditions_scoped_to_resource_types():
+    app = core.App()
+    stack = core.Stack(app, "tags")
+    vault = SilverIpaVaultCustomConstruct(stack, "silver", organization_id="o-test")
+    vault.add_tag_selection(
+        frequency="daily",
+        tags={"backup-class": "silver"},
+        resource_types=["EBS", "RDS"],
+        selection_id="silver",
+    )
+    template = assertions.Template.from_stack(stack)
+    template.has_resource_properties(
+        "AWS::Backup::BackupSelection",
+        {
+            "BackupSelection": {
+                "SelectionName": "DailyTagSelection-silver",
+                "IamRoleArn": assertions.Match.any_value(),
+                "Resources": ["arn:aws:ec2:*:*:volume/*", "arn:aws:rds:*:*:db:*"],
+                "Conditions": {
+                    "StringEquals": [
+                        {
+                            "ConditionKey": "aws:ResourceTag/backup-class",
+                            "ConditionValue": "silver",
+                        }
+                    ]
+                },
+            }
+        },
+    )
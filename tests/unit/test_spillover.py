@@ -0,0 +1,81 @@
+import json
+import os
+
+import aws_cdk as core
+
+from ipa_backup.constructs.spillover import SelectionSpillover
+from ipa_backup.ipa_backup_stack import IpaBackupStack
+from ipa_backup.template_budget import (
+    MAX_TEMPLATE_BYTES,
+    MAX_TEMPLATE_RESOURCES,
+    NESTED_SLOTS,
+    TemplateBudget,
+    TemplatePlanner,
+)
+from tests.factories import make_manifest, write_manifest
+
+
+def test_20k_arn_account_synthesizes_into_several_templates_under_the_limits(tmp_path):
+    manifest_path = write_manifest(tmp_path, make_manifest(1, 20_000))
+    outdir = tmp_path / "cdk.out"
+    app = core.App(outdir=str(outdir))
+    IpaBackupStack(
+        app,
+        "ipa-backup",
+        env=core.Environment(account="100000000000", region="ap-southeast-2"),
+        manifest_path=manifest_path,
+    )
+    app.synth()
+
+    templates = {}
+    for name in os.listdir(outdir):
+        if name.endswith(".template.json"):
+            body = (outdir / name).read_bytes()
+            assert len(body) <= MAX_TEMPLATE_BYTES, f"{name} is {len(body)} bytes"
+            templates[name] = json.loads(body)
+    assert len(templates) >= 3
+
+    selected = []
+    for name, template in templates.items():
+        resources = template["Resources"]
+        assert len(resources) <= MAX_TEMPLATE_RESOURCES
+        for resource in resources.values():
+            if resource["Type"] != "AWS::Backup::BackupSelection":
+                continue
+            selection = resource["Properties"]["BackupSelection"]
+            selected.extend(selection["Resources"])
+            if name != "ipa-backup.template.json":
+                # the role and plans stay in the parent and are passed in as parameters
+                assert "Ref" in selection["IamRoleArn"]
+                assert selection["IamRoleArn"]["Ref"] in template["Parameters"]
+                assert resource["Properties"]["BackupPlanId"]["Ref"] in template["Parameters"]
+    assert len(selected) == len(set(selected)) == 20_000
+
+    parent = templates["ipa-backup.template.json"]["Resources"].values()
+    assert sum(r["Type"] == "AWS::CloudFormation::Stack" for r in parent) == len(templates) - 1
+
+
+def test_spilled_selections_keep_their_template_whatever_the_order():
+    keys = [f"silver-DailyBackupSelection-all-{number:03b}" for number in range(8)]
+
+    def placements(order):
+        # the stack's own template is already full, so every selection spills
+        planner = TemplatePlanner(TemplateBudget(resources=MAX_TEMPLATE_RESOURCES))
+        return {key: planner.place(1, 50_000, key) for key in order}
+
+    placed = placements(keys)
+    assert placements(list(reversed(keys))) == placed
+    assert set(placed.values()) <= set(range(1, NESTED_SLOTS + 1))
+    # removing a selection moves none of the others
+    assert placements(keys[1:]) == {key: template for key, template in placed.items() if key != keys[0]}
+
+
+def test_resources_added_between_selections_are_measured():
+    app = core.App()
+    stack = core.Stack(app, "stack")
+    spillover = SelectionSpillover.of(stack)
+    assert spillover.scope_for(stack, resources=1, size=500, key="first") is stack
+    # the stack fills up after its first selection
+    for number in range(MAX_TEMPLATE_RESOURCES):
+        core.CfnResource(stack, f"topic-{number}", type="AWS::SNS::Topic")
+    assert spillover.scope_for(stack, resources=1, size=500, key="second") is not stack
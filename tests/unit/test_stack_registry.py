@@ -0,0 +1,44 @@
+import aws_cdk as core
+import pytest
+
+from ipa_backup.stack_registry import StackRegistry, selection_from
+
+
+def make_registry(built):
+    registry = StackRegistry()
+    for name in ("ipa-backup-code-construct", "ipa-backup-pipeline-construct", "ipa-backup-reports"):
+
+        @registry.register(name)
+        def factory(scope, construct_id):
+            built.append(construct_id)
+            return core.Stack(scope, construct_id)
+
+    return registry
+
+
+def test_only_the_selected_stacks_are_built(monkeypatch):
+    monkeypatch.delenv("IPA_BACKUP_STACKS", raising=False)
+    built = []
+    registry = make_registry(built)
+    app = core.App(context={"ipa-backup:stacks": "ipa-backup-pipeline-construct, *-reports"})
+    stacks = registry.build(app)
+    assert built == ["ipa-backup-pipeline-construct", "ipa-backup-reports"]
+    assert [stack.stack_name for stack in app.synth().stacks] == list(stacks)
+
+
+def test_every_stack_is_built_without_a_selection(monkeypatch):
+    monkeypatch.delenv("IPA_BACKUP_STACKS", raising=False)
+    built = []
+    make_registry(built).build(core.App())
+    assert len(built) == 3
+    # the environment variable wins over the context
+    monkeypatch.setenv("IPA_BACKUP_STACKS", "ipa-backup-code-construct")
+    assert selection_from(core.App(context={"ipa-backup:stacks": "*"})) == ["ipa-backup-code-construct"]
+
+
+def test_a_selection_matching_nothing_is_an_error():
+    registry = make_registry([])
+    with pytest.raises(ValueError, match="no stack matches ipa-backup-pipline"):
+        registry.selected(["ipa-backup-pipline"])
+    with pytest.raises(ValueError):
+        registry.register("ipa-backup-reports")(lambda scope, construct_id: None)
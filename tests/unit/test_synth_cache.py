@@ -0,0 +1,31 @@
+from tests.factories import make_manifest
+from tests.synth_cache import SynthCache
+
+
+ACCOUNT = "100000000000"
+REGION = "ap-southeast-2"
+
+
+def test_templates_are_synthesized_once_and_reused_from_disk(tmp_path):
+    manifest = make_manifest(1, 6, vault_class="gold")
+    cache = SynthCache(tmp_path)
+    first = cache.synth(account=ACCOUNT, region=REGION, manifest=manifest)
+    assert cache.synthesized == 1
+    assert cache.synth(account=ACCOUNT, region=REGION, manifest=manifest) is first
+
+    # a later session reads the same templates back rather than synthesizing them
+    later = SynthCache(tmp_path)
+    reused = later.synth(account=ACCOUNT, region=REGION, manifest=manifest)
+    assert later.synthesized == 0
+    assert reused == first
+    reused.template.resource_count_is("AWS::Backup::BackupSelection", 3)
+
+
+def test_the_manifest_context_and_arguments_are_part_of_the_key(tmp_path):
+    cache = SynthCache(tmp_path)
+    manifest = make_manifest(1, 6)
+    key = cache.key("ipa-backup", ACCOUNT, REGION, None, manifest)
+    assert key == cache.key("ipa-backup", ACCOUNT, REGION, {}, make_manifest(1, 6))
+    assert key != cache.key("ipa-backup", ACCOUNT, REGION, None, make_manifest(1, 7))
+    assert key != cache.key("ipa-backup", ACCOUNT, REGION, {"ipa-backup:telemetry": "true"}, manifest)
+    assert key != cache.key("ipa-backup", ACCOUNT, REGION, None, manifest, vault_classes=["gold"])
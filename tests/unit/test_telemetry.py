@@ -0,0 +1,158 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+from ipa_backup.constructs.telemetry import BATCH_SIZE
+from ipa_backup.lambdas.backup_telemetry import (
+    BACKUP_JOB_STATE_CHANGE,
+    BACKUP_VAULT_STATE_CHANGE,
+    MAX_VALUES_PER_METRIC,
+    NAMESPACE,
+    publish,
+)
+
+
+VAULT_CLASSES = {"silver-vault": "silver", "gold-vault": "gold"}
+ACCOUNTS = ["111111111111", "222222222222", "333333333333"]
+RESOURCE_TYPES = ["EBS", "RDS", "EFS"]
+STARTED = datetime(2026, 10, 1, 14, tzinfo=timezone.utc)
+
+
+def iso(moment):
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+def job_event(number, vault_name, account, resource_type, state, minutes):
+    return {
+        "detail-type": BACKUP_JOB_STATE_CHANGE,
+        "account": account,
+        "time": iso(STARTED + timedelta(minutes=minutes)),
+        "detail": {
+            "backupJobId": f"job-{number}",
+            "backupVaultName": vault_name,
+            "resourceType": resource_type,
+            "state": state,
+            "creationDate": iso(STARTED),
+            "completionDate": iso(STARTED + timedelta(minutes=minutes)),
+            "bytesTransferred": "1048576",
+        },
+    }
+
+
+def burst(count, seed=7):
+    # a night of jobs: mostly completed, some failed, with as many running events besides
+    generator = random.Random(seed)
+    events = []
+    for number in range(count):
+        vault_name = generator.choice(list(VAULT_CLASSES))
+        account = generator.choice(ACCOUNTS)
+        resource_type = generator.choice(RESOURCE_TYPES)
+        state = "FAILED" if number % 20 == 0 else "COMPLETED"
+        events.append(job_event(number, vault_name, account, resource_type, "RUNNING", 0))
+        events.append(job_event(number, vault_name, account, resource_type, state, generator.randint(1, 300)))
+    generator.shuffle(events)
+    return events
+
+
+def sqs_batches(events, size=BATCH_SIZE):
+    records = [{"messageId": str(number), "body": json.dumps(event)} for number, event in enumerate(events)]
+    return [records[start : start + size] for start in range(0, len(records), size)]
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def test_a_burst_of_jobs_is_aggregated_into_emf_documents():
+    events = burst(12_000)
+    documents = []
+    for records in sqs_batches(events):
+        published = publish(records, VAULT_CLASSES, emit=lambda line: documents.append(json.loads(line)), clock=lambda: 1_790_000_000)
+        # 1,000 events become a document per class, account and resource type, and a few more for durations
+        assert published["events"] == len(records)
+        assert published["documents"] < 50
+
+    for document in documents:
+        (directive,) = document["_aws"]["CloudWatchMetrics"]
+        assert directive["Namespace"] == NAMESPACE
+        assert document["_aws"]["Timestamp"] == 1_790_000_000_000
+        for dimensions in directive["Dimensions"]:
+            assert all(dimension in document for dimension in dimensions)
+        for metric in directive["Metrics"]:
+            assert metric["Name"] in document
+        assert len(document.get("JobDuration", ())) <= MAX_VALUES_PER_METRIC
+
+    # the documents add up to the events, job by job
+    finished = [event for event in events if event["detail"]["state"] != "RUNNING"]
+    assert sum(document.get("Jobs", 0) for document in documents) == 12_000
+    assert sum(document.get("JobsFailed", 0) for document in documents) == 600
+    assert sum(document.get("BytesTransferred", 0) for document in documents) == 12_000 * 1_048_576
+    for vault_name, vault_class in VAULT_CLASSES.items():
+        expected = [
+            (datetime.fromisoformat(event["time"].replace("Z", "+00:00")) - STARTED).total_seconds()
+            for event in finished
+            if event["detail"]["backupVaultName"] == vault_name
+        ]
+        durations = [
+            duration
+            for document in documents
+            if document["VaultClass"] == vault_class
+            for duration in document.get("JobDuration", ())
+        ]
+        assert sorted(durations) == sorted(expected)
+        assert percentile(durations, 0.95) == percentile(expected, 0.95)
+
+
+def test_events_of_other_vaults_and_malformed_records_are_skipped():
+    events = [
+        job_event(1, "gold-vault", ACCOUNTS[0], "EBS", "COMPLETED", 30),
+        job_event(2, "someone-elses-vault", ACCOUNTS[0], "EBS", "COMPLETED", 30),
+        {"detail-type": BACKUP_VAULT_STATE_CHANGE, "account": ACCOUNTS[0], "detail": {"backupVaultName": "gold-vault", "state": "CREATED"}},
+    ]
+    records = sqs_batches(events)[0] + [{"messageId": "bad", "body": "not json"}]
+    documents = []
+    published = publish(records, VAULT_CLASSES, emit=lambda line: documents.append(json.loads(line)))
+    assert published == {"events": 3, "ignored": 1, "documents": 2}
+    jobs, vault = documents
+    assert (jobs["ResourceType"], jobs["Jobs"], jobs["JobDuration"]) == ("EBS", 1, [1800.0])
+    assert (vault["ResourceType"], vault["VaultStateChanges"]) == ("BackupVault", 1)
+    assert "JobDuration" not in vault
+
+
+def test_telemetry_publishes_each_vault_under_its_class(synth_cache):
+    template = synth_cache.synth(
+        account=ACCOUNTS[0],
+        region="ap-southeast-2",
+        context={
+            "ipa-backup:telemetry": "true",
+            # as -c on the command line sets it
+            "ipa-backup:job-duration-alarm-minutes": '{"gold": 120}',
+        },
+        vault_classes=["silver", "gold"],
+    ).template
+    template.resource_count_is("AWS::Lambda::Function", 1)
+    template.resource_count_is("AWS::SQS::Queue", 1)
+    template.resource_count_is("AWS::CloudWatch::Dashboard", 1)
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {"BatchSize": BATCH_SIZE})
+    alarms = template.find_resources("AWS::CloudWatch::Alarm")
+    thresholds = {
+        alarm["Properties"]["Dimensions"][0]["Value"]: alarm["Properties"]["Threshold"]
+        for alarm in alarms.values()
+    }
+    assert thresholds == {"silver": 240 * 60, "gold": 120 * 60}
+    # as cdk.json sets the context
+    from_json = synth_cache.synth(
+        account=ACCOUNTS[0],
+        region="ap-southeast-2",
+        context={"ipa-backup:telemetry": "true", "ipa-backup:job-duration-alarm-minutes": {"gold": 120}},
+        vault_classes=["silver", "gold"],
+    ).template
+    assert from_json.find_resources("AWS::CloudWatch::Alarm") == alarms
+    (function,) = template.find_resources("AWS::Lambda::Function").values()
+    vault_classes = json.dumps(function["Properties"]["Environment"]["Variables"]["VAULT_CLASSES"])
+    assert vault_classes.count('\\"silver\\"') == 1 and vault_classes.count('\\"gold\\"') == 1
+
+    # without the context there is no telemetry
+    quiet = synth_cache.synth(account=ACCOUNTS[0], region="ap-southeast-2", vault_classes=["silver"])
+    quiet.template.resource_count_is("AWS::Lambda::Function", 0)